@@ -0,0 +1,85 @@
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+
+from hyo2.soundspeed.db.db import ProjectDb
+from hyo2.soundspeed.profile.profilelist import ProfileList
+from hyo2.abc.lib.logging import set_logging
+
+ns_list = ["hyo2.soundspeed", "hyo2.soundspeedmanager", "hyo2.soundspeedsettings"]
+set_logging(ns_list=ns_list)
+
+logger = logging.getLogger(__name__)
+
+nr_casts = 50  # N synthetic casts ..
+nr_samples = 5000  # .. of M samples each
+
+
+def make_casts(n, m):
+    ssp = ProfileList()
+    t0 = datetime(2020, 1, 1)
+    depth = np.linspace(0.5, 1000.0, m)
+    for i in range(n):
+        ssp.append()
+        ssp.cur.meta.utc_time = t0 + timedelta(hours=i)
+        ssp.cur.meta.latitude = 43.0 + 0.01 * i
+        ssp.cur.meta.longitude = -70.0
+        for samples in [ssp.cur.init_data, ssp.cur.init_proc]:
+            samples(m)
+        for samples in [ssp.cur.data, ssp.cur.proc]:
+            samples.depth[:] = depth
+            samples.pressure[:] = np.round(depth * 1.01, 2)
+            samples.speed[:] = np.round(1500.0 - 0.01 * depth + np.sin(depth / 50.0), 2)
+            samples.temp[:] = np.round(20.0 - depth / 300.0, 3)
+            samples.sal[:] = 35.0
+    return ssp
+
+
+casts = make_casts(nr_casts, nr_samples)
+projects_folder = tempfile.mkdtemp()
+
+# row layout: one row per sample (as in the project db up to version 3)
+rows_path = os.path.join(projects_folder, "rows.db")
+conn = sqlite3.connect(rows_path)
+for table in ProjectDb.samples_tables:
+    conn.execute("CREATE TABLE %s(ssp_pk integer NOT NULL, pressure real, depth real NOT NULL, speed real, "
+                 "temperature real, conductivity real, salinity real, source int NOT NULL DEFAULT 0, "
+                 "flag int NOT NULL DEFAULT 0)" % table)
+start = time.perf_counter()
+with conn:
+    for pk, profile in enumerate(casts.l):
+        for table, samples in [('data', profile.data), ('proc', profile.proc)]:
+            columns = [getattr(samples, attribute) for _, attribute, _ in ProjectDb.blob_columns]
+            conn.executemany("INSERT INTO %s VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)" % table,
+                             zip([pk] * samples.num_samples, *[column.tolist() for column in columns]))
+rows_store = time.perf_counter() - start
+start = time.perf_counter()
+for pk in range(nr_casts):
+    for table in ['data', 'proc', 'sis']:
+        np.array(conn.execute("SELECT * FROM %s WHERE ssp_pk=?" % table, (pk,)).fetchall(), dtype=np.float64)
+rows_load = time.perf_counter() - start
+conn.close()
+
+# blob layout: one row of compressed BLOBs per cast
+db = ProjectDb(projects_folder=projects_folder, project_name="blobs")
+start = time.perf_counter()
+db.add_casts(casts)
+blobs_store = time.perf_counter() - start
+pks = [row[0] for row in db.conn.execute("SELECT id FROM ssp_pk").fetchall()]
+start = time.perf_counter()
+db.profiles_by_pks(pks)
+blobs_load = time.perf_counter() - start
+db.disconnect()
+
+logger.info("%d casts x %d samples" % (nr_casts, nr_samples))
+logger.info("rows: size %.1f MB, store %.3f s, load %.3f s"
+            % (os.path.getsize(rows_path) / 1024 ** 2, rows_store, rows_load))
+logger.info("blobs: size %.1f MB, store %.3f s, load %.3f s"
+            % (os.path.getsize(db.db_path) / 1024 ** 2, blobs_store, blobs_load))
+
+shutil.rmtree(projects_folder)
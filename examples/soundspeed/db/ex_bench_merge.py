@@ -0,0 +1,73 @@
+import time
+import shutil
+import tempfile
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+
+from hyo2.soundspeed.db.db import ProjectDb
+from hyo2.soundspeed.profile.profilelist import ProfileList
+from hyo2.abc.lib.logging import set_logging
+
+ns_list = ["hyo2.soundspeed", "hyo2.soundspeedmanager", "hyo2.soundspeedsettings"]
+set_logging(ns_list=ns_list)
+
+logger = logging.getLogger(__name__)
+
+nr_casts = 200  # N synthetic casts per project ..
+nr_samples = 2000  # .. of M samples each
+nr_shared = 50  # casts present in both the projects
+
+
+def make_casts(first, n, m):
+    ssp = ProfileList()
+    t0 = datetime(2020, 1, 1)
+    depth = np.linspace(0.5, 5000.0, m)
+    for i in range(first, first + n):
+        ssp.append()
+        ssp.cur.meta.utc_time = t0 + timedelta(hours=i)
+        ssp.cur.meta.latitude = 43.0 + 0.01 * i
+        ssp.cur.meta.longitude = -70.0
+        for samples in [ssp.cur.init_data, ssp.cur.init_proc]:
+            samples(m)
+        for samples in [ssp.cur.data, ssp.cur.proc]:
+            samples.depth[:] = depth
+            samples.pressure[:] = depth * 1.01
+            samples.speed[:] = 1500.0 - 0.01 * depth + np.sin(depth / 50.0)
+            samples.temp[:] = 20.0 - depth / 300.0
+            samples.sal[:] = 35.0
+    return ssp
+
+
+projects_folder = tempfile.mkdtemp()
+in_db = ProjectDb(projects_folder=projects_folder, project_name="input")
+in_db.add_casts(make_casts(0, nr_casts, nr_samples))
+in_db.disconnect()
+
+# merge by attaching the input db
+db = ProjectDb(projects_folder=projects_folder, project_name="merge")
+db.add_casts(make_casts(nr_casts - nr_shared, nr_casts, nr_samples))
+start = time.perf_counter()
+pk_issues, pk_done = db.merge_db(input_db_path=in_db.db_path)
+elapsed = time.perf_counter() - start
+nr_merged = 2 * len(pk_done) * nr_samples
+logger.info("merged: %d casts, skipped: %d" % (len(pk_done), len(pk_issues)))
+logger.info("merge time: %.3f s -> %.0f samples/s" % (elapsed, nr_merged / elapsed))
+db.disconnect()
+
+# cast-by-cast import, as reference
+in_db = ProjectDb(projects_folder=projects_folder, project_name="input")
+db = ProjectDb(projects_folder=projects_folder, project_name="by_cast")
+db.add_casts(make_casts(nr_casts - nr_shared, nr_casts, nr_samples))
+start = time.perf_counter()
+cur_keys = set([(row[1], str(row[2])) for row in db.list_profiles()])
+for row in in_db.list_profiles():
+    if (row[1], str(row[2])) in cur_keys:
+        continue
+    db.add_casts(in_db.profile_by_pk(pk=row[0]))
+elapsed = time.perf_counter() - start
+logger.info("cast-by-cast import time: %.3f s -> %.0f samples/s" % (elapsed, nr_merged / elapsed))
+db.disconnect()
+in_db.disconnect()
+
+shutil.rmtree(projects_folder)
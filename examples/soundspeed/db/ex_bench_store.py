@@ -0,0 +1,56 @@
+import os
+import time
+import shutil
+import tempfile
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+
+from hyo2.soundspeed.db.db import ProjectDb
+from hyo2.soundspeed.profile.profilelist import ProfileList
+from hyo2.abc.lib.logging import set_logging
+
+ns_list = ["hyo2.soundspeed", "hyo2.soundspeedmanager", "hyo2.soundspeedsettings"]
+set_logging(ns_list=ns_list)
+
+logger = logging.getLogger(__name__)
+
+nr_casts = 20  # N synthetic casts ..
+nr_samples = 30000  # .. of M samples each
+
+
+def make_casts(n, m):
+    ssp = ProfileList()
+    t0 = datetime(2020, 1, 1)
+    depth = np.linspace(0.5, 5000.0, m)
+    for i in range(n):
+        ssp.append()
+        ssp.cur.meta.utc_time = t0 + timedelta(hours=i)
+        ssp.cur.meta.latitude = 43.0 + 0.01 * i
+        ssp.cur.meta.longitude = -70.0
+        for samples in [ssp.cur.init_data, ssp.cur.init_proc]:
+            samples(m)
+        for samples in [ssp.cur.data, ssp.cur.proc]:
+            samples.depth[:] = depth
+            samples.pressure[:] = depth * 1.01
+            samples.speed[:] = 1500.0 - 0.01 * depth + np.sin(depth / 50.0)
+            samples.temp[:] = 20.0 - depth / 300.0
+            samples.sal[:] = 35.0
+    return ssp
+
+
+casts = make_casts(nr_casts, nr_samples)
+projects_folder = tempfile.mkdtemp()
+db = ProjectDb(projects_folder=projects_folder, project_name="bench")
+
+start = time.perf_counter()
+success = db.add_casts(casts)
+elapsed = time.perf_counter() - start
+
+nr_stored = 2 * nr_casts * nr_samples
+logger.info("stored %d casts x %d samples: %s" % (nr_casts, nr_samples, success))
+logger.info("store time: %.3f s -> %.0f samples/s" % (elapsed, nr_stored / elapsed))
+logger.info("db size: %.1f MB" % (os.path.getsize(db.db_path) / 1024 ** 2))
+
+db.disconnect()
+shutil.rmtree(projects_folder)
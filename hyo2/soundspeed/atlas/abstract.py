@@ -1,14 +1,92 @@
 from abc import ABCMeta, abstractmethod
 from datetime import datetime as dt, date
 import logging
-from typing import Optional, Union
+from typing import Optional, Sequence, Union
+
+import numpy as np
 
 from hyo2.soundspeed.base.geodesy import Geodesy
+from hyo2.soundspeed.profile.dicts import Dicts
+from hyo2.soundspeed.profile.profile import Profile
 from hyo2.soundspeed.profile.profilelist import ProfileList
 
 logger = logging.getLogger(__name__)
 
 
+class AtlasResults:
+    """Compact results of a batch atlas query
+
+    The profiles of each query (e.g., the mean, the min and the max) are stored as rows of NaN-padded
+    (queries, profiles, levels) arrays, with the number of valid samples of each profile in 'counts'.
+    The ProfileList of a query is only created when requested by index.
+    """
+
+    def __init__(self, atlas: 'AbstractAtlas', lats: np.ndarray, lons: np.ndarray, dtstamps: list,
+                 found: np.ndarray, counts: np.ndarray, depth: np.ndarray, temp: np.ndarray,
+                 sal: np.ndarray) -> None:
+        self.atlas = atlas
+        self.lats = lats
+        self.lons = lons
+        self.dtstamps = dtstamps
+        self.found = found  # False for the queries without results
+        self.counts = counts
+        self.depth = depth
+        self.temp = temp
+        self.sal = sal
+
+    @classmethod
+    def from_data(cls, atlas: 'AbstractAtlas', lats: np.ndarray, lons: np.ndarray, dtstamps: list,
+                  data: list) -> 'AtlasResults':
+        """Pack the results of the queries, each one None or a list of (depth, temp, sal) arrays"""
+        nr_profiles = max([len(item) for item in data if item is not None], default=1)
+        nr_levels = max([depth.size for item in data if item is not None for depth, _, _ in item], default=0)
+        dtype = np.float32
+        for item in data:
+            for prf in item or list():
+                for arr in prf:
+                    dtype = np.promote_types(dtype, arr.dtype)
+        shape = (len(data), nr_profiles, nr_levels)
+        depth = np.full(shape, np.nan, dtype=dtype)
+        temp = np.full(shape, np.nan, dtype=dtype)
+        sal = np.full(shape, np.nan, dtype=dtype)
+        counts = np.zeros(shape[:2], dtype=np.int64)
+        found = np.zeros(len(data), dtype=bool)
+        for i, item in enumerate(data):
+            if item is None:
+                continue
+            found[i] = True
+            for j, (prf_depth, prf_temp, prf_sal) in enumerate(item):
+                count = prf_depth.size
+                counts[i, j] = count
+                depth[i, j, :count] = prf_depth
+                temp[i, j, :count] = prf_temp
+                sal[i, j, :count] = prf_sal
+
+        return cls(atlas=atlas, lats=lats, lons=lons, dtstamps=dtstamps, found=found, counts=counts,
+                   depth=depth, temp=temp, sal=sal)
+
+    def __len__(self) -> int:
+        return self.found.size
+
+    def __getitem__(self, idx: int) -> Optional[ProfileList]:
+        """Create the ProfileList of the query at the passed index (None if without results)"""
+        if not self.found[idx]:
+            return None
+        data = [(self.depth[idx, j, :count], self.temp[idx, j, :count], self.sal[idx, j, :count])
+                for j, count in enumerate(self.counts[idx])]
+        return self.atlas.make_profiles(lat=float(self.lats[idx]), lon=float(self.lons[idx]),
+                                        dtstamp=self.dtstamps[idx], data=data)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __repr__(self) -> str:
+        msg = "  <AtlasResults>\n"
+        msg += "      <queries: %d, found: %d>\n" % (len(self), np.count_nonzero(self.found))
+        return msg
+
+
 class AbstractAtlas(metaclass=ABCMeta):
     """Common abstract atlas"""
 
@@ -18,6 +96,7 @@ class AbstractAtlas(metaclass=ABCMeta):
         self.data_folder = data_folder
         self.prj = prj
         self.g = Geodesy()
+        self.probe_name = None  # the key in Dicts.probe_types of the created profiles
 
     @abstractmethod
     def is_present(self) -> bool:
@@ -32,6 +111,124 @@ class AbstractAtlas(metaclass=ABCMeta):
     def download_db(self) -> bool:
         pass
 
+    def query_group(self, dtstamp: dt) -> object:
+        """Return the key of the grids used by a query at the passed time (by default, the day)"""
+        return dtstamp.date()
+
+    def query_many(self, lats: Sequence[Optional[float]], lons: Sequence[Optional[float]],
+                   dtstamps: Sequence[Optional[dt]], server_mode: bool = False) -> AtlasResults:
+        """Query the atlas for many positions and times at once
+
+        The queries are grouped by the grids that they need (see query_group), so each grid is read once.
+        """
+        lats = np.array([np.nan if lat is None else lat for lat in lats], dtype=np.float64)
+        lons = np.array([np.nan if lon is None else lon for lon in lons], dtype=np.float64)
+        dtstamps = [dt.utcnow() if dtstamp is None else dtstamp for dtstamp in dtstamps]
+        if (lats.size != lons.size) or (lats.size != len(dtstamps)):
+            raise RuntimeError("mismatching number of latitudes, longitudes and times: %d, %d, %d"
+                               % (lats.size, lons.size, len(dtstamps)))
+        for dtstamp in dtstamps:
+            if not isinstance(dtstamp, dt):
+                raise RuntimeError("invalid datetime passed: %s" % type(dtstamp))
+
+        data = [None] * lats.size
+        invalid = np.isnan(lats) | np.isnan(lons)
+        if invalid.any():
+            logger.error("skipping %d queries with invalid location" % np.count_nonzero(invalid))
+        groups = dict()
+        for idx in np.nonzero(~invalid)[0]:
+            groups.setdefault(self.query_group(dtstamps[idx]), list()).append(idx)
+        for key in sorted(groups):
+            idxs = np.array(groups[key])
+            results = self._query_group(lats=lats[idxs], lons=lons[idxs], dtstamps=[dtstamps[i] for i in idxs],
+                                        server_mode=server_mode)
+            for idx, result in zip(idxs, results):
+                data[idx] = result
+
+        return AtlasResults.from_data(atlas=self, lats=lats, lons=lons, dtstamps=dtstamps, data=data)
+
+    def _query_group(self, lats: np.ndarray, lons: np.ndarray, dtstamps: list, server_mode: bool = False) -> list:
+        """Query a group of positions that use the same grids, returning for each one None or
+        a list of (depth, temp, sal) arrays (one per profile)"""
+        results = list()
+        for lat, lon, dtstamp in zip(lats, lons, dtstamps):
+            # a failing query only drops its own result
+            # noinspection PyBroadException
+            try:
+                data = self._query_data(lat=float(lat), lon=float(lon), dtstamp=dtstamp, server_mode=server_mode)
+            except Exception as e:
+                logger.warning("unable to retrieve %s data: %s" % (self.name, e))
+                data = None
+            results.append(data)
+        return results
+
+    def _query_data(self, lat: float, lon: float, dtstamp: dt, server_mode: bool = False) -> Optional[list]:
+        """Query a single position, returning None or a list of (depth, temp, sal) arrays (one per profile)
+
+        By default, the arrays are taken from the profiles created by query. The atlases that override it
+        skip the creation of the profiles, which are only created when requested (see AtlasResults).
+        """
+        profiles = self.query(lat=lat, lon=lon, dtstamp=dtstamp, server_mode=server_mode)
+        if profiles is None:
+            return None
+        return [(np.array(ssp.data.depth), np.array(ssp.data.temp), np.array(ssp.data.sal)) for ssp in profiles.l]
+
+    def make_profiles(self, lat: float, lon: float, dtstamp: dt, data: list) -> ProfileList:
+        """Create the ProfileList of a query from a list of (depth, temp, sal) arrays
+
+        The first profile is the query result, the following ones (e.g., min and max) are skipped if empty.
+        """
+        if lon > 180.0:  # Go back to negative longitude
+            lon -= 360.0
+
+        profiles = ProfileList()
+        for i, (depth, temp, sal) in enumerate(data):
+            if (i > 0) and (depth.size == 0):
+                continue
+
+            ssp = Profile()
+            ssp.meta.sensor_type = Dicts.sensor_types['Synthetic']
+            ssp.meta.probe_type = Dicts.probe_types[self.probe_name]
+            ssp.meta.latitude = lat
+            ssp.meta.longitude = lon
+            ssp.meta.utc_time = dt(year=dtstamp.year, month=dtstamp.month, day=dtstamp.day,
+                                   hour=dtstamp.hour, minute=dtstamp.minute, second=dtstamp.second)
+            if i == 0:
+                ssp.meta.original_path = "%s_%s" % (self.probe_name, dtstamp.strftime("%Y%m%d_%H%M%S"))
+            ssp.init_data(depth.size)
+            ssp.data.depth = depth
+            ssp.data.temp = temp
+            ssp.data.sal = sal
+            ssp.calc_data_speed()
+            ssp.clone_data_to_proc()
+            ssp.init_sis()
+            profiles.append_profile(ssp)
+
+        profiles.current_index = 0
+        return profiles
+
+    def _closest_valid_levels(self, lat: float, lon: float, latitudes: np.ndarray, longitudes: np.ndarray,
+                              t: np.ndarray, s: np.ndarray) -> tuple:
+        """Return, for each depth level, the temperature and salinity of the closest node with valid values,
+        and if there is one
+
+        The t and s arrays are (levels, lat nodes, lon nodes) with NaN (or masked) invalid values, while
+        the node latitudes and longitudes are (lat nodes, lon nodes). The ties go to the first node.
+        """
+        nr_nodes = np.size(latitudes)
+        longitudes = np.asarray(np.ravel(longitudes), dtype=np.float64)
+        latitudes = np.asarray(np.ravel(latitudes), dtype=np.float64)
+        dist = np.asarray(self.g.distance(longitudes, latitudes, np.full(nr_nodes, lon), np.full(nr_nodes, lat)),
+                          dtype=np.float64)
+
+        t = np.ma.filled(t, np.nan).reshape(-1, nr_nodes)
+        s = np.ma.filled(s, np.nan).reshape(-1, nr_nodes)
+        masked_dist = np.where(np.isnan(t) | np.isnan(s), np.inf, dist)
+        levels = np.arange(t.shape[0])
+        nodes = masked_dist.argmin(axis=1)
+        found = np.isfinite(masked_dist[levels, nodes])
+        return t[levels, nodes], s[levels, nodes], found
+
     def __repr__(self) -> str:
         msg = "  <%s>\n" % self.__class__.__name__
         msg += "      <desc: %s>\n" % self.desc
@@ -1,9 +1,12 @@
+from collections import OrderedDict
 from datetime import datetime as dt
 import os
 from enum import IntEnum
 import logging
 from typing import Optional
+import numpy as np
 from netCDF4 import Dataset, num2date
+from scipy.spatial import cKDTree
 
 from hyo2.soundspeed.base.geodesy import Geodesy
 from hyo2.soundspeed.profile.dicts import Dicts
@@ -83,6 +86,10 @@ class RegOfsOffline:
         self._temp = None
         self._sal = None
 
+        # KD-trees of the model nodes, by file path and modification time (the least recently used are dropped)
+        self._trees = OrderedDict()
+        self.max_trees = 2
+
     def query(self, nc_path: str, lat: float, lon: float) -> Optional[ProfileList]:
         if not os.path.exists(nc_path):
             raise RuntimeError('Unable to locate %s' % nc_path)
@@ -93,17 +100,33 @@ class RegOfsOffline:
             return None
         logger.debug('query location: %s, %s' % (lat, lon))
 
+        return self.query_many(nc_path=nc_path, lats=[lat], lons=[lon])[0]
+
+    def query_many(self, nc_path: str, lats: list, lons: list) -> list:
+        """Query the closest model node of each passed position (e.g., along a transect) from a single file open
+
+        For each position, the result is None (if too far from the model nodes) or a profile list.
+        """
+        if not os.path.exists(nc_path):
+            raise RuntimeError('Unable to locate %s' % nc_path)
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        if lats.size != lons.size:
+            raise RuntimeError("mismatch in the number of latitudes and longitudes: %d, %d" % (lats.size, lons.size))
+
         progress = CliProgress()
 
+        self.clear_data()
         try:
             self._file = Dataset(nc_path)
+            self._has_data_loaded = True
             progress.update(20)
 
         except (RuntimeError, IOError) as e:
             logger.warning("unable to access data: %s" % e)
             self.clear_data()
             progress.end()
-            return None
+            return [None] * lats.size
 
         try:
             self.name = self._file.title
@@ -130,36 +153,86 @@ class RegOfsOffline:
             # logger.debug('temp:(%s)\n%s' % (self._temp.shape, self._temp[:, 0]))
             # logger.debug('sal:(%s)\n%s' % (self._sal.shape, self._sal[:, 0]))
 
+            dists, idxs = self.nearest_nodes(nc_path=nc_path, lats=lats, lons=lons)
+            progress.update(60)
+
         except Exception as e:
             logger.error("troubles in variable lookup for lat/long grid and/or depth: %s" % e)
             self.clear_data()
             progress.end()
-            return None
+            return [None] * lats.size
 
-        min_dist = 100000.0
-        min_idx = None
-        for idx, _ in enumerate(self._lats):
-            nc_lat = self._lats[idx]
-            nc_lon = self._lons[idx]
-            if nc_lon > 180.0:
-                nc_lon = nc_lon - 360.0
-            nc_dist = self.g.distance(nc_lon, nc_lat, lon, lat)
-            # logger.debug('loc: %.6f, %.6f -> %.6f' % (nc_lat, nc_lon, nc_dist))
-            if nc_dist < min_dist:
-                min_dist = nc_dist
-                min_idx = idx
-        if min_dist >= 10000.0:
-            logger.error("location too far from model nodes: %.f" % min_dist)
-            self.clear_data()
-            progress.end()
-            return None
+        results = list()
+        for dist, idx in zip(dists, idxs):
+            if dist >= 10000.0:
+                logger.error("location too far from model nodes: %.f" % dist)
+                results.append(None)
+                continue
+            results.append(self._make_profiles(loc_idx=int(idx), dist=dist))
 
-        self._loc_idx = min_idx
+        progress.end()
+        return results
+
+    def nearest_nodes(self, nc_path: str, lats: list, lons: list, k: int = 1) -> tuple:
+        """Return the geodesic distances and the indices of the k model nodes closest to the passed positions
+
+        The arrays are (positions, k), sorted by distance, or (positions, ) when k is 1.
+        """
+        tree, node_lats, node_lons = self._node_tree(nc_path=nc_path)
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+
+        # the closest nodes in ECEF are candidates, ranked by the geodesic distance
+        nr_candidates = min(k + 8, tree.n)
+        _, candidates = tree.query(np.column_stack(Geodesy.ecef(lons, lats)), k=nr_candidates)
+        candidates = candidates.reshape(lats.size, nr_candidates)
+        dists = np.asarray(self.g.distance(np.repeat(lons, nr_candidates), np.repeat(lats, nr_candidates),
+                                           node_lons[candidates.ravel()], node_lats[candidates.ravel()]),
+                           dtype=np.float64).reshape(candidates.shape)
+        order = np.argsort(dists, axis=1, kind='stable')[:, :k]
+        dists = np.take_along_axis(dists, order, axis=1)
+        idxs = np.take_along_axis(candidates, order, axis=1)
+        if k == 1:
+            return dists[:, 0], idxs[:, 0]
+        return dists, idxs
+
+    def _node_tree(self, nc_path: str) -> tuple:
+        """Return the KD-tree (on ECEF coordinates), the latitudes and the longitudes of the model nodes
+
+        The tree is built once per file, and rebuilt when the file is modified. Only the trees of the last
+        max_trees files are kept, since each new model run (or forecast hour) is a new file.
+        """
+        nc_path = os.path.abspath(nc_path)
+        key = (nc_path, os.path.getmtime(nc_path))
+        if key in self._trees:
+            self._trees.move_to_end(key)
+        else:
+            for old_key in [old_key for old_key in self._trees if old_key[0] == nc_path]:
+                del self._trees[old_key]
+            while len(self._trees) >= max(self.max_trees, 1):
+                self._trees.popitem(last=False)
+
+            if (self._file is not None) and (os.path.abspath(self._file.filepath()) == nc_path):
+                node_lats, node_lons = self._lats, self._lons
+            else:
+                with Dataset(nc_path) as ds:
+                    node_lats, node_lons = ds.variables['lat'][:], ds.variables['lon'][:]
+            node_lats = np.asarray(node_lats, dtype=np.float64)
+            node_lons = np.asarray(node_lons, dtype=np.float64)
+            node_lons = np.where(node_lons > 180.0, node_lons - 360.0, node_lons)
+            logger.debug("building the KD-tree of %d nodes" % node_lats.size)
+            self._trees[key] = (cKDTree(np.column_stack(Geodesy.ecef(node_lons, node_lats))), node_lats, node_lons)
+
+        return self._trees[key]
+
+    def _make_profiles(self, loc_idx: int, dist: float) -> ProfileList:
+        """Make the profile list for the passed model node"""
+        self._loc_idx = loc_idx
         self._lon = self._lons[self._loc_idx]
         if self._lon > 180.0:
             self._lon = self._lon - 360.0
         self._lat = self._lats[self._loc_idx]
-        logger.debug('closest node: %d [%s, %s] -> %s' % (self._loc_idx, self._lat, self._lon, min_dist))
+        logger.debug('closest node: %d [%s, %s] -> %s' % (self._loc_idx, self._lat, self._lon, dist))
 
         zeta = self._zeta[self._loc_idx]
         h = self._h[self._loc_idx]
@@ -188,8 +261,6 @@ class RegOfsOffline:
 
         profiles = ProfileList()
         profiles.append_profile(ssp)
-
-        progress.end()
         return profiles
 
     def clear_data(self) -> None:
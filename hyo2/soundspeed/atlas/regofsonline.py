@@ -12,9 +12,6 @@ import numpy as np
 from hyo2.abc.lib.progress.cli_progress import CliProgress
 
 from hyo2.soundspeed.atlas.abstract import AbstractAtlas
-from hyo2.soundspeed.profile.profile import Profile
-from hyo2.soundspeed.profile.profilelist import ProfileList
-from hyo2.soundspeed.profile.dicts import Dicts
 from hyo2.soundspeed.profile.oceanography import Oceanography as Oc
 
 logger = logging.getLogger(__name__)
@@ -69,6 +66,7 @@ class RegOfsOnline(AbstractAtlas):
         super().__init__(data_folder=data_folder, prj=prj)
         self.model = model
         self.name = model.name
+        self.probe_name = model.name
         self.desc = self.regofs_model_descs[model]
 
         # How far are we willing to look for solutions? size in grid nodes
@@ -135,9 +133,18 @@ class RegOfsOnline(AbstractAtlas):
     def query(self, lat: Optional[float], lon: Optional[float], dtstamp: Union[dt, None] = None,
               server_mode: bool = False):
         """Query OFS for passed location and timestamp"""
-        original_datestamp = dtstamp
         if dtstamp is None:
             dtstamp = dt.utcnow()
+        data = self._query_data(lat=lat, lon=lon, dtstamp=dtstamp, server_mode=server_mode)
+        if data is None:
+            return None
+
+        return self.make_profiles(lat=lat, lon=lon, dtstamp=dtstamp, data=data)
+
+    def _query_data(self, lat: Optional[float], lon: Optional[float], dtstamp: dt,
+                    server_mode: bool = False) -> Optional[list]:
+        """Query OFS for passed location and timestamp, returning the (depth, temp, sal) arrays"""
+        original_datestamp = dtstamp
         if not isinstance(dtstamp, dt):
             raise RuntimeError("invalid date passed: %s" % type(dtstamp))
         logger.debug("query: %s @ (%.6f, %.6f)" % (dtstamp, lon, lat))
@@ -198,102 +205,30 @@ class RegOfsOnline(AbstractAtlas):
             s._sharedmask = False
             s[s_mask] = np.nan
 
-        # Calculate distances from requested position to each of the grid node locations
-        distances = np.zeros((self._d.size, lon_search_window, lat_search_window))
-        # logger.debug('distances shape: %s' % (distances.shape,))
+        # Calculate distances from requested position to each of the grid node locations, and
+        # for each depth level keep the values of the closest node with valid values
         longitudes = self._lon[lat_s_idx:lat_n_idx + 1, lon_w_idx:lon_e_idx + 1]
         latitudes = self._lat[lat_s_idx:lat_n_idx + 1, lon_w_idx:lon_e_idx + 1]
+        t_closest, s_closest, found = self._closest_valid_levels(lat=lat, lon=lon, latitudes=latitudes,
+                                                                 longitudes=longitudes, t=t, s=s)
+        num_values = np.count_nonzero(found)
 
-        for i in range(lat_search_window):
-
-            for j in range(lon_search_window):
-                dist = self.g.distance(longitudes[i, j], latitudes[i, j], lon, lat)
-                distances[:, i, j] = dist
-                # logger.info("node (%s %s), pos: %3.2f, %3.2f, dist: %3.1f"
-                #             % (i, j, latitudes[i, j], longitudes[i, j], distances[0, i, j]))
-
-        # Get mask of "no data" elements and replace these with NaNs in distance array
-        t_mask = np.isnan(t)
-        distances[t_mask] = np.nan
-        s_mask = np.isnan(s)
-        distances[s_mask] = np.nan
-        # logger.info("distance array:\n%s" % distances[0])
+        if num_values == 0:
+            logger.info("no data from lookup!")
+            return None
 
-        # Spin through all the depth levels
+        # Calculate the in-situ temperatures of all the levels with valid values
         temp_pot = np.zeros(self._d.size)
         temp_in_situ = np.zeros(self._d.size)
         d = np.zeros(self._d.size)
         sal = np.zeros(self._d.size)
-        num_values = 0
-        for i in range(self._d.size):
-
-            t_level = t[i]
-            s_level = s[i]
-            d_level = distances[i]
-
-            try:
-                ind = np.nanargmin(d_level)
-            except ValueError:
-                # logger.info("%s: all-NaN slices" % i)
-                continue
-
-            if np.isnan(ind):
-                logger.info("%s: bottom of valid data" % i)
-                break
-
-            ind2 = np.unravel_index(ind, t_level.shape)
-
-            t_closest = t_level[ind2]
-            s_closest = s_level[ind2]
-            # d_closest = d_level[ind2]
-
-            temp_pot[i] = t_closest
-            sal[i] = s_closest
-            d[i] = self._d[i]
-
-            # Calculate in-situ temperature
-            p = Oc.d2p(d[i], lat)
-            temp_in_situ[i] = Oc.in_situ_temp(s=sal[i], t=t_closest, p=p, pr=self._ref_p)
-            # logger.info("%02d: %6.1f %6.1f > T/S/Dist: %3.1f %3.1f %3.1f [pot.temp. %3.1f]"
-            #             % (i, d[i], p, temp_in_situ[i], s_closest, d_closest, t_closest))
-
-            num_values += 1
-
-        if num_values == 0:
-            logger.info("no data from lookup!")
-            return None
+        temp_pot[found] = t_closest[found]
+        sal[found] = s_closest[found]
+        d[found] = self._d[found]
+        p = Oc.d2p(d[found], lat)
+        temp_in_situ[found] = Oc.in_situ_temp(s=sal[found], t=temp_pot[found], p=p, pr=self._ref_p)
 
-        # ind = np.nanargmin(distances[0])
-        # ind2 = np.unravel_index(ind, distances[0].shape)
-        # switching to the query location
-        # lat_out = latitudes[ind2]
-        # lon_out = longitudes[ind2]
-        # while lon_out > 180.0:
-        #     lon_out -= 360.0
-
-        # Make a new SV object to return our query in
-        ssp = Profile()
-        ssp.meta.sensor_type = Dicts.sensor_types['Synthetic']
-        ssp.meta.probe_type = Dicts.probe_types[self.name]
-        ssp.meta.latitude = lat
-        if lon > 180.0:  # Go back to negative longitude
-            lon -= 360.0
-        ssp.meta.longitude = lon
-        ssp.meta.utc_time = dt(year=dtstamp.year, month=dtstamp.month, day=dtstamp.day,
-                               hour=dtstamp.hour, minute=dtstamp.minute, second=dtstamp.second)
-        ssp.meta.original_path = "%s_%s" % (self.name, dtstamp.strftime("%Y%m%d_%H%M%S"))
-        ssp.init_data(num_values)
-        ssp.data.depth = d[0:num_values]
-        ssp.data.temp = temp_in_situ[0:num_values]
-        ssp.data.sal = sal[0:num_values]
-        ssp.calc_data_speed()
-        ssp.clone_data_to_proc()
-        ssp.init_sis()
-
-        profiles = ProfileList()
-        profiles.append_profile(ssp)
-
-        return profiles
+        return [(d[0:num_values], temp_in_situ[0:num_values], sal[0:num_values])]
 
     def clear_data(self) -> None:
         """Delete the data and reset the last loaded day"""
@@ -9,9 +9,6 @@ import requests
 from hyo2.abc.lib.progress.cli_progress import CliProgress
 
 from hyo2.soundspeed.atlas.abstract import AbstractAtlas
-from hyo2.soundspeed.profile.profile import Profile
-from hyo2.soundspeed.profile.profilelist import ProfileList
-from hyo2.soundspeed.profile.dicts import Dicts
 from hyo2.soundspeed.profile.oceanography import Oceanography as Oc
 
 logger = logging.getLogger(__name__)
@@ -23,6 +20,7 @@ class Rtofs(AbstractAtlas):
     def __init__(self, data_folder: str, prj: 'hyo2.soundspeed.soundspeed import SoundSpeedLibrary') -> None:
         super(Rtofs, self).__init__(data_folder=data_folder, prj=prj)
         self.name = self.__class__.__name__
+        self.probe_name = 'RTOFS'
         self.desc = "Global Real-Time Ocean Forecast System"
 
         # How far are we willing to look for solutions? size in grid nodes
@@ -87,6 +85,15 @@ class Rtofs(AbstractAtlas):
         """Query RTOFS for passed location and timestamp"""
         if dtstamp is None:
             dtstamp = dt.utcnow()
+        data = self._query_data(lat=lat, lon=lon, dtstamp=dtstamp, server_mode=server_mode)
+        if data is None:
+            return None
+
+        return self.make_profiles(lat=lat, lon=lon, dtstamp=dtstamp, data=data)
+
+    def _query_data(self, lat: Optional[float], lon: Optional[float], dtstamp: dt,
+                    server_mode: bool = False) -> Optional[list]:
+        """Query RTOFS for passed location and timestamp, returning the (depth, temp, sal) arrays"""
         if not isinstance(dtstamp, dt):
             raise RuntimeError("invalid datetime passed: %s" % type(dtstamp))
         logger.debug("query: %s @ (%.6f, %.6f)" % (dtstamp, lon, lat))
@@ -190,102 +197,30 @@ class Rtofs(AbstractAtlas):
             s[:, :, 0:lons_left.size] = s_left
             s[:, :, lons_left.size:self._search_window] = s_right
 
-        # Calculate distances from requested position to each of the grid node locations
-        distances = np.zeros((self._d.size, self._search_window, self._search_window))
-        latitudes = np.zeros((self._search_window, self._search_window))
+        # Calculate distances from requested position to each of the grid node locations, and
+        # for each depth level keep the values of the closest node with valid values
         lats = self._lat[lat_s_idx:lat_n_idx + 1]
-        for i in range(self._search_window):
-            latitudes[:, i] = lats
-
-        for i in range(self._search_window):
-
-            for j in range(self._search_window):
-                dist = self.g.distance(longitudes[i, j], latitudes[i, j], lon, lat)
-                distances[:, i, j] = dist
-                # logger.info("node %s, pos: %3.1f, %3.1f, dist: %3.1f"
-                #             % (i, latitudes[i, j], longitudes[i, j], distances[0, i, j]))
-        # logger.info("distance array:\n%s" % distances[0])
-        # Get mask of "no data" elements and replace these with NaNs in distance array
-        t_mask = np.isnan(t)
-        distances[t_mask] = np.nan
-        s_mask = np.isnan(s)
-        distances[s_mask] = np.nan
-
-        # Spin through all the depth levels
-        temp_pot = np.zeros(self._d.size)
-        temp_in_situ = np.zeros(self._d.size)
-        d = np.zeros(self._d.size)
-        sal = np.zeros(self._d.size)
-        num_values = 0
-        for i in range(self._d.size):
-
-            t_level = t[i]
-            s_level = s[i]
-            d_level = distances[i]
-
-            try:
-                ind = np.nanargmin(d_level)
-            except ValueError:
-                # logger.info("%s: all-NaN slices" % i)
-                continue
-
-            if np.isnan(ind):
-                logger.info("%s: bottom of valid data" % i)
-                break
-
-            ind2 = np.unravel_index(ind, t_level.shape)
-
-            t_closest = t_level[ind2]
-            s_closest = s_level[ind2]
-            # d_closest = d_level[ind2]
-
-            temp_pot[i] = t_closest
-            sal[i] = s_closest
-            d[i] = self._d[i]
-
-            # Calculate in-situ temperature
-            p = Oc.d2p(d[i], lat)
-            temp_in_situ[i] = Oc.in_situ_temp(s=sal[i], t=t_closest, p=p, pr=self._ref_p)
-            # logger.info("%02d: %6.1f %6.1f > T/S/Dist: %3.1f %3.1f %3.1f [pot.temp. %3.1f]"
-            #             % (i, d[i], p, temp_in_situ[i], s_closest, d_closest, t_closest))
-
-            num_values += 1
+        latitudes = np.repeat(lats[:, np.newaxis], self._search_window, axis=1)
+        t_closest, s_closest, found = self._closest_valid_levels(lat=lat, lon=lon, latitudes=latitudes,
+                                                                 longitudes=longitudes, t=t, s=s)
+        num_values = np.count_nonzero(found)
 
         if num_values == 0:
             logger.info("no data from lookup!")
             return None
 
-        # ind = np.nanargmin(distances[0])
-        # ind2 = np.unravel_index(ind, distances[0].shape)
-        # switching to the query location
-        # lat_out = latitudes[ind2]
-        # lon_out = longitudes[ind2]
-        # while lon_out > 180.0:
-        #     lon_out -= 360.0
-
-        # Make a new SV object to return our query in
-        ssp = Profile()
-        ssp.meta.sensor_type = Dicts.sensor_types['Synthetic']
-        ssp.meta.probe_type = Dicts.probe_types['RTOFS']
-        ssp.meta.latitude = lat
-        if lon > 180.0:  # Go back to negative longitude
-            lon -= 360.0
-        ssp.meta.longitude = lon
-        ssp.meta.utc_time = dt(year=dtstamp.year, month=dtstamp.month, day=dtstamp.day,
-                               hour=dtstamp.hour, minute=dtstamp.minute, second=dtstamp.second)
-        ssp.meta.original_path = "RTOFS_%s" % dtstamp.strftime("%Y%m%d_%H%M%S")
-        ssp.init_data(num_values)
-        ssp.data.depth = d[0:num_values]
-        ssp.data.temp = temp_in_situ[0:num_values]
-        ssp.data.sal = sal[0:num_values]
-        ssp.calc_data_speed()
-        ssp.clone_data_to_proc()
-        ssp.init_sis()
-
-        profiles = ProfileList()
-        profiles.append_profile(ssp)
-
-        return profiles
+        # Calculate the in-situ temperatures of all the levels with valid values
+        temp_pot = np.zeros(self._d.size)
+        temp_in_situ = np.zeros(self._d.size)
+        d = np.zeros(self._d.size)
+        sal = np.zeros(self._d.size)
+        temp_pot[found] = t_closest[found]
+        sal[found] = s_closest[found]
+        d[found] = self._d[found]
+        p = Oc.d2p(d[found], lat)
+        temp_in_situ[found] = Oc.in_situ_temp(s=sal[found], t=temp_pot[found], p=p, pr=self._ref_p)
+
+        return [(d[0:num_values], temp_in_situ[0:num_values], sal[0:num_values])]
 
     def clear_data(self) -> None:
         """Delete the data and reset the last loaded day"""
@@ -22,6 +22,7 @@ class Woa09(AbstractAtlas):
     def __init__(self, data_folder: str, prj: 'hyo2.soundspeed.soundspeed import SoundSpeedLibrary') -> None:
         super(Woa09, self).__init__(data_folder=data_folder, prj=prj)
         self.name = self.__class__.__name__
+        self.probe_name = 'WOA09'
         self.desc = "World Ocean Atlas 2009"
         self.has_data_loaded = False
         self.search_radius = 2  # How far are we willing to look for solutions?
@@ -120,11 +121,9 @@ class Woa09(AbstractAtlas):
     def get_depth(self, lat: float, lon: float) -> float:
         """This helper method retrieve the max valid depth based on location"""
         lat_idx, lon_idx = self.grid_coords(lat, lon)
-        t_profile = self.t_annual.variables['t_an'][0, :, lat_idx, lon_idx]
-        index = 0
-        for sample in range(t_profile.size):
-            if t_profile[sample] != 9.96921E36:  # null value
-                index = sample
+        t_profile = np.ma.asarray(self.t_annual.variables['t_an'][0, :, lat_idx, lon_idx])
+        valid = np.nonzero(~np.ma.getmaskarray(t_profile))[0]  # the null values are masked
+        index = valid[-1] if valid.size > 0 else 0
         return self.t_annual.variables['depth'][index]
 
     def calc_month_idx(self, jday: int) -> None:
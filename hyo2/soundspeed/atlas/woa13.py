@@ -4,14 +4,11 @@ import numpy as np
 from netCDF4 import Dataset
 import logging
 from datetime import datetime as dt
-from typing import Union
+from typing import Optional, Union
 
 from hyo2.abc.lib.ftp import Ftp
 
 from hyo2.soundspeed.atlas.abstract import AbstractAtlas
-from hyo2.soundspeed.profile.profile import Profile
-from hyo2.soundspeed.profile.profilelist import ProfileList
-from hyo2.soundspeed.profile.dicts import Dicts
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +19,7 @@ class Woa13(AbstractAtlas):
     def __init__(self, data_folder: str, prj: 'hyo2.soundspeed.soundspeed import SoundSpeedLibrary') -> None:
         super(Woa13, self).__init__(data_folder=data_folder, prj=prj)
         self.name = self.__class__.__name__
+        self.probe_name = 'WOA13'
         self.desc = "World Ocean Atlas 2013 v2"
         self.has_data_loaded = False
         self.search_radius = 2  # How far are we willing to look for solutions?
@@ -36,9 +34,20 @@ class Woa13(AbstractAtlas):
         self.lon_step = 0.25
         self.num_levels = None
 
+        # per grid cell: the number of valid levels
+        self.nr_valid_levels = None
+
         self.month_idx = 0
         self.season_idx = 0
 
+        # optional mode: the needed month and season grids are loaded once as memory-mapped arrays.
+        # The first query of a month converts the 8 needed variables in full to float32 .npy files
+        # (about 2.6 GB on the 0.25 deg grid, and up to about 18 GB once all the months are queried),
+        # stored in the cache folder (by default, next to the atlas files). See purge_cache.
+        self.in_memory = False
+        self.cache_folder = None
+        self._grids = dict()
+
     def is_present(self) -> bool:
         """Check the presence of one of the db file
 
@@ -104,6 +113,8 @@ class Woa13(AbstractAtlas):
 
             self.lat = self.t[12].variables['lat'][:]
             self.lon = self.t[12].variables['lon'][:]
+            self.lat_step = float(self.lat[1] - self.lat[0])
+            self.lon_step = float(self.lon[1] - self.lon[0])
             # self.lon = np.hstack((lon[lon.size // 2:], lon[:lon.size // 2]))
             csv_iter = csv.reader(open((os.path.join(self.data_folder, "landsea_04.msk"))))
             next(csv_iter)  # skip firs header row
@@ -128,15 +139,74 @@ class Woa13(AbstractAtlas):
         return True
 
     def get_depth(self, lat: float, lon: float) -> float:
-        """This helper method retrieve the max valid depth based on location"""
+        """This helper method retrieve the max valid depth based on location (in the January monthly grid)"""
         lat_idx, lon_idx = self.grid_coords(lat, lon)
-        t_profile = self.t[0].variables['t_an'][0, :, lat_idx, lon_idx]
-        index = 0
-        for sample in range(t_profile.size):
-            if t_profile[sample] != 9.96921E36:  # null value
-                index = sample
+        if not self.load_ocean_index():
+            raise RuntimeError('troubles in ocean index load')
+        index = max(int(self.nr_valid_levels[lat_idx, lon_idx]) - 1, 0)
         return self.t[0].variables['depth'][index]
 
+    def load_ocean_index(self) -> bool:
+        """Load the ocean index of the grid cells
+
+        The index is stored in a .npz file next to the atlas files, and rebuilt when older than them.
+        If the file cannot be stored (e.g., read-only atlas folder), the index is only kept in memory.
+        """
+        if self.nr_valid_levels is not None:
+            return True
+
+        if not self.has_data_loaded:
+            if not self.load_grids():
+                return False
+
+        index_path = os.path.join(self.data_folder, "woa13_ocean_index.npz")
+        src_paths = [os.path.join(self.data_folder, "landsea_04.msk"), self.t[0].filepath()]
+        try:
+            if os.path.exists(index_path) and \
+                    (os.path.getmtime(index_path) >= max([os.path.getmtime(path) for path in src_paths])):
+                with np.load(index_path) as npz:
+                    self.nr_valid_levels = npz['nr_valid_levels']
+                return True
+
+        except Exception as e:
+            logger.warning("unable to load the stored ocean index: %s" % e)
+
+        try:
+            logger.info("building the ocean index")
+            index = self._build_ocean_index()
+
+        except Exception as e:
+            logger.error("unable to build the ocean index: %s" % e)
+            return False
+
+        try:
+            tmp_path = os.path.join(self.data_folder, "woa13_ocean_index.tmp.npz")
+            np.savez(tmp_path, **index)
+            os.replace(tmp_path, index_path)
+
+        except Exception as e:
+            logger.warning("unable to store the ocean index: %s" % e)
+
+        self.nr_valid_levels = index['nr_valid_levels']
+        return True
+
+    def _build_ocean_index(self) -> dict:
+        """Calculate the number of valid levels of each grid cell
+
+        The levels are counted in the January temperature grid (t01, with the monthly levels only), the one
+        used by get_depth since its first version.
+        """
+        var = self.t[0].variables['t_an']
+        _, nr_levels, nr_lats, nr_lons = var.shape
+        nr_valid_levels = np.zeros((nr_lats, nr_lons), dtype=np.int16)
+        step = 32  # latitude rows per read
+        for i in range(0, nr_lats, step):
+            valid = ~np.ma.getmaskarray(np.ma.asarray(var[0, :, i:i + step, :]))
+            last_valid = nr_levels - np.argmax(valid[::-1], axis=0)
+            nr_valid_levels[i:i + step] = np.where(valid.any(axis=0), last_valid, 0)
+
+        return {'nr_valid_levels': nr_valid_levels}
+
     def calc_indices(self, month: int) -> None:
         """Calculate the month index based on the julian day"""
         self.month_idx = month - 1
@@ -158,11 +228,22 @@ class Woa13(AbstractAtlas):
             if not self.load_grids():
                 raise RuntimeError('troubles in db load')
 
-        lat_idx = np.abs((self.lat - lat)).argmin()
-        lon_idx = np.abs((self.lon - lon)).argmin()
+        lat_idxs, lon_idxs = self._grid_indices(lats=np.array([lat]), lons=np.array([lon]))
+        lat_idx, lon_idx = int(lat_idxs[0]), int(lon_idxs[0])
         logger.debug("grid coords: %s %s" % (lat_idx, lon_idx))
         return lat_idx, lon_idx
 
+    def _grid_indices(self, lats: np.ndarray, lons: np.ndarray) -> tuple:
+        """Return the indices of the grid nodes nearest to the passed positions
+
+        The grid is regular, so the indices are calculated (the ties go to the lower index).
+        """
+        lat_idxs = np.ceil((lats - float(self.lat[0])) / self.lat_step - 0.5).astype(np.int64)
+        lat_idxs = np.clip(lat_idxs, 0, self.lat.size - 1)
+        lon_pos = ((lons - float(self.lon[0])) / self.lon_step) % self.lon.size  # the longitudes wrap around
+        lon_idxs = np.ceil(lon_pos - 0.5).astype(np.int64) % self.lon.size
+        return lat_idxs, lon_idxs
+
     def query(self, lat: float, lon: float, dtstamp: Union[dt, None] = None, server_mode: bool = False):
         """Query WOA13 for passed location and timestamp"""
         if dtstamp is None:
@@ -183,196 +264,216 @@ class Woa13(AbstractAtlas):
 
         self.calc_indices(month=dtstamp.month)
 
-        # Find the nearest grid node
-        lat_base_idx, lon_base_idx = self.grid_coords(lat=lat, lon=lon)
-        lat_offsets = range(lat_base_idx - self.search_radius, lat_base_idx + self.search_radius + 1)
-        lon_offsets = range(lon_base_idx - self.search_radius, lon_base_idx + self.search_radius + 1)
-
-        # Search nodes surrounding the requested position to find the closest non-land
-        t = np.zeros(self.num_levels)
-        s = np.zeros(self.num_levels)
-        t_min = np.zeros(self.num_levels)
-        s_min = np.zeros(self.num_levels)
-        t_max = np.zeros(self.num_levels)
-        s_max = np.zeros(self.num_levels)
-        dist_arr = np.zeros(self.num_levels)
-        dist_t_sd = np.zeros(self.num_levels)
-        dist_s_sd = np.zeros(self.num_levels)
-        dist_arr[:] = 99999999
-        dist_t_sd[:] = 99999999
-        dist_s_sd[:] = 99999999
-        min_dist = 999999999
-        num_visited = 0
-        # These keep track of the closest node found, this will also
-        # be used to populate lat/lon of the cast to be delivered
-        lat_idx = -1
-        lon_idx = -1
-        for this_lat_index in lat_offsets:
-            for this_lon_index in lon_offsets:
-
-                if this_lon_index >= self.lon.size:
-                    # logger.debug("[%s] >= [%s]" % (this_lon_index, self.t[self.month_idx].variables['lon'].size))
-                    this_lon_index -= self.lat.size
-
-                # Check to see if we're at sea or on land
-                if self.landsea[this_lat_index][this_lon_index] == 1:
-                    # logger.debug("at land: %s, %s" % (this_lat_index, this_lon_index))
-                    # from matplotlib import pyplot
-                    # pyplot.imshow(self.landsea, origin='lower')
-                    # pyplot.scatter([this_lon_index], [this_lat_index], c='r', s=40)
-                    # pyplot.show()
-
-                    continue
-
-                # calculate the distance to the grid node
-                dist = self.g.distance(lon, lat, self.lon[this_lon_index], self.lat[this_lat_index])
-                # logger.debug("[%s %s] [%s %s]" % (self.lon.shape, self.lat.shape, this_lon_index, this_lat_index))
-                # logger.debug("dist: %s" % dist)
-
-                # Keep track of the closest valid grid node to report the pseudo-cast position
-                if dist < min_dist:
-                    min_dist = dist
-                    lat_idx = this_lat_index
-                    lon_idx = this_lon_index
-
-                # Extract monthly temperature and salinity profile for this location
-                t_profile = self.t[self.month_idx].variables['t_an'][0, :, this_lat_index, this_lon_index]
-                s_profile = self.s[self.month_idx].variables['s_an'][0, :, this_lat_index, this_lon_index]
-                # Extract seasonal temperature and salinity profile for this location
-                t_profile2 = self.t[self.season_idx].variables['t_an'][0, :, this_lat_index, this_lon_index]
-                s_profile2 = self.s[self.season_idx].variables['s_an'][0, :, this_lat_index, this_lon_index]
-
-                # Now do the same for the standard deviation profiles
-                t_sd_profile = self.t[self.month_idx].variables['t_sd'][0, :, this_lat_index, this_lon_index]
-                s_sd_profile = self.s[self.month_idx].variables['s_sd'][0, :, this_lat_index, this_lon_index]
-                t_sd_profile2 = self.t[self.season_idx].variables['t_sd'][0, :, this_lat_index, this_lon_index]
-                s_sd_profile2 = self.s[self.season_idx].variables['s_sd'][0, :, this_lat_index, this_lon_index]
-
-                # Overwrite the top of the seasonal profiles with the monthly profiles
-                t_profile2[0:t_profile.size] = t_profile
-                s_profile2[0:s_profile.size] = s_profile
-                t_sd_profile2[0:t_sd_profile.size] = t_sd_profile
-                s_sd_profile2[0:s_sd_profile.size] = s_sd_profile
-
-                # For each element in the profile, only keep those whose distance is closer than values
-                # found from previous iterations (maintain the closest value at each depth level)
-                # logger.debug("profile sz: %d\n%s" % (t_profile2.size, t_profile2))
-                for i in range(t_profile2.size):
-                    if dist >= dist_arr[i]:
-                        continue
-                    if (t_profile2[i] < 50.0) and (s_profile2[i] < 500.0) and (s_profile2[i] >= 0):
-                        t[i] = t_profile2[i]
-                        s[i] = s_profile2[i]
-                        dist_arr[i] = dist
-
-                # Now do the same thing for the temperature standard deviations
-                for i in range(t_sd_profile2.size):
-                    if dist >= dist_t_sd[i]:
-                        continue
-                    if (t_sd_profile2[i] < 50.0) and (t_sd_profile2[i] > -2):
-                        t_min[i] = t_profile2[i] - t_sd_profile2[i]
-                        if t_min[i] < -2.0:  # can't have overly cold water
-                            t_min[i] = -2.0
-                        t_max[i] = t_profile2[i] + t_sd_profile2[i]
-                        dist_t_sd[i] = dist
-
-                # Now do the same thing for the salinity standard deviations
-                for i in range(s_sd_profile2.size):
-                    if dist >= dist_s_sd[i]:
-                        continue
-                    if (s_sd_profile2[i] < 500.0) and (s_sd_profile2[i] >= 0):
-                        s_min[i] = s_profile2[i] - s_sd_profile2[i]
-                        if s_min[i] < 0:  # Can't have a negative salinity
-                            s_min[i] = 0
-                        s_max[i] = s_profile2[i] + s_sd_profile2[i]
-                        dist_s_sd[i] = dist
-
-                num_visited += 1
-
-        if (lat_idx == -1) and (lon_idx == -1):
+        data = self._query_nodes(lats=np.array([lat]), lons=np.array([lon]), in_memory=self.in_memory)[0]
+        if data is None:
             logger.info("possible request on land")
             return None
 
-        valid = dist_arr != 99999999
-        num_values = t[valid].size
-        logger.debug("valid: %s" % num_values)
-
-        if lon > 180.0:  # Go back to negative longitude
-            lon -= 360.0
-
-        # populate output profiles
-        ssp = Profile()
-        ssp.meta.sensor_type = Dicts.sensor_types['Synthetic']
-        ssp.meta.probe_type = Dicts.probe_types['WOA13']
-        ssp.meta.latitude = lat
-        ssp.meta.longitude = lon
-        ssp.meta.utc_time = dt(year=dtstamp.year, month=dtstamp.month, day=dtstamp.day,
-                               hour=dtstamp.hour, minute=dtstamp.minute, second=dtstamp.second)
-        ssp.init_data(num_values)
-        ssp.data.depth = self.t[self.season_idx].variables['depth'][0:num_values]
-        ssp.data.temp = t[valid]
-        ssp.data.sal = s[valid]
-        ssp.calc_data_speed()
-        ssp.clone_data_to_proc()
-        ssp.init_sis()
-
-        # - min/max
-        # Isolate realistic values
-        for i in range(t_min.size):
-
-            if dist_t_sd[i] == 99999999 or dist_s_sd[i] == 99999999:
-                num_values = i
-                break
-
-        # -- min
-        ssp_min = Profile()
-        ssp_min.meta.sensor_type = Dicts.sensor_types['Synthetic']
-        ssp_min.meta.probe_type = Dicts.probe_types['WOA13']
-        ssp_min.meta.latitude = lat
-        ssp_min.meta.longitude = lon
-        ssp_min.meta.utc_time = dt(year=dtstamp.year, month=dtstamp.month, day=dtstamp.day,
-                                   hour=dtstamp.hour, minute=dtstamp.minute, second=dtstamp.second)
-        if num_values > 0:
-            ssp_min.init_data(num_values)
-            ssp_min.data.depth = self.t[self.season_idx].variables['depth'][0:num_values]
-            ssp_min.data.temp = t_min[valid][0:num_values]
-            ssp_min.data.sal = s_min[valid][0:num_values]
-            ssp_min.calc_data_speed()
-            ssp_min.clone_data_to_proc()
-            ssp_min.init_sis()
-        else:
-            ssp_min = None
-        # -- max
-        ssp_max = Profile()
-        ssp_max.meta.sensor_type = Dicts.sensor_types['Synthetic']
-        ssp_max.meta.probe_type = Dicts.probe_types['WOA13']
-        ssp_max.meta.latitude = lat
-        ssp_max.meta.longitude = lon
-        ssp_max.meta.utc_time = dt(year=dtstamp.year, month=dtstamp.month, day=dtstamp.day,
-                                   hour=dtstamp.hour, minute=dtstamp.minute, second=dtstamp.second)
-        ssp.meta.original_path = "WOA13_%s" % dtstamp.strftime("%Y%m%d_%H%M%S")
-        if num_values > 0:
-            ssp_max.init_data(num_values)
-            ssp_max.data.depth = self.t[self.season_idx].variables['depth'][0:num_values].astype(np.float64)
-            ssp_max.data.temp = t_max[valid][0:num_values]
-            ssp_max.data.sal = s_max[valid][0:num_values]
-            ssp_max.calc_data_speed()
-            ssp_max.clone_data_to_proc()
-            ssp_max.init_sis()
-        else:
-            ssp_max = None
+        # logger.debug("retrieved: %s" % profiles)
 
-        profiles = ProfileList()
-        profiles.append_profile(ssp)
-        if ssp_min:
-            profiles.append_profile(ssp_min)
-        if ssp_max:
-            profiles.append_profile(ssp_max)
-        profiles.current_index = 0
+        return self.make_profiles(lat=lat, lon=lon, dtstamp=dtstamp, data=data)
 
-        # logger.debug("retrieved: %s" % profiles)
+    def query_group(self, dtstamp: dt) -> int:
+        """Return the key of the grids used by a query at the passed time (the month)"""
+        return dtstamp.month
 
-        return profiles
+    def _query_group(self, lats: np.ndarray, lons: np.ndarray, dtstamps: list, server_mode: bool = False) -> list:
+        """Query a group of positions in the same month"""
+        if not self.has_data_loaded:
+            if not self.load_grids():
+                logger.error("No data")
+                return [None] * lats.size
+
+        self.calc_indices(month=dtstamps[0].month)
+
+        results = list()
+        step = 1024  # positions per pass, to bound the memory use
+        for i in range(0, lats.size, step):
+            results.extend(self._query_nodes(lats=lats[i:i + step], lons=lons[i:i + step],
+                                             in_memory=self.in_memory))
+        return results
+
+    def _query_nodes(self, lats: np.ndarray, lons: np.ndarray, in_memory: bool) -> list:
+        """Retrieve the profiles at the passed positions for the current month and season indices
+
+        For each depth level, the values of the closest node (in the search window) with valid values are used.
+        For each position, the result is None (if on land) or a list of (depth, temp, sal) arrays for
+        the mean, the min and the max profiles.
+        """
+        # Search nodes surrounding the requested positions to find the closest non-land
+        lat_idxs, lon_idxs, sea = self._search_windows(lats=lats, lons=lons)
+        dist = np.asarray(self.g.distance(np.repeat(lons, lat_idxs.shape[1]), np.repeat(lats, lat_idxs.shape[1]),
+                                          np.asarray(self.lon)[lon_idxs.ravel()],
+                                          np.asarray(self.lat)[lat_idxs.ravel()]), dtype=np.float64)
+        dist = np.where(sea, dist.reshape(lat_idxs.shape), np.inf)
+
+        # Extract the seasonal profiles, with the top overwritten by the monthly profiles
+        profiles = dict()
+        for name in ['t_an', 's_an', 't_sd', 's_sd']:
+            profiles[name] = self._read_nodes(file_idx=self.season_idx, name=name, lat_idxs=lat_idxs,
+                                              lon_idxs=lon_idxs, in_memory=in_memory)
+            monthly = self._read_nodes(file_idx=self.month_idx, name=name, lat_idxs=lat_idxs, lon_idxs=lon_idxs,
+                                       in_memory=in_memory)
+            profiles[name][..., :monthly.shape[-1]] = monthly
+        t_profiles = profiles['t_an']
+        s_profiles = profiles['s_an']
+        t_sd_profiles = profiles['t_sd']
+        s_sd_profiles = profiles['s_sd']
+
+        # For each depth level, only keep the values of the closest node with valid values
+        nodes, valid = self._nearest_valid(dist=dist, valid=(t_profiles < 50.0) & (s_profiles < 500.0)
+                                           & (s_profiles >= 0))
+        t = self._pick(t_profiles, nodes)
+        s = self._pick(s_profiles, nodes)
+
+        # Now do the same thing for the temperature standard deviations
+        nodes, valid_t_sd = self._nearest_valid(dist=dist, valid=(t_sd_profiles < 50.0) & (t_sd_profiles > -2))
+        t_sd = self._pick(t_sd_profiles, nodes)
+        t_min = np.where(valid_t_sd, np.maximum(self._pick(t_profiles, nodes) - t_sd, -2.0), 0)  # overly cold water
+        t_max = np.where(valid_t_sd, self._pick(t_profiles, nodes) + t_sd, 0)
+
+        # Now do the same thing for the salinity standard deviations
+        nodes, valid_s_sd = self._nearest_valid(dist=dist, valid=(s_sd_profiles < 500.0) & (s_sd_profiles >= 0))
+        s_sd = self._pick(s_sd_profiles, nodes)
+        s_min = np.where(valid_s_sd, np.maximum(self._pick(s_profiles, nodes) - s_sd, 0), 0)  # negative salinity
+        s_max = np.where(valid_s_sd, self._pick(s_profiles, nodes) + s_sd, 0)
+
+        depth = np.asarray(self.t[self.season_idx].variables['depth'][:])
+        results = list()
+        for i in range(lats.size):
+            if not sea[i].any():
+                results.append(None)
+                continue
+
+            num_values = np.count_nonzero(valid[i])
+            data = [(depth[0:num_values], t[i][valid[i]], s[i][valid[i]])]
+
+            # - min/max: isolate realistic values
+            missing_sd = np.nonzero(~(valid_t_sd[i] & valid_s_sd[i]))[0]
+            if missing_sd.size > 0:
+                num_values = missing_sd[0]
+            data.append((depth[0:num_values], t_min[i][valid[i]][0:num_values], s_min[i][valid[i]][0:num_values]))
+            data.append((depth[0:num_values], t_max[i][valid[i]][0:num_values], s_max[i][valid[i]][0:num_values]))
+            results.append(data)
+
+        return results
+
+    def _search_windows(self, lats: np.ndarray, lons: np.ndarray) -> tuple:
+        """Return the lat and lon indices of the search windows around the passed positions, and if at sea
+
+        The arrays are (positions, nodes), with the nodes of each window in lat-major order.
+        """
+        lat_base_idxs, lon_base_idxs = self._grid_indices(lats=lats, lons=lons)
+
+        offsets = np.arange(-self.search_radius, self.search_radius + 1)
+        lat_offsets, lon_offsets = [offs.ravel() for offs in np.meshgrid(offsets, offsets, indexing='ij')]
+        lat_idxs = lat_base_idxs[:, np.newaxis] + lat_offsets
+        lon_idxs = (lon_base_idxs[:, np.newaxis] + lon_offsets) % self.lon.size  # the longitudes wrap around
+        in_grid = (lat_idxs >= 0) & (lat_idxs < self.lat.size)
+        lat_idxs = np.clip(lat_idxs, 0, self.lat.size - 1)
+
+        sea = in_grid & (self.landsea[lat_idxs, lon_idxs] != 1)
+        return lat_idxs, lon_idxs, sea
+
+    @classmethod
+    def _nearest_valid(cls, dist: np.ndarray, valid: np.ndarray) -> tuple:
+        """Return the closest node with valid values for each position and depth level, and if there is one
+
+        The dist array is (positions, nodes), the valid array is (positions, nodes, levels).
+        The ties go to the first node.
+        """
+        masked_dist = np.where(valid, dist[..., np.newaxis], np.inf)
+        nodes = masked_dist.argmin(axis=1)[:, np.newaxis, :]
+        found = np.isfinite(np.take_along_axis(masked_dist, nodes, axis=1)[:, 0, :])
+        return nodes, found
+
+    @classmethod
+    def _pick(cls, profiles: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        """Pick the values of the (positions, nodes, levels) profiles at the passed nodes of each level"""
+        return np.take_along_axis(profiles, nodes, axis=1)[:, 0, :]
+
+    def _read_nodes(self, file_idx: int, name: str, lat_idxs: np.ndarray, lon_idxs: np.ndarray,
+                    in_memory: bool = False) -> np.ndarray:
+        """Read the profiles of a grid variable at the (positions, nodes) indices, NaN if not valid
+
+        The profiles are returned as a (positions, nodes, levels) array.
+        """
+        if in_memory:
+            grid = self._grid(file_idx=file_idx, name=name)
+            if grid is not None:
+                return np.array(grid[lat_idxs, lon_idxs])
+
+        # a single hyperslab with all the nodes of each position
+        ds = self.t[file_idx] if name.startswith('t') else self.s[file_idx]
+        var = ds.variables[name]
+        profiles = list()
+        for lat_row, lon_row in zip(lat_idxs, lon_idxs):
+            lat_unique, lat_pos = np.unique(lat_row, return_inverse=True)
+            lon_unique, lon_pos = np.unique(lon_row, return_inverse=True)
+            values = np.ma.filled(np.ma.asarray(var[0, :, lat_unique, lon_unique], dtype=np.float32), np.nan)
+            profiles.append(values[:, lat_pos, lon_pos].T)
+        return np.stack(profiles)
+
+    def _grid(self, file_idx: int, name: str) -> Optional[np.ndarray]:
+        """Return a grid variable as a memory-mapped (lat, lon, depth) array, NaN if not valid
+
+        The whole variable is read and stored in a float32 .npy file in the cache folder, and rebuilt when
+        older than the netCDF file.
+        """
+        key = (file_idx, name)
+        if key in self._grids:
+            return self._grids[key]
+
+        ds = self.t[file_idx] if name.startswith('t') else self.s[file_idx]
+        nc_path = ds.filepath()
+        npy_path = os.path.join(self._cache_folders()[0 if name.startswith('t') else 1],
+                                "%s.%s.npy" % (os.path.splitext(os.path.basename(nc_path))[0], name))
+        try:
+            if not os.path.exists(npy_path) or (os.path.getmtime(npy_path) < os.path.getmtime(nc_path)):
+                logger.info("caching %s of %s" % (name, os.path.basename(nc_path)))
+                var = ds.variables[name]
+                _, nr_levels, nr_lats, nr_lons = var.shape
+                tmp_path = "%s.tmp" % npy_path
+                grid = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                                 shape=(nr_lats, nr_lons, nr_levels))
+                step = 32  # latitude rows per read
+                for i in range(0, nr_lats, step):
+                    values = np.ma.asarray(var[0, :, i:i + step, :], dtype=np.float32)
+                    grid[i:i + step] = np.ma.filled(values, np.nan).transpose((1, 2, 0))
+                grid.flush()
+                del grid
+                os.replace(tmp_path, npy_path)
+
+            self._grids[key] = np.load(npy_path, mmap_mode='r')
+
+        except Exception as e:
+            logger.error("unable to cache %s of %s: %s" % (name, os.path.basename(nc_path), e))
+            self._grids[key] = None
+
+        return self._grids[key]
+
+    def _cache_folders(self) -> tuple:
+        """Return the folders of the temperature and salinity grid caches"""
+        if self.cache_folder is not None:
+            return self.cache_folder, self.cache_folder
+        return os.path.join(self.data_folder, "temp"), os.path.join(self.data_folder, "sal")
+
+    def purge_cache(self) -> bool:
+        """Delete the grid cache files of the in-memory mode"""
+        self._grids = dict()  # release the memory-mapped files
+        try:
+            for folder in set(self._cache_folders()):
+                if not os.path.isdir(folder):
+                    continue
+                for name in os.listdir(folder):
+                    if name.startswith("woa13_") and (name.endswith(".npy") or name.endswith(".npy.tmp")):
+                        os.remove(os.path.join(folder, name))
+
+        except OSError as e:
+            logger.error("unable to purge the grid cache: %s" % e)
+            return False
+
+        return True
 
     def clear_data(self) -> None:
         """Delete the data and reset the last loaded day"""
@@ -387,6 +488,8 @@ class Woa13(AbstractAtlas):
                 if self.s[i]:
                     self.s[i].close()
             self.s = list()
+            self._grids = dict()
+            self.nr_valid_levels = None
             self.landsea = None
             self.lat = None
             self.lon = None
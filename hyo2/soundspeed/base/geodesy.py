@@ -24,6 +24,8 @@ wkt_3857 = "PROJCS[\"WGS 84 / Pseudo-Mercator\",GEOGCS[\"Popular Visualisation C
 class Geodesy:
     """ A class about geodetic methods and conversions """
 
+    earth_radius = 6371000.0  # mean radius of earth in meters (used by haversine)
+
     @classmethod
     def radians(cls, degrees=0.0, minutes=0.0, seconds=0.0):
         """ Conversion of degrees, minutes and seconds to radians
@@ -190,16 +192,35 @@ class Geodesy:
 
     @classmethod
     def haversine(cls, long_1, lat_1, long_2, lat_2):
-        """ Calculate the great circle distance between two points on a spherical Earth"""
+        """ Calculate the great circle distance between two points on a spherical Earth
+
+        The positions may also be NumPy arrays (broadcast together), returning an array of distances.
+        """
         # convert decimal degrees to radians
-        long_1, lat_1, long_2, lat_2 = map(math.radians, [long_1, lat_1, long_2, lat_2])
+        long_1, lat_1, long_2, lat_2 = map(np.radians, [long_1, lat_1, long_2, lat_2])
 
         dlon = long_2 - long_1
         dlat = lat_2 - lat_1
-        a = math.sin(dlat / 2) ** 2 + math.cos(lat_1) * math.cos(lat_2) * math.sin(dlon / 2) ** 2
-        c = 2 * math.asin(math.sqrt(a))
-        r = 6371000  # Radius of earth in meters. Use 3956 for miles
-        return c * r
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin(dlon / 2) ** 2
+        c = 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+        return c * cls.earth_radius
+
+    @classmethod
+    def ecef(cls, long, lat, height=0.0):
+        """ Convert WGS84 geographic coordinates to Earth-centered, Earth-fixed coordinates (in meters)
+
+        The positions may also be NumPy arrays, returning the x, y, z arrays.
+        """
+        a = 6378137.0  # WGS84 semi-major axis
+        f = 1.0 / 298.257223563  # WGS84 flattening
+        e2 = f * (2.0 - f)
+        long, lat = map(np.radians, [long, lat])
+
+        n = a / np.sqrt(1.0 - e2 * np.sin(lat) ** 2)
+        x = (n + height) * np.cos(lat) * np.cos(long)
+        y = (n + height) * np.cos(lat) * np.sin(long)
+        z = (n * (1.0 - e2) + height) * np.sin(lat)
+        return x, y, z
 
     def distance(self, long_1, lat_1, long_2, lat_2, units="m"):
         """ Returns distance in 'units' (default m) between two Lat Lon point sets
@@ -0,0 +1,26 @@
+import zlib
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def pack_array(values, dtype):
+    """Pack an array as a compressed BLOB of the given little-endian dtype
+
+    The bytes are shuffled (all the first bytes of each value, then all the second bytes, ...) before
+    the compression, since similar values share their most significant bytes.
+    """
+    values = np.ascontiguousarray(values, dtype=dtype)
+    shuffled = values.view(np.uint8).reshape(-1, values.itemsize).T
+    return zlib.compress(shuffled.tobytes(), 6)
+
+
+def unpack_array(blob, dtype, count):
+    """Unpack a compressed BLOB created by pack_array into an array of count values"""
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    if shuffled.size != count * dtype.itemsize:
+        raise RuntimeError("invalid blob size: %d (expected %d)" % (shuffled.size, count * dtype.itemsize))
+    return np.ascontiguousarray(shuffled.reshape(dtype.itemsize, count).T).view(dtype).reshape(count)
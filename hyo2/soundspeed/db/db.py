@@ -1,12 +1,16 @@
 import sqlite3
 import os
 import datetime
+import threading
 # import traceback
+from urllib.request import pathname2url
 import numpy as np
 import logging
 
 from hyo2.soundspeed import lib_info
+from hyo2.soundspeed.base.geodesy import Geodesy
 from hyo2.soundspeed.db.point import Point, convert_point, adapt_point
+from hyo2.soundspeed.db.blob import pack_array, unpack_array
 from hyo2.soundspeed.db.plot import PlotDb
 from hyo2.soundspeed.db.export import ExportDb
 from hyo2.soundspeed.profile.profilelist import ProfileList
@@ -18,7 +22,20 @@ logger = logging.getLogger(__name__)
 class ProjectDb:
     """Class that provides an interface to a SQLite db with Sound Speed data"""
 
-    def __init__(self, projects_folder=None, project_name=None):
+    # since version 4, each cast has a single row per samples table with the columns as compressed BLOBs
+    samples_tables = ['data', 'proc', 'sis']
+    blob_columns = [  # (table column, samples attribute, blob dtype)
+        ('pressure', 'pressure', '<f8'),
+        ('depth', 'depth', '<f8'),
+        ('speed', 'speed', '<f8'),
+        ('temperature', 'temp', '<f8'),
+        ('conductivity', 'conductivity', '<f8'),
+        ('salinity', 'sal', '<f8'),
+        ('source', 'source', '<i4'),
+        ('flag', 'flag', '<i4'),
+    ]
+
+    def __init__(self, projects_folder=None, project_name=None, wal=False):
 
         # in case that no data folder is passed
         if projects_folder is None:
@@ -30,7 +47,7 @@ class ProjectDb:
             project_name = "default"
 
         # the passed project name is used to identify the project database to open
-        self.db_path = os.path.abspath(os.path.join(projects_folder, self.clean_project_name(project_name) + ".db"))
+        self.db_path = self.make_db_path(projects_folder=projects_folder, project_name=project_name)
         logger.debug('current project db: %s' % self.db_path)
 
         # add plotting and exporting capabilities
@@ -39,11 +56,25 @@ class ProjectDb:
 
         # add variable used to store the connection to the database
         self.conn = None
+        # the connection may be shared among threads: the callers serialize the access with this lock
+        self.lock = threading.RLock()
+        # write-ahead logging (opt-in): it persists in the file, leaves '-wal'/'-shm' files,
+        # requires SQLite >= 3.7, and does not work on network filesystems
+        self.wal = wal
 
         self.tmp_data = None
         self.tmp_ssp_pk = None
 
-        self.cur_version = 3
+        # spatial and temporal index of the casts (if the SQLite R*Tree module is available)
+        self.has_rtree = False
+        # nearest casts: initial search radius (in meters), enlarged until enough casts are found
+        self.nearest_start_radius = 10000.0
+
+        self.cur_version = 4
+
+        # bulk loading: max number of pks per query and rows per fetch
+        self.max_query_pks = 500
+        self.fetch_size = 100000
 
         self.reconnect_or_create()
 
@@ -55,6 +86,63 @@ class ProjectDb:
     def clean_project_name(some_var):
         return ''.join(char for char in some_var if char.isalnum() or char in ['-', '_', '.'])
 
+    @classmethod
+    def make_db_path(cls, projects_folder, project_name):
+        return os.path.abspath(os.path.join(projects_folder, cls.clean_project_name(project_name) + ".db"))
+
+    @classmethod
+    def read_only_uri(cls, db_path):
+        """Return the URI to open a db in read-only mode"""
+        return "file:%s?mode=ro" % pathname2url(os.path.abspath(db_path))
+
+    @classmethod
+    def read_db_version(cls, db_path):
+        """Read the version of a project db without modifying it (None if not a project db)"""
+        try:
+            conn = sqlite3.connect(cls.read_only_uri(db_path), uri=True)
+
+        except sqlite3.Error as e:
+            logger.error("unable to open %s, %s: %s" % (db_path, type(e), e))
+            return None
+
+        try:
+            # noinspection SqlResolve
+            return conn.execute("""SELECT version FROM library""").fetchone()[0]
+
+        except (sqlite3.Error, TypeError) as e:
+            logger.error("while reading the version of %s, %s: %s" % (db_path, type(e), e))
+            return None
+
+        finally:
+            conn.close()
+
+    @classmethod
+    def updated_copy(cls, db_path, projects_folder):
+        """Copy a project db in the passed folder and update the copy to the current version, returning its path
+
+        The passed db is only read (e.g., an old vessel db to merge), so that older versions can still open it.
+        """
+        project_name = os.path.splitext(os.path.basename(db_path))[0]
+        copy_path = cls.make_db_path(projects_folder=projects_folder, project_name=project_name)
+        try:
+            src = sqlite3.connect(cls.read_only_uri(db_path), uri=True)
+            try:
+                dst = sqlite3.connect(copy_path)
+                try:
+                    src.backup(dst)
+                finally:
+                    dst.close()
+            finally:
+                src.close()
+
+        except sqlite3.Error as e:
+            logger.error("unable to copy %s, %s: %s" % (db_path, type(e), e))
+            return None
+
+        db = cls(projects_folder=projects_folder, project_name=project_name)
+        db.disconnect()
+        return copy_path
+
     def reconnect_or_create(self):
         """ Reconnection to an existing database or create a new db """
         if self.conn:
@@ -67,7 +155,8 @@ class ProjectDb:
 
         try:
             self.conn = sqlite3.connect(self.db_path,
-                                        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+                                        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                                        check_same_thread=False, cached_statements=256, uri=True)
             # logger.info("Connected")
 
         except sqlite3.Error as e:
@@ -81,6 +170,8 @@ class ProjectDb:
         except sqlite3.Error as e:
             raise RuntimeError("Unable to activate foreign keys: %s" % e)
 
+        self._set_journal_mode()
+
         try:
             # Set the row factory
             self.conn.row_factory = sqlite3.Row
@@ -105,6 +196,21 @@ class ProjectDb:
         if not built:
             raise RuntimeError("Unable to build tables: the DB is encrypted or is not a database")
 
+    def _set_journal_mode(self):
+        """Activate the write-ahead logging if requested, otherwise (or if failing) use the rollback journal"""
+        try:
+            mode = self.conn.execute('PRAGMA journal_mode').fetchone()[0].lower()
+            if self.wal and (mode != 'wal'):
+                # readers do not block the writer (and vice versa)
+                mode = self.conn.execute('PRAGMA journal_mode=WAL').fetchone()[0].lower()
+                if mode != 'wal':
+                    logger.warning("Unable to activate write-ahead logging: %s journal mode" % mode)
+            if (mode == 'wal') and not self.wal:
+                self.conn.execute('PRAGMA journal_mode=DELETE')
+
+        except sqlite3.Error as e:
+            logger.warning("Unable to set the journal mode: %s" % e)
+
     def disconnect(self):
         """ Disconnect from the current database """
         if not self.conn:
@@ -113,6 +219,7 @@ class ProjectDb:
 
         try:
             self.conn.close()
+            self.conn = None
             # logger.info("Disconnected")
             return True
 
@@ -156,9 +263,23 @@ class ProjectDb:
                 # check if the library version is old
                 # noinspection SqlResolve
                 ret = self.conn.execute("""SELECT version FROM library""").fetchone()
-                if ret[0] < 3:
-                    logger.debug("updated old library version from %s to %s" % (ret[0], self.cur_version))
-                    self._updates_to_version_3(old_version=ret[0])
+                if ret[0] < self.cur_version:
+                    # a single transaction for all the updates (the SQLite DDL is transactional),
+                    # so that an interrupted update is rolled back
+                    if not self.conn.in_transaction:
+                        self.conn.execute("BEGIN")
+                    try:
+                        if ret[0] < 3:
+                            logger.debug("updated old library version from %s to %s" % (ret[0], 3))
+                            self._updates_to_version_3(old_version=ret[0])
+                            ret = (3, )
+                        if ret[0] < 4:
+                            logger.debug("updated old library version from %s to %s" % (ret[0], 4))
+                            self._updates_to_version_4(old_version=ret[0])
+
+                    except Exception:
+                        self.conn.rollback()
+                        raise
 
                 self.conn.execute("""
                                   CREATE TABLE IF NOT EXISTS ssp_pk(
@@ -166,6 +287,11 @@ class ProjectDb:
                                      cast_datetime timestamp NOT NULL,
                                      cast_position point NOT NULL)
                                   """)
+                # noinspection SqlResolve
+                self.conn.execute("""
+                                  CREATE INDEX IF NOT EXISTS ssp_pk_cast ON ssp_pk(cast_datetime, cast_position)
+                                  """)
+                self._build_rtree()
 
                 # noinspection SqlResolve
                 self.conn.execute("""
@@ -192,53 +318,26 @@ class ProjectDb:
                                      FOREIGN KEY(pk) REFERENCES ssp_pk(id))
                                   """)
 
-                # noinspection SqlResolve
-                self.conn.execute("""
-                                  CREATE TABLE IF NOT EXISTS data(
-                                     ssp_pk integer NOT NULL,
-                                     pressure real,
-                                     depth real NOT NULL,
-                                     speed real,
-                                     temperature real,
-                                     conductivity real,
-                                     salinity real,
-                                     source int NOT NULL DEFAULT  0,
-                                     flag int NOT NULL DEFAULT 0,
-                                     FOREIGN KEY(ssp_pk)
-                                        REFERENCES ssp(pk))
-                                  """)
-
-                # noinspection SqlResolve
-                self.conn.execute("""
-                                  CREATE TABLE IF NOT EXISTS proc(
-                                     ssp_pk integer NOT NULL,
-                                     pressure real,
-                                     depth real NOT NULL,
-                                     speed real,
-                                     temperature real,
-                                     conductivity real,
-                                     salinity real,
-                                     source int NOT NULL DEFAULT  0,
-                                     flag int NOT NULL DEFAULT 0,
-                                     FOREIGN KEY(ssp_pk)
-                                        REFERENCES ssp(pk))
-                                  """)
+                for table in self.samples_tables:
+                    self._create_samples_table(table)
 
+                # per-cast summary of the samples, maintained by add_casts/remove_casts
                 # noinspection SqlResolve
                 self.conn.execute("""
-                                  CREATE TABLE IF NOT EXISTS sis(
+                                  CREATE TABLE IF NOT EXISTS ssp_summary(
                                      ssp_pk integer NOT NULL,
-                                     pressure real,
-                                     depth real NOT NULL,
-                                     speed real,
-                                     temperature real,
-                                     conductivity real,
-                                     salinity real,
-                                     source int NOT NULL DEFAULT  0,
-                                     flag int NOT NULL DEFAULT 0,
+                                     ss_at_min_depth real,
+                                     min_depth real,
+                                     max_depth real,
+                                     max_raw_depth real,
+                                     data_samples integer NOT NULL DEFAULT 0,
+                                     proc_samples integer NOT NULL DEFAULT 0,
+                                     sis_samples integer NOT NULL DEFAULT 0,
+                                     PRIMARY KEY (ssp_pk),
                                      FOREIGN KEY(ssp_pk)
                                         REFERENCES ssp(pk))
                                   """)
+                self._add_missing_summaries()
 
                 # noinspection SqlResolve
                 self.conn.execute("""
@@ -269,6 +368,171 @@ class ProjectDb:
             logger.error("during building tables, %s: %s" % (type(e), e))
             return False
 
+    def _create_samples_table(self, table):
+        # noinspection SqlResolve
+        self.conn.execute("""
+                          CREATE TABLE IF NOT EXISTS %s(
+                             ssp_pk integer NOT NULL,
+                             num_samples integer NOT NULL,
+                             pressure blob NOT NULL,
+                             depth blob NOT NULL,
+                             speed blob NOT NULL,
+                             temperature blob NOT NULL,
+                             conductivity blob NOT NULL,
+                             salinity blob NOT NULL,
+                             source blob NOT NULL,
+                             flag blob NOT NULL,
+                             PRIMARY KEY (ssp_pk),
+                             FOREIGN KEY(ssp_pk)
+                                REFERENCES ssp(pk))
+                          """ % table)
+
+    # ssp columns copied by merge_db (named, since the columns order changed when 'surveylines' was added)
+    ssp_columns = ['pk', 'sensor_type', 'probe_type', 'original_path', 'institution', 'survey', 'vessel', 'sn',
+                   'proc_time', 'proc_info', 'surveylines', 'comments', 'pressure_uom', 'depth_uom', 'speed_uom',
+                   'temperature_uom', 'conductivity_uom', 'salinity_uom']
+
+    def merge_db(self, input_db_path, progress=None):
+        """Merge the casts of another project db (at the current version), returning the skipped and merged pks
+
+        The casts are copied with set-based queries on the input db, attached in read-only mode, without decoding
+        the samples.
+        The casts already present (same timestamp and position) are skipped. The returned pks are the input ones.
+        None is returned if the input db cannot be attached.
+        """
+        if not self.conn:
+            logger.error("missing db connection")
+            return None
+
+        def step(value, text):
+            if progress is not None:
+                progress.update(value=value, text=text)
+
+        pk_issues = list()
+        pk_done = list()
+
+        if progress is not None:
+            progress.start(text="Merge project db")
+
+        attached = False
+        try:
+            # noinspection SqlResolve
+            self.conn.execute("""ATTACH DATABASE ? AS merge_db""", (self.read_only_uri(input_db_path),))
+            attached = True
+
+            with self.conn:
+                if not self.conn.in_transaction:
+                    self.conn.execute("BEGIN")
+
+                step(10, "Checking duplicated casts")
+                # noinspection SqlResolve
+                self.conn.execute("""
+                                  CREATE TEMP TABLE merge_pks(
+                                     in_pk INTEGER PRIMARY KEY,
+                                     cur_pk integer,
+                                     is_new integer NOT NULL DEFAULT 0)
+                                  """)
+                # noinspection SqlResolve
+                self.conn.execute("""
+                                  INSERT INTO temp.merge_pks (in_pk, cur_pk)
+                                     SELECT a.id, b.id FROM merge_db.ssp_pk a
+                                        JOIN merge_db.ssp c ON a.id=c.pk
+                                        LEFT OUTER JOIN main.ssp_pk b
+                                           ON a.cast_datetime=b.cast_datetime AND a.cast_position=b.cast_position
+                                  """)
+                # noinspection SqlResolve
+                pk_issues = [row[0] for row in self.conn.execute("""
+                                  SELECT in_pk FROM temp.merge_pks WHERE cur_pk IN (SELECT pk FROM main.ssp)
+                                  ORDER BY in_pk
+                                  """)]
+                # noinspection SqlResolve
+                self.conn.execute("""DELETE FROM temp.merge_pks WHERE cur_pk IN (SELECT pk FROM main.ssp)""")
+
+                # new casts: pks after the current max one (a cast key may be present, but without data)
+                # noinspection SqlResolve
+                max_pk = self.conn.execute("""SELECT COALESCE(MAX(id), 0) FROM main.ssp_pk""").fetchone()[0]
+                # noinspection SqlResolve
+                new_pks = [row[0] for row in self.conn.execute("""
+                                  SELECT in_pk FROM temp.merge_pks WHERE cur_pk IS NULL ORDER BY in_pk
+                                  """)]
+                # noinspection SqlResolve
+                self.conn.executemany("""UPDATE temp.merge_pks SET cur_pk=?, is_new=1 WHERE in_pk=?""",
+                                      [(max_pk + i + 1, in_pk) for i, in_pk in enumerate(new_pks)])
+
+                step(30, "Copying casts")
+                # noinspection SqlResolve
+                self.conn.execute("""
+                                  INSERT INTO main.ssp_pk (id, cast_datetime, cast_position)
+                                     SELECT m.cur_pk, a.cast_datetime, a.cast_position FROM merge_db.ssp_pk a
+                                        JOIN temp.merge_pks m ON a.id=m.in_pk WHERE m.is_new=1
+                                  """)
+                columns = ", ".join(self.ssp_columns)
+                in_columns = ", ".join(["m.cur_pk"] + ["a.%s" % column for column in self.ssp_columns[1:]])
+                # noinspection SqlResolve
+                self.conn.execute("""
+                                  INSERT INTO main.ssp (%s)
+                                     SELECT %s FROM merge_db.ssp a JOIN temp.merge_pks m ON a.pk=m.in_pk
+                                  """ % (columns, in_columns))
+
+                for i, table in enumerate(self.samples_tables):
+                    step(40 + 15 * i, "Copying %s samples" % table)
+                    columns = ", ".join(["num_samples"] + [column for column, _, _ in self.blob_columns])
+                    # noinspection SqlResolve
+                    self.conn.execute("""
+                                      INSERT INTO main.%s (ssp_pk, %s)
+                                         SELECT m.cur_pk, %s FROM merge_db.%s a
+                                            JOIN temp.merge_pks m ON a.ssp_pk=m.in_pk
+                                      """ % (table, columns, columns, table))
+
+                step(85, "Updating the casts summary and index")
+                # noinspection SqlResolve
+                if self.conn.execute("""
+                                     SELECT COUNT(*) FROM merge_db.sqlite_master
+                                        WHERE type='table' AND name='ssp_summary'
+                                     """).fetchone()[0]:
+                    # noinspection SqlResolve
+                    self.conn.execute("""
+                                      INSERT INTO main.ssp_summary
+                                         SELECT m.cur_pk, a.ss_at_min_depth, a.min_depth, a.max_depth,
+                                            a.max_raw_depth, a.data_samples, a.proc_samples, a.sis_samples
+                                            FROM merge_db.ssp_summary a JOIN temp.merge_pks m ON a.ssp_pk=m.in_pk
+                                      """)
+                self._add_missing_summaries()  # also for the input dbs without summary
+                if self.has_rtree:
+                    self._align_rtree()
+
+                # noinspection SqlResolve
+                pk_done = [row[0] for row in self.conn.execute("""SELECT in_pk FROM temp.merge_pks ORDER BY in_pk""")]
+                # noinspection SqlResolve
+                self.conn.execute("""DROP TABLE temp.merge_pks""")
+
+        except sqlite3.Error as e:
+            if not attached:
+                logger.error("unable to attach %s, %s: %s" % (input_db_path, type(e), e))
+                return None
+
+            logger.error("during merging %s, %s: %s" % (input_db_path, type(e), e))
+            # the transaction is rolled back: nothing was merged
+            pk_done = list()
+            try:
+                # noinspection SqlResolve
+                pk_issues = [row[0] for row in self.conn.execute("""SELECT pk FROM merge_db.ssp ORDER BY pk""")]
+
+            except sqlite3.Error:
+                pk_issues = list()
+
+        finally:
+            if attached:
+                # noinspection SqlResolve
+                self.conn.execute("""DROP TABLE IF EXISTS temp.merge_pks""")
+                # noinspection SqlResolve
+                self.conn.execute("""DETACH DATABASE merge_db""")
+            if progress is not None:
+                progress.end()
+
+        logger.debug("merged %d casts (skipped: %d)" % (len(pk_done), len(pk_issues)))
+        return pk_issues, pk_done
+
     def remove_casts(self, ssp):
         if not isinstance(ssp, ProfileList):
             raise RuntimeError("not passed a ProfileList, but %s" % type(ssp))
@@ -305,7 +569,10 @@ class ProjectDb:
             return False
 
         try:
+            # a single transaction for all the casts (committed or rolled back on exit)
             with self.conn:
+                if not self.conn.in_transaction:
+                    self.conn.execute("BEGIN")
 
                 for i, self.tmp_data in enumerate(ssp.l):
 
@@ -330,6 +597,9 @@ class ProjectDb:
                         if not self._add_sis():
                             raise sqlite3.Error("unable to add ssp sis data samples")
 
+                    if not self._add_summary():
+                        raise sqlite3.Error("unable to add ssp summary")
+
             return True
 
         except sqlite3.Error as e:
@@ -370,9 +640,10 @@ class ProjectDb:
             if ret[0] == 0:
                 # logger.info("add new spp pk for %s @ %s" % (utc_time, point))
                 # noinspection SqlResolve
-                self.conn.execute("""
-                                  INSERT INTO ssp_pk VALUES (NULL, ?, ?)
-                                  """, (utc_time, point,))
+                cursor = self.conn.execute("""
+                                           INSERT INTO ssp_pk VALUES (NULL, ?, ?)
+                                           """, (utc_time, point,))
+                self._add_rtree_entry(pk=cursor.lastrowid, utc_time=utc_time, point=point)
         except sqlite3.Error as e:
             logger.error("during ssp pk check, %s: %s" % (type(e), e))
             return False
@@ -422,6 +693,15 @@ class ProjectDb:
             logger.error("during deletion from sis, %s: %s" % (type(e), e))
             return False
 
+        try:
+            # noinspection SqlResolve
+            self.conn.execute("""DELETE FROM ssp_summary WHERE ssp_pk=?""", (self.tmp_ssp_pk,))
+            # logger.info("deleted %s pk entry from ssp_summary" % self.tmp_ssp_pk)
+
+        except sqlite3.Error as e:
+            logger.error("during deletion from ssp_summary, %s: %s" % (type(e), e))
+            return False
+
         try:
             # noinspection SqlResolve
             self.conn.execute("""DELETE FROM ssp WHERE pk=?""", (self.tmp_ssp_pk,))
@@ -432,6 +712,16 @@ class ProjectDb:
             return False
 
         if full:
+            if self.has_rtree:
+                try:
+                    # noinspection SqlResolve
+                    self.conn.execute("""DELETE FROM ssp_rtree WHERE id=?""", (self.tmp_ssp_pk,))
+                    # logger.info("deleted %s id entry from ssp_rtree" % self.tmp_ssp_pk)
+
+                except sqlite3.Error as e:
+                    logger.error("during deletion from ssp_rtree, %s: %s" % (type(e), e))
+                    return False
+
             try:
                 # noinspection SqlResolve
                 self.conn.execute("""DELETE FROM ssp_pk WHERE id=?""", (self.tmp_ssp_pk,))
@@ -443,6 +733,56 @@ class ProjectDb:
 
         return True
 
+    def _build_rtree(self):
+        """Create the R*Tree index on cast position and time, and align it to the ssp_pk table"""
+        try:
+            # noinspection SqlResolve
+            self.conn.execute("""
+                              CREATE VIRTUAL TABLE IF NOT EXISTS ssp_rtree USING rtree(
+                                 id,
+                                 min_lon, max_lon,
+                                 min_lat, max_lat,
+                                 min_time, max_time)
+                              """)
+            self.has_rtree = True
+
+        except sqlite3.OperationalError as e:
+            logger.warning("unable to create the casts spatial index, queries will scan all the casts: %s" % e)
+            self.has_rtree = False
+            return
+
+        # the index may be out-of-date if the project was modified by an older version of the library
+        self._align_rtree()
+
+    def _align_rtree(self):
+        """Remove the R*Tree entries of deleted casts, and add the missing ones"""
+        # noinspection SqlResolve
+        self.conn.execute("""DELETE FROM ssp_rtree WHERE id NOT IN (SELECT id FROM ssp_pk)""")
+        # noinspection SqlResolve
+        rows = self.conn.execute("""
+                                 SELECT id, cast_datetime, cast_position FROM ssp_pk
+                                    WHERE id NOT IN (SELECT id FROM ssp_rtree)
+                                 """).fetchall()
+        for row in rows:
+            self._add_rtree_entry(pk=row['id'], utc_time=row['cast_datetime'], point=row['cast_position'])
+        if len(rows) > 0:
+            logger.debug("added %d casts to the spatial index" % len(rows))
+
+    def _add_rtree_entry(self, pk, utc_time, point):
+        if not self.has_rtree:
+            return
+
+        timestamp = self._timestamp(utc_time)
+        # noinspection SqlResolve
+        self.conn.execute("""
+                          INSERT OR REPLACE INTO ssp_rtree VALUES (?, ?, ?, ?, ?, ?, ?)
+                          """, (int(pk), point.x, point.x, point.y, point.y, timestamp, timestamp))
+
+    @classmethod
+    def _timestamp(cls, utc_time):
+        """Seconds since the epoch of a naive UTC datetime"""
+        return (utc_time - datetime.datetime(1970, 1, 1)).total_seconds()
+
     def _add_ssp(self):
 
         try:
@@ -480,113 +820,132 @@ class ProjectDb:
 
         return True
 
-    def _add_data(self):
+    def _add_samples(self, table, samples):
+        """Insert the samples of a profile section in the passed table"""
+        sz = samples.num_samples
+        if sz == 0:
+            return
 
-        sz = self.tmp_data.data.num_samples
-        # logger.info("num samples to add: %s" % sz)
+        columns = [getattr(samples, attribute)[:sz] for _, attribute, _ in self.blob_columns]
+        self._insert_blobs(table=table, pk=self.tmp_ssp_pk, num_samples=sz, columns=columns)
 
-        added_samples = 0
-        for i in range(sz):
+    def _insert_blobs(self, table, pk, num_samples, columns):
+        blobs = [pack_array(column, dtype) for column, (_, _, dtype) in zip(columns, self.blob_columns)]
+        # noinspection SqlResolve
+        self.conn.execute("""INSERT INTO %s VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""" % table,
+                          [int(pk), int(num_samples)] + blobs)
 
-            try:
-                # first check if the sample is already present with exactly the same values
-                # noinspection SqlResolve
-                self.conn.execute("""
-                                  INSERT INTO data VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                  """, (self.tmp_ssp_pk,
-                                        self.tmp_data.data.pressure[i],
-                                        self.tmp_data.data.depth[i],
-                                        self.tmp_data.data.speed[i],
-                                        self.tmp_data.data.temp[i],
-                                        self.tmp_data.data.conductivity[i],
-                                        self.tmp_data.data.sal[i],
-                                        self.tmp_data.data.source[i],
-                                        self.tmp_data.data.flag[i],
-                                        ))
-                added_samples += 1
-            except sqlite3.IntegrityError as e:
-                logger.info("skipping row #%s due to %s: %s" % (i, type(e), e))
-                continue
-            except sqlite3.Error as e:
-                print(self.tmp_data.data.depth[i], type(self.tmp_data.data.depth[i]))
-                # traceback.print_stack()
-                logger.error("during adding ssp raw samples, %s: %s" % (type(e), e))
-                return False
+    def _add_data(self):
+
+        try:
+            self._add_samples(table='data', samples=self.tmp_data.data)
+
+        except sqlite3.Error as e:
+            logger.error("during adding ssp raw samples, %s: %s" % (type(e), e))
+            return False
 
-        # logger.info("added %s raw samples" % added_samples)
         return True
 
     def _add_proc(self):
 
-        sz = self.tmp_data.proc.num_samples
-        # logger.info("max processed samples to add: %s" % sz)
-
-        added_samples = 0
-        for i in range(sz):
+        try:
+            self._add_samples(table='proc', samples=self.tmp_data.proc)
 
-            try:
-                # first check if the sample is already present with exactly the same values
-                # noinspection SqlResolve
-                self.conn.execute("""
-                                  INSERT INTO proc VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                  """, (self.tmp_ssp_pk,
-                                        self.tmp_data.proc.pressure[i],
-                                        self.tmp_data.proc.depth[i],
-                                        self.tmp_data.proc.speed[i],
-                                        self.tmp_data.proc.temp[i],
-                                        self.tmp_data.proc.conductivity[i],
-                                        self.tmp_data.proc.sal[i],
-                                        self.tmp_data.proc.source[i],
-                                        self.tmp_data.proc.flag[i],
-                                        ))
-                added_samples += 1
-
-            except sqlite3.IntegrityError as e:
-                logger.info("skipping row #%s due to %s: %s" % (i, type(e), e))
-                continue
-            except sqlite3.Error as e:
-                logger.error("during adding ssp processed samples, %s: %s" % (type(e), e))
-                return False
+        except sqlite3.Error as e:
+            logger.error("during adding ssp processed samples, %s: %s" % (type(e), e))
+            return False
 
-        # logger.info("added %s processed samples" % added_samples)
         return True
 
     def _add_sis(self):
 
-        sz = self.tmp_data.sis.num_samples
-        # logger.info("max sis samples to add: %s" % sz)
+        try:
+            self._add_samples(table='sis', samples=self.tmp_data.sis)
 
-        added_samples = 0
-        for i in range(sz):
+        except sqlite3.Error as e:
+            logger.error("during adding ssp sis samples, %s: %s" % (type(e), e))
+            return False
 
-            try:
-                # first check if the sample is already present with exactly the same values
-                # noinspection SqlResolve
-                self.conn.execute("""
-                                  INSERT INTO sis VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                  """, (self.tmp_ssp_pk,
-                                        self.tmp_data.sis.pressure[i],
-                                        self.tmp_data.sis.depth[i],
-                                        self.tmp_data.sis.speed[i],
-                                        self.tmp_data.sis.temp[i],
-                                        self.tmp_data.sis.conductivity[i],
-                                        self.tmp_data.sis.sal[i],
-                                        self.tmp_data.sis.source[i],
-                                        self.tmp_data.sis.flag[i],
-                                        ))
-                added_samples += 1
-
-            except sqlite3.IntegrityError as e:
-                logger.info("skipping row #%s due to %s: %s" % (i, type(e), e))
-                continue
+        return True
 
-            except sqlite3.Error as e:
-                logger.error("during adding ssp sis samples, %s: %s" % (type(e), e))
-                return False
+    def _add_summary(self):
+
+        try:
+            counts = list()
+            for samples in [self.tmp_data.data, self.tmp_data.proc, self.tmp_data.sis]:
+                counts.append(0 if samples is None else int(samples.num_samples))
+
+            sz = counts[1]
+            if sz > 0:
+                proc = self.tmp_data.proc
+                summary = self._proc_summary(depth=proc.depth[:sz], speed=proc.speed[:sz],
+                                             source=proc.source[:sz], flag=proc.flag[:sz])
+            else:
+                summary = [None, None, None, None]
+
+            # noinspection SqlResolve
+            self.conn.execute("""
+                              INSERT INTO ssp_summary VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                              """, [int(self.tmp_ssp_pk)] + summary + counts)
+
+        except sqlite3.Error as e:
+            logger.error("during ssp summary addition, %s: %s" % (type(e), e))
+            return False
 
-        # logger.info("added %s sis samples" % added_samples)
         return True
 
+    def _add_missing_summaries(self):
+        """Add the summary of the casts stored without it (e.g., converted from an older version)"""
+        # noinspection SqlResolve
+        rows = self.conn.execute("""
+                                 SELECT a.pk, b.num_samples AS proc_samples, b.depth, b.speed, b.source, b.flag,
+                                    c.num_samples AS data_samples, d.num_samples AS sis_samples
+                                    FROM ssp a
+                                    LEFT OUTER JOIN proc b ON a.pk=b.ssp_pk
+                                    LEFT OUTER JOIN data c ON a.pk=c.ssp_pk
+                                    LEFT OUTER JOIN sis d ON a.pk=d.ssp_pk
+                                    WHERE a.pk NOT IN (SELECT ssp_pk FROM ssp_summary)
+                                 """).fetchall()
+
+        for row in rows:
+            sz = row['proc_samples'] or 0
+            if sz > 0:
+                summary = self._proc_summary(depth=unpack_array(row['depth'], '<f8', sz),
+                                             speed=unpack_array(row['speed'], '<f8', sz),
+                                             source=unpack_array(row['source'], '<i4', sz),
+                                             flag=unpack_array(row['flag'], '<i4', sz))
+            else:
+                summary = [None, None, None, None]
+            counts = [row['data_samples'] or 0, sz, row['sis_samples'] or 0]
+
+            # noinspection SqlResolve
+            self.conn.execute("""
+                              INSERT INTO ssp_summary VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                              """, [row['pk']] + summary + counts)
+
+        if len(rows) > 0:
+            logger.debug("added summary for %d casts" % len(rows))
+
+    @classmethod
+    def _proc_summary(cls, depth, speed, source, flag):
+        """Return surface speed, min and max depths, and max raw depth (no extensions) of the valid samples"""
+        ext_sources = [Dicts.sources['woa09_ext'], Dicts.sources['woa13_ext'], Dicts.sources['woa18_ext'],
+                       Dicts.sources['rtofs_ext'], Dicts.sources['gomofs_ext'], Dicts.sources['ref_ext']]
+
+        valid_idx = np.nonzero((flag == Dicts.flags['valid']) & ~np.isnan(depth))[0]
+        if valid_idx.size == 0:
+            return [None, None, None, None]
+
+        min_idx = valid_idx[np.argmin(depth[valid_idx])]
+        max_idx = valid_idx[np.argmax(depth[valid_idx])]
+        summary = [float(speed[min_idx]), float(depth[min_idx]), float(depth[max_idx]), None]
+
+        raw_idx = valid_idx[~np.isin(source[valid_idx], ext_sources)]
+        if raw_idx.size > 0:
+            summary[3] = float(depth[raw_idx].max())
+
+        return summary
+
     def timestamp_list(self):
         """Create and return the timestamp list (and the pk)"""
 
@@ -615,17 +974,9 @@ class ProjectDb:
 
         ssp_list = list()
         # noinspection SqlResolve
-        sql = self.conn.execute("SELECT * FROM ssp_view")
-        sql_min = self.conn.execute("SELECT ssp_pk, speed, MIN(depth) as 'depth' FROM proc "
-                                    "WHERE flag=? GROUP BY ssp_pk", (Dicts.flags['valid'],)).fetchall()
-        sql_max = self.conn.execute("SELECT ssp_pk, speed, MAX(depth) as 'depth' FROM proc "
-                                    "WHERE flag=? GROUP BY ssp_pk", (Dicts.flags['valid'],)).fetchall()
-        sql_raw = self.conn.execute("SELECT ssp_pk, speed, MAX(depth) as 'depth' FROM proc "
-                                    "WHERE flag=? AND source!=? AND source!=? AND source!=? "
-                                    "AND source!=? AND source!=? AND source!=? GROUP BY ssp_pk",
-                                    (Dicts.flags['valid'], Dicts.sources['woa09_ext'], Dicts.sources['woa13_ext'],
-                                     Dicts.sources['woa18_ext'], Dicts.sources['rtofs_ext'], 
-                                     Dicts.sources['gomofs_ext'], Dicts.sources['ref_ext'],)).fetchall()
+        sql = self.conn.execute("""
+                                SELECT * FROM ssp_view a LEFT OUTER JOIN ssp_summary b ON a.pk=b.ssp_pk
+                                """)
 
         try:
             with self.conn:
@@ -642,45 +993,17 @@ class ProjectDb:
                         probe_type = Dicts.probe_types['Future']
 
                     # special handling for surface sound speed, min depth, max depth
-                    try:
-                        min_depth = str()
-                        for row_min in sql_min:
-                            if row_min['ssp_pk'] == row['pk']:
-                                ss_at_min_depth = '%0.2f' % row_min['speed']
-                                min_depth = '%0.2f' % row_min['depth']
-                                break
-                        if min_depth == '':
-                            logger.warning("unable to retrieve min depth for profile: %s -> skipping" % row['pk'])
-                            continue
-                    except Exception as e:
-                        logger.warning("profile %s: %s -> skipping" % (e, row['pk']))
+                    if row['min_depth'] is None:
+                        logger.warning("unable to retrieve min depth for profile: %s -> skipping" % row['pk'])
                         continue
+                    ss_at_min_depth = '%0.2f' % row['ss_at_min_depth']
+                    min_depth = '%0.2f' % row['min_depth']
+                    max_depth = '%0.2f' % row['max_depth']
 
-                    try:
-                        max_depth = str()
-                        for row_max in sql_max:
-                            if row_max['ssp_pk'] == row['pk']:
-                                max_depth = '%0.2f' % row_max['depth']
-                                break
-                        if max_depth == '':
-                            logger.warning("unable to retrieve max depth for profile: %s -> skipping" % row['pk'])
-                            continue
-                    except Exception as e:
-                        logger.warning("profile %s: %s -> skipping" % (e, row['pk']))
-                        continue
-
-                    try:
-                        max_raw_depth = str()
-                        for row_raw in sql_raw:
-                            if row_raw['ssp_pk'] == row['pk']:
-                                max_raw_depth = '%0.2f' % row_raw['depth']
-                                break
-                        if max_raw_depth == '':
-                            logger.warning("unable to retrieve max raw depth for profile: %s -> skipping" % row['pk'])
-                            continue
-                    except Exception as e:
-                        logger.warning("profile %s: %s -> skipping" % (e, row['pk']))
+                    if row['max_raw_depth'] is None:
+                        logger.warning("unable to retrieve max raw depth for profile: %s -> skipping" % row['pk'])
                         continue
+                    max_raw_depth = '%0.2f' % row['max_raw_depth']
 
                     ssp_list.append((row['pk'],  # 0
                                      row['cast_datetime'],  # 1
@@ -713,137 +1036,304 @@ class ProjectDb:
             logger.error("%s: %s" % (type(e), e))
             return ssp_list
 
-    def profile_by_pk(self, pk):
+    def casts_in_bbox(self, min_lon, min_lat, max_lon, max_lat, start_time=None, end_time=None):
+        """Return the (pk, cast_datetime, cast_position) of the casts in a bounding box and time window
+
+        A bounding box crossing the antimeridian has min_lon greater than max_lon. The casts are sorted by time.
+        """
         if not self.conn:
             logger.error("missing db connection")
             return None
 
-        # logger.info("retrieve profile with pk: %s" % pk)
+        if min_lon <= max_lon:
+            boxes = [(min_lon, min_lat, max_lon, max_lat), ]
+        else:
+            boxes = [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
 
-        ssp = ProfileList()
-        ssp.append()
+        try:
+            times, lons, lats, rows = self._candidate_casts(boxes=boxes, start_time=start_time,
+                                                            end_time=end_time)
 
-        with self.conn:
-            try:
-                # ssp spatial timestamp
-                # noinspection SqlResolve
-                ssp_idx = self.conn.execute("SELECT * FROM ssp_pk WHERE id=?", (pk,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error("while querying casts in bbox, %s: %s" % (type(e), e))
+            return None
 
-                ssp.cur.meta.utc_time = ssp_idx['cast_datetime']
-                ssp.cur.meta.longitude = ssp_idx['cast_position'].x
-                ssp.cur.meta.latitude = ssp_idx['cast_position'].y
+        inside = np.zeros(len(rows), dtype=bool)
+        for box in boxes:
+            inside |= (lons >= box[0]) & (lats >= box[1]) & (lons <= box[2]) & (lats <= box[3])
+        idx = np.nonzero(inside)[0]
+        idx = idx[np.argsort(times[idx], kind='stable')]
 
-            except sqlite3.Error as e:
-                logger.error("spatial timestamp for %s pk > %s: %s" % (pk, type(e), e))
-                return None
+        return [rows[i] for i in idx]
 
-            try:
-                # ssp metadata
-                # noinspection SqlResolve
-                ssp_meta = self.conn.execute("SELECT * FROM ssp WHERE pk=?", (pk,)).fetchone()
-
-                # special handling in case of unknown future sensor type
-                ssp.cur.meta.sensor_type = ssp_meta['sensor_type']
-                if ssp.cur.meta.sensor_type not in Dicts.sensor_types.values():
-                    ssp.cur.meta.sensor_type = Dicts.sensor_types['Future']
-
-                # special handling in case of unknown future probe type
-                ssp.cur.meta.probe_type = ssp_meta['probe_type']
-                if ssp.cur.meta.probe_type not in Dicts.probe_types.values():
-                    ssp.cur.meta.probe_type = Dicts.probe_types['Future']
-
-                ssp.cur.meta.original_path = ssp_meta['original_path']
-                ssp.cur.meta.institution = ssp_meta['institution']
-                ssp.cur.meta.survey = ssp_meta['survey']
-                ssp.cur.meta.vessel = ssp_meta['vessel']
-                ssp.cur.meta.sn = ssp_meta['sn']
-                ssp.cur.meta.proc_time = ssp_meta['proc_time']
-                ssp.cur.meta.proc_info = ssp_meta['proc_info']
-                ssp.cur.meta.comments = ssp_meta['comments']
-                ssp.cur.meta.surveylines = ssp_meta['surveylines']
-
-                ssp.cur.meta.pressure_uom = ssp_meta['pressure_uom']
-                ssp.cur.meta.depth_uom = ssp_meta['depth_uom']
-                ssp.cur.meta.speed_uom = ssp_meta['speed_uom']
-                ssp.cur.meta.temperature_uom = ssp_meta['temperature_uom']
-                ssp.cur.meta.conductivity_uom = ssp_meta['conductivity_uom']
-                ssp.cur.meta.salinity_uom = ssp_meta['salinity_uom']
+    def casts_within_radius(self, longitude, latitude, radius, start_time=None, end_time=None):
+        """Return the (pk, cast_datetime, cast_position, distance) of the casts within a radius (in meters)
 
-            except sqlite3.Error as e:
-                logger.error("ssp meta for %s pk > %s: %s" % (pk, type(e), e))
-                return None
+        The casts are sorted by (great circle) distance.
+        """
+        if not self.conn:
+            logger.error("missing db connection")
+            return None
 
-            # raw data
-            try:
-                # noinspection SqlResolve
-                ssp_samples = self.conn.execute("SELECT * FROM data WHERE ssp_pk=?", (pk,)).fetchall()
-                num_samples = len(ssp_samples)
-                ssp.cur.init_data(num_samples)
-                # logger.debug("raw data samples: %s" % num_samples)
-                for i in range(num_samples):
-                    # print(ssp_samples[i])
-
-                    ssp.cur.data.pressure[i] = ssp_samples[i]['pressure']
-                    ssp.cur.data.depth[i] = ssp_samples[i]['depth']
-                    ssp.cur.data.speed[i] = ssp_samples[i]['speed']
-                    ssp.cur.data.temp[i] = ssp_samples[i]['temperature']
-                    ssp.cur.data.conductivity[i] = ssp_samples[i]['conductivity']
-                    ssp.cur.data.sal[i] = ssp_samples[i]['salinity']
-                    ssp.cur.data.source[i] = ssp_samples[i]['source']
-                    ssp.cur.data.flag[i] = ssp_samples[i]['flag']
+        boxes = self._radius_boxes(longitude=longitude, latitude=latitude, radius=radius)
 
-            except sqlite3.Error as e:
-                logger.error("reading raw samples for %s pk, %s: %s" % (pk, type(e), e))
-                return None
+        try:
+            times, lons, lats, rows = self._candidate_casts(boxes=boxes, start_time=start_time,
+                                                            end_time=end_time)
 
-            # proc data
-            try:
-                # noinspection SqlResolve
-                ssp_samples = self.conn.execute("SELECT * FROM proc WHERE ssp_pk=?", (pk,)).fetchall()
-                num_samples = len(ssp_samples)
-                ssp.cur.init_proc(num_samples)
-                # logger.debug("proc data samples: %s" % num_samples)
-                for i in range(num_samples):
-                    # print(ssp_samples[i])
-                    ssp.cur.proc.pressure[i] = ssp_samples[i]['pressure']
-                    ssp.cur.proc.depth[i] = ssp_samples[i]['depth']
-                    ssp.cur.proc.speed[i] = ssp_samples[i]['speed']
-                    ssp.cur.proc.temp[i] = ssp_samples[i]['temperature']
-                    ssp.cur.proc.conductivity[i] = ssp_samples[i]['conductivity']
-                    ssp.cur.proc.sal[i] = ssp_samples[i]['salinity']
-                    ssp.cur.proc.source[i] = ssp_samples[i]['source']
-                    ssp.cur.proc.flag[i] = ssp_samples[i]['flag']
+        except sqlite3.Error as e:
+            logger.error("while querying casts within radius, %s: %s" % (type(e), e))
+            return None
 
-            except sqlite3.Error as e:
-                logger.error("reading raw samples for %s pk, %s: %s" % (pk, type(e), e))
+        distances = Geodesy.haversine(long_1=longitude, lat_1=latitude, long_2=lons, lat_2=lats)
+        idx = np.nonzero(distances <= radius)[0]
+        idx = idx[np.argsort(distances[idx], kind='stable')]
+
+        return [tuple(rows[i]) + (float(distances[i]),) for i in idx]
+
+    def nearest_casts(self, longitude, latitude, n=1, start_time=None, end_time=None, max_radius=None):
+        """Return the (pk, cast_datetime, cast_position, distance) of the n casts nearest to a position
+
+        The search radius is enlarged until n casts are found (up to max_radius, in meters, if passed).
+        """
+        if n < 1:
+            raise RuntimeError("invalid number of casts: %s" % n)
+
+        whole_earth = np.pi * Geodesy.earth_radius
+        if (max_radius is None) or (max_radius > whole_earth):
+            max_radius = whole_earth
+
+        radius = min(self.nearest_start_radius, max_radius)
+        while True:
+            casts = self.casts_within_radius(longitude=longitude, latitude=latitude, radius=radius,
+                                             start_time=start_time, end_time=end_time)
+            if casts is None:
                 return None
 
-            # sis data
-            try:
+            if (len(casts) >= n) or (radius >= max_radius):
+                return casts[:n]
+
+            radius = min(radius * 4.0, max_radius)
+
+    @classmethod
+    def _radius_boxes(cls, longitude, latitude, radius):
+        """Return the bounding boxes (not crossing the antimeridian) that enclose a spherical cap"""
+        angle = radius / Geodesy.earth_radius
+        d_lat = np.degrees(angle)
+        min_lat = latitude - d_lat
+        max_lat = latitude + d_lat
+
+        # the cap includes a pole or is too wide: all the longitudes
+        if (min_lat <= -90.0) or (max_lat >= 90.0) or (np.sin(angle) >= np.cos(np.radians(latitude))):
+            return [(-180.0, max(min_lat, -90.0), 180.0, min(max_lat, 90.0)), ]
+
+        d_lon = np.degrees(np.arcsin(np.sin(angle) / np.cos(np.radians(latitude))))
+        min_lon = longitude - d_lon
+        max_lon = longitude + d_lon
+        if min_lon < -180.0:
+            return [(min_lon + 360.0, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+        if max_lon > 180.0:
+            return [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon - 360.0, max_lat)]
+        return [(min_lon, min_lat, max_lon, max_lat), ]
+
+    def _candidate_casts(self, boxes, start_time, end_time):
+        """Retrieve the casts possibly in the boxes and in the time window, with times and positions as arrays
+
+        The R*Tree stores 32-bit floats (rounded outwards), so the candidates are refined on the actual values.
+        """
+        start_ts = -np.inf if start_time is None else self._timestamp(start_time)
+        end_ts = np.inf if end_time is None else self._timestamp(end_time)
+
+        rows = dict()
+        for min_lon, min_lat, max_lon, max_lat in boxes:
+            if self.has_rtree:
+                where = "b.max_lon>=? AND b.min_lon<=? AND b.max_lat>=? AND b.min_lat<=?"
+                params = [min_lon, max_lon, min_lat, max_lat]
+                if start_time is not None:
+                    where += " AND b.max_time>=?"
+                    params.append(start_ts)
+                if end_time is not None:
+                    where += " AND b.min_time<=?"
+                    params.append(end_ts)
                 # noinspection SqlResolve
-                ssp_samples = self.conn.execute("SELECT * FROM sis WHERE ssp_pk=?", (pk,)).fetchall()
-                num_samples = len(ssp_samples)
-                ssp.cur.init_sis(num_samples)
-                # logger.debug("sis data samples: %s" % num_samples)
-                for i in range(num_samples):
-                    # print(ssp_samples[i])
-                    ssp.cur.sis.pressure[i] = ssp_samples[i]['depth']
-                    ssp.cur.sis.depth[i] = ssp_samples[i]['depth']
-                    ssp.cur.sis.speed[i] = ssp_samples[i]['speed']
-                    ssp.cur.sis.temp[i] = ssp_samples[i]['temperature']
-                    ssp.cur.sis.conductivity[i] = ssp_samples[i]['conductivity']
-                    ssp.cur.sis.sal[i] = ssp_samples[i]['salinity']
-                    ssp.cur.sis.source[i] = ssp_samples[i]['source']
-                    ssp.cur.sis.flag[i] = ssp_samples[i]['flag']
+                sql = self.conn.execute("SELECT a.id, a.cast_datetime, a.cast_position FROM ssp_pk a "
+                                        "JOIN ssp_rtree b ON a.id=b.id WHERE %s" % where, params)
+            else:
+                # noinspection SqlResolve
+                sql = self.conn.execute("""SELECT id, cast_datetime, cast_position FROM ssp_pk""")
 
-            except sqlite3.Error as e:
-                logger.error("reading sis samples for %s pk, %s: %s" % (pk, type(e), e))
-                return None
+            for row in sql:
+                rows[row['id']] = (row['id'], row['cast_datetime'], row['cast_position'])
+
+        rows = list(rows.values())
+        times = np.array([self._timestamp(row[1]) for row in rows], dtype=np.float64)
+        lons = np.array([row[2].x for row in rows], dtype=np.float64)
+        lats = np.array([row[2].y for row in rows], dtype=np.float64)
+
+        idx = np.nonzero((times >= start_ts) & (times <= end_ts))[0]
+        return times[idx], lons[idx], lats[idx], [rows[i] for i in idx]
+
+    def profile_by_pk(self, pk):
+        ssps = self.profiles_by_pks([pk, ])
+        if ssps is None:
+            return None
+
+        return ssps[0]
+
+    def profiles_by_pks(self, pks):
+        """Retrieve the profiles with the passed primary keys, returning a list of ProfileList (None on failure)"""
+        if not self.conn:
+            logger.error("missing db connection")
+            return None
+
+        # logger.info("retrieve profiles with pks: %s" % pks)
+
+        ssps = dict()
+        for pk in pks:
+            ssps[pk] = ProfileList()
+            ssps[pk].append()
+
+        unique_pks = list(ssps.keys())
+        with self.conn:
+            for i in range(0, len(unique_pks), self.max_query_pks):
+                chunk = unique_pks[i:i + self.max_query_pks]
+                placeholders = ", ".join(["?"] * len(chunk))
+
+                try:
+                    # ssp spatial timestamp
+                    # noinspection SqlResolve
+                    rows = self.conn.execute("SELECT * FROM ssp_pk WHERE id IN (%s)" % placeholders,
+                                             chunk).fetchall()
+                    for ssp_idx in rows:
+                        ssp = ssps[ssp_idx['id']]
+                        ssp.cur.meta.utc_time = ssp_idx['cast_datetime']
+                        ssp.cur.meta.longitude = ssp_idx['cast_position'].x
+                        ssp.cur.meta.latitude = ssp_idx['cast_position'].y
+
+                    if len(rows) != len(chunk):
+                        missing = set(chunk) - set([row['id'] for row in rows])
+                        logger.error("spatial timestamp for %s pk > missing" % sorted(missing))
+                        return None
+
+                except sqlite3.Error as e:
+                    logger.error("spatial timestamp for %s pks > %s: %s" % (chunk, type(e), e))
+                    return None
+
+                try:
+                    # ssp metadata
+                    # noinspection SqlResolve
+                    rows = self.conn.execute("SELECT * FROM ssp WHERE pk IN (%s)" % placeholders, chunk).fetchall()
+                    for ssp_meta in rows:
+                        self._load_meta(ssp=ssps[ssp_meta['pk']], ssp_meta=ssp_meta)
+
+                except sqlite3.Error as e:
+                    logger.error("ssp meta for %s pks > %s: %s" % (chunk, type(e), e))
+                    return None
+
+                # raw, processed and sis data
+                for table in ['data', 'proc', 'sis']:
+                    try:
+                        self._load_samples(ssps=ssps, pks=chunk, table=table)
+
+                    except sqlite3.Error as e:
+                        logger.error("reading %s samples for %s pks, %s: %s" % (table, chunk, type(e), e))
+                        return None
 
         # This is the only way for the library to load a profile from the project database
-        ssp.loaded_from_db = True
+        for ssp in ssps.values():
+            ssp.loaded_from_db = True
+
+        return [ssps[pk] for pk in pks]
+
+    @classmethod
+    def _load_meta(cls, ssp, ssp_meta):
+
+        # special handling in case of unknown future sensor type
+        ssp.cur.meta.sensor_type = ssp_meta['sensor_type']
+        if ssp.cur.meta.sensor_type not in Dicts.sensor_types.values():
+            ssp.cur.meta.sensor_type = Dicts.sensor_types['Future']
+
+        # special handling in case of unknown future probe type
+        ssp.cur.meta.probe_type = ssp_meta['probe_type']
+        if ssp.cur.meta.probe_type not in Dicts.probe_types.values():
+            ssp.cur.meta.probe_type = Dicts.probe_types['Future']
+
+        ssp.cur.meta.original_path = ssp_meta['original_path']
+        ssp.cur.meta.institution = ssp_meta['institution']
+        ssp.cur.meta.survey = ssp_meta['survey']
+        ssp.cur.meta.vessel = ssp_meta['vessel']
+        ssp.cur.meta.sn = ssp_meta['sn']
+        ssp.cur.meta.proc_time = ssp_meta['proc_time']
+        ssp.cur.meta.proc_info = ssp_meta['proc_info']
+        ssp.cur.meta.comments = ssp_meta['comments']
+        ssp.cur.meta.surveylines = ssp_meta['surveylines']
+
+        ssp.cur.meta.pressure_uom = ssp_meta['pressure_uom']
+        ssp.cur.meta.depth_uom = ssp_meta['depth_uom']
+        ssp.cur.meta.speed_uom = ssp_meta['speed_uom']
+        ssp.cur.meta.temperature_uom = ssp_meta['temperature_uom']
+        ssp.cur.meta.conductivity_uom = ssp_meta['conductivity_uom']
+        ssp.cur.meta.salinity_uom = ssp_meta['salinity_uom']
+
+    def _fetch_columns(self, sql, params, nr_columns):
+        """Execute a query returning numeric columns as a packed (rows x columns) array (NULL as NaN)"""
+        cursor = self.conn.cursor()
+        cursor.row_factory = None  # plain tuples, directly packed by NumPy
+        cursor.execute(sql, params)
+
+        chunks = list()
+        while True:
+            rows = cursor.fetchmany(self.fetch_size)
+            if len(rows) == 0:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+
+        if len(chunks) == 0:
+            return np.zeros((0, nr_columns))
+        return np.concatenate(chunks)
+
+    def _load_samples(self, ssps, pks, table):
+        """Load the samples of a table for the passed pks into the profiles"""
+        placeholders = ", ".join(["?"] * len(pks))
+        # noinspection SqlResolve
+        rows = self.conn.execute("SELECT * FROM %s WHERE ssp_pk IN (%s)" % (table, placeholders), pks).fetchall()
+        rows = dict([(row['ssp_pk'], row) for row in rows])
+        # logger.debug("%s samples: %s" % (table, len(rows)))
+
+        for pk in pks:
+            row = rows.get(pk)
+            num_samples = 0 if row is None else row['num_samples']
+            profile = ssps[pk].cur
+            if table == 'data':
+                profile.init_data(num_samples)
+                samples = profile.data
+            elif table == 'proc':
+                profile.init_proc(num_samples)
+                samples = profile.proc
+            else:
+                profile.init_sis(num_samples)
+                samples = profile.sis
+            if num_samples == 0:
+                continue
 
-        return ssp
+            for column, attribute, dtype in self.blob_columns:
+                getattr(samples, attribute)[:] = unpack_array(row[column], dtype, num_samples)
+
+    def _fetch_row_samples(self, table, pks):
+        """Yield the (pk, columns) of a samples table in the row layout used up to version 3"""
+        placeholders = ", ".join(["?"] * len(pks))
+        # noinspection SqlResolve
+        columns = self._fetch_columns("SELECT ssp_pk, pressure, depth, speed, temperature, conductivity, salinity, "
+                                      "source, flag FROM %s WHERE ssp_pk IN (%s)"
+                                      % (table, placeholders), pks, nr_columns=9)
+
+        # group by pk, the stable sort preserves the insertion order of the samples
+        columns = columns[np.argsort(columns[:, 0], kind='stable')]
+        ssp_pks = columns[:, 0]
+        for pk in pks:
+            begin = np.searchsorted(ssp_pks, pk, side='left')
+            end = np.searchsorted(ssp_pks, pk, side='right')
+            yield pk, columns[begin:end, 1:]
 
     def delete_profile_by_pk(self, pk: int) -> bool:
         """Delete all the entries related to a SSP primary key"""
@@ -873,7 +1363,46 @@ class ProjectDb:
         # noinspection SqlResolve
         self.conn.execute("""
                           INSERT INTO library VALUES (?, ?, ?)
-                          """, (self.cur_version, "%s v.%s" % (lib_info.lib_name, lib_info.lib_version),
+                          """, (3, "%s v.%s" % (lib_info.lib_name, lib_info.lib_version),
+                                datetime.datetime.utcnow(),))
+
+    def _updates_to_version_4(self, old_version):
+        # - 'data', 'proc' and 'sis' tables: from a row per sample to a row of BLOBs per cast
+        for table in self.samples_tables:
+            # noinspection SqlResolve
+            resumed = self.conn.execute("""SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?""",
+                                        ("%s_rows" % table,)).fetchone()[0] > 0
+            # noinspection SqlResolve
+            converted = 'num_samples' in [row[1] for row in self.conn.execute("""PRAGMA table_info(%s)""" % table)]
+            if converted and not resumed:  # by an update interrupted while converting the next tables
+                continue
+            if resumed:  # left by an interrupted update: restart the conversion from the rows
+                logger.info("resuming the conversion of %s" % table)
+                # noinspection SqlResolve
+                self.conn.execute("""DROP TABLE IF EXISTS %s""" % table)
+            else:
+                # noinspection SqlResolve
+                self.conn.execute("""ALTER TABLE %s RENAME TO %s_rows""" % (table, table))
+            self._create_samples_table(table)
+
+            # noinspection SqlResolve
+            pks = [row[0] for row in self.conn.execute("""SELECT DISTINCT ssp_pk FROM %s_rows""" % table)]
+            for i in range(0, len(pks), self.max_query_pks):
+                for pk, columns in self._fetch_row_samples(table="%s_rows" % table,
+                                                           pks=pks[i:i + self.max_query_pks]):
+                    self._insert_blobs(table=table, pk=pk, num_samples=columns.shape[0], columns=columns.T)
+            logger.debug("converted %s samples of %d casts" % (table, len(pks)))
+
+            # noinspection SqlResolve
+            self.conn.execute("""DROP TABLE %s_rows""" % table)
+
+        # - 'library' table
+        # noinspection SqlResolve
+        self.conn.execute("""DELETE FROM library WHERE version=?""", (old_version,))
+        # noinspection SqlResolve
+        self.conn.execute("""
+                          INSERT INTO library VALUES (?, ?, ?)
+                          """, (4, "%s v.%s" % (lib_info.lib_name, lib_info.lib_version),
                                 datetime.datetime.utcnow(),))
 
     def __repr__(self):
@@ -162,11 +162,11 @@ class Saiv(AbstractTextReader):
                 continue
 
             # additional data field
-            try:
-                for mf in self.more_fields:
-                    self.ssp.cur.more.sa[mf][count] = float(data[self.field_index[mf]])
-            except Exception as e:
-                logger.debug("issue in reading additional data fields: %s -> skipping" % e)
+            if len(self.more_fields) > 0:
+                try:
+                    self.ssp.cur.more.sa[count] = tuple(float(data[self.field_index[mf]]) for mf in self.more_fields)
+                except Exception as e:
+                    logger.debug("issue in reading additional data fields: %s -> skipping" % e)
 
             count += 1
 
@@ -40,11 +40,12 @@ class Asvp(AbstractTextWriter):
                 and (np.sum(self.ssp.cur.sis.speed[ti]) != 0):
 
             asvp_base_name = self.fod.basename
-            for abs_freq in self.abs_freqs:
+            depth, atten, mean_atten = self._calc_abs()  # all the frequencies in a single pass
+            for i, abs_freq in enumerate(self.abs_freqs):
                 abs_file = "%s_%dkHz.abs" % (asvp_base_name, abs_freq)
                 self._write(data_path=data_path, data_file=abs_file)
                 self._write_header_abs(abs_freq)
-                self._write_body_abs(abs_freq)
+                self._write_body_abs(depth, atten[i], mean_atten[i])
 
         else:
             logger.warning("not temperature and/or salinity to create absorption files")
@@ -79,46 +80,40 @@ class Asvp(AbstractTextWriter):
                          self.ssp.cur.sis.depth[ti].size)
         self.fod.io.write(abs_header)
 
-    def _write_body_abs(self, freq):
-        # logger.debug('generating body for %d kHz' % freq)
+    def _calc_abs(self):
+        """Calculate the attenuation and its depth-weighted cumulative mean as frequencies-by-samples arrays
 
+        The samples with invalid salinity are skipped.
+        """
         ti = self.ssp.cur.sis_thinned
+        depth = self.ssp.cur.sis.depth[ti]
+        temp = self.ssp.cur.sis.temp[ti]
+        sal = self.ssp.cur.sis.sal[ti]
+
+        # thickness of the layer around each sample, bounded by the mid-points with the neighbours
+        mid = (depth[1:] + depth[:-1]) / 2.0
+        delta = np.empty_like(depth)
+        delta[0] = mid[0]
+        delta[1:-1] = mid[1:] - mid[:-1]
+        delta[-1] = depth[-1] - mid[-1]
+
+        valid = sal > 0
+        if not valid.all():
+            logger.info("skipping invalid salinity values")
+        depth = depth[valid]
+        delta = delta[valid]
+
+        freqs = np.array(self.abs_freqs, dtype=np.float64)[:, np.newaxis]
+        atten = Oc.attenuation(f=freqs, t=temp[valid], d=depth, s=sal[valid], ph=8.1)
+        mean_atten = np.cumsum(atten * delta, axis=1) / np.cumsum(delta)
+
+        return depth, atten, mean_atten
+
+    def _write_body_abs(self, depth, atten, mean_atten):
+        # logger.debug('generating body')
 
-        top_mean = 0
-        bottom_mean = 0
-
-        body = str()
-        sample_sz = int(np.sum(ti))
-        has_skipped_salinity = False
-        for i in range(sample_sz):
-
-            if self.ssp.cur.sis.sal[ti][i] <= 0:
-                if not has_skipped_salinity:
-                    logger.info("skipping invalid salinity values")
-                    has_skipped_salinity = True
-                continue
-
-            abs = Oc.attenuation(f=freq, t=self.ssp.cur.sis.temp[ti][i], d=self.ssp.cur.sis.depth[ti][i],
-                                 s=self.ssp.cur.sis.sal[ti][i], ph=8.1)
-
-            if i == 0:  # first
-                delta = (self.ssp.cur.sis.depth[ti][0] + self.ssp.cur.sis.depth[ti][1]) / 2.0
-
-            elif i == sample_sz - 1:  # last
-                delta = (self.ssp.cur.sis.depth[ti][sample_sz - 1] -
-                         (self.ssp.cur.sis.depth[ti][sample_sz - 1] + self.ssp.cur.sis.depth[ti][sample_sz - 2]) / 2.0)
-
-            else:
-                delta = ((self.ssp.cur.sis.depth[ti][i + 1] + self.ssp.cur.sis.depth[ti][i]) / 2.0 -
-                         (self.ssp.cur.sis.depth[ti][i] + self.ssp.cur.sis.depth[ti][i - 1]) / 2.0)
-
-            top_mean += abs * delta
-            bottom_mean += delta
-
-            mean_abs = top_mean / bottom_mean
-
-            body += "%.3f %.3f %.3f %s\n" \
-                    % (self.ssp.cur.sis.depth[ti][i], abs, mean_abs, "999.000")
+        rows = zip(depth.tolist(), atten.tolist(), mean_atten.tolist())
+        body = "".join(["%.3f %.3f %.3f %s\n" % (d, a, m, "999.000") for d, a, m in rows])
 
         self.fod.io.write(body)
         self.fod.io.close()
@@ -1,4 +1,5 @@
 import math
+import itertools
 import numpy as np
 import gsw
 import logging
@@ -8,6 +9,7 @@ warnings.filterwarnings("ignore", category=RuntimeWarning)
 logger = logging.getLogger(__name__)
 
 
+
 class Oceanography:
     """A collection of oceanographic methods
 
@@ -25,6 +27,35 @@ class Oceanography:
       J. Acoust. Soc. Am. 103(3) pp 1346-1352
     """
 
+    @classmethod
+    def _to_array(cls, value, dtype=None):
+        """Return the passed value as an (at least) 1-D floating point array"""
+        value = np.atleast_1d(np.asarray(value, dtype=dtype))
+        if not np.issubdtype(value.dtype, np.floating):
+            value = value.astype(np.float64)
+        return value
+
+    @classmethod
+    def _pow(cls, x, exponent):
+        """Return the power of the passed float array, evaluated element by element with the C library pow
+
+        The NumPy array power may use other kernels (e.g., SIMD ones) that differ in the last bit from the
+        C library pow used for the scalars, so the batched results would not match the per-sample ones.
+        The float32 arrays (a less precise mode) use the NumPy array power.
+        """
+        if x.dtype != np.float64:
+            return x ** exponent
+
+        values = x.ravel().tolist()
+        try:
+            result = np.fromiter(map(math.pow, values, itertools.repeat(exponent, len(values))), dtype=np.float64,
+                                 count=len(values))
+
+        except (ValueError, OverflowError):  # NaN or inf, as the NumPy scalar power
+            result = np.array([np.float64(value) ** exponent for value in values], dtype=np.float64)
+
+        return result.reshape(x.shape)
+
     # ### PRESSURE/DEPTH METHODS ###
 
     @classmethod
@@ -116,12 +147,18 @@ class Oceanography:
 
         ref: Leroy and Parthiot(1998)
 
+        Both scalars and arrays are accepted. Scalars are evaluated as 1-element arrays, so that the result
+        is bit-for-bit identical to the one of the same sample in a batched call.
+
         Args:
             d: depth in metres
             lat: latitude in decimal degrees
         Returns: pressure in decibar
 
         """
+        is_scalar = (np.ndim(d) == 0) and (np.ndim(lat) == 0)
+        d = cls._to_array(d)
+
         # (sin of latitude) squared
         sl = np.sin(lat / 57.29578)
         sl2 = sl * sl
@@ -129,7 +166,7 @@ class Oceanography:
         # gravity variation with latitude
         g = 9.7803 * (1 + 5.3e-3 * sl2)
 
-        h45 = 1.00818e-2 * d + 2.465e-8 * d ** 2 - 1.25e-13 * d ** 3 + 2.8e-19 * d ** 4
+        h45 = 1.00818e-2 * d + 2.465e-8 * cls._pow(d, 2) - 1.25e-13 * cls._pow(d, 3) + 2.8e-19 * cls._pow(d, 4)
         k = (g - 2e-5 * d) / (9.80612 - 2e-5 * d)
         hlat = h45 * k
 
@@ -137,27 +174,52 @@ class Oceanography:
         # e.g.: correction applicable to common oceans
         # corr = 1e-2 * (d / (d + 100)) + 6.2e-6 * d
 
-        return 100.0 * hlat  # from MPa to decibar
+        p = 100.0 * hlat  # from MPa to decibar
+        if is_scalar:
+            return p[0]
+        return p
 
     # ### SPEED METHODS ###
 
     @classmethod
-    def speed(cls, d, t, s, lat=30):
+    def speed(cls, d, t, s, lat=30, dtype=np.float64):
         """ Calculate sound speed from depth, temperature, and salinity
 
         validity: 0 - 40 deg C, 0 - 40 ppt, 0 - 1000 bars (~1000m)
 
         ref: Wong and Zhu(1995), Chen and Millero(1977)
 
+        The inputs may be scalars or arrays (broadcast together), so that a whole profile can be evaluated
+        with a single call. Scalars are evaluated as 1-element arrays: a scalar call returns exactly the
+        same value of the corresponding sample in a batched call.
+
         Args:
             d: depth in meter
             t: temp in degrees celsius
             s: salinity in practical salinity units (ppt)
             lat: latitude in decimal degree
+            dtype: floating point type used for the calculation (np.float32 for a faster, less precise result)
 
-        Returns: sound speed in m/s
+        Returns: sound speed in m/s (a scalar for scalar inputs, an array otherwise)
         """
+        is_scalar = (np.ndim(d) == 0) and (np.ndim(t) == 0) and (np.ndim(s) == 0) and (np.ndim(lat) == 0)
+        d = cls._to_array(d, dtype=dtype)
+        t = cls._to_array(t, dtype=dtype)
+        s = cls._to_array(s, dtype=dtype)
+
+        cwtp, atp, btp, dtp = cls._speed_coefficients(d=d, t=t, lat=lat)
 
+        vs = cwtp + atp * s + btp * cls._pow(s, 1.5) + dtp * cls._pow(s, 2)
+        if is_scalar:
+            return vs[0]
+        return vs
+
+    @classmethod
+    def _speed_coefficients(cls, d, t, lat):
+        """Return the salinity-independent terms of the Chen and Millero(1977) equation
+
+        The sound speed is: cwtp + atp * s + btp * s ** 1.5 + dtp * s ** 2
+        """
         p = cls.d2p_backup(d, lat) / 10  # pressure in bar
 
         c00 = 1402.388
@@ -210,17 +272,20 @@ class Oceanography:
 
         btp = b00 + b01 * t + (b10 + b11 * t) * p
 
-        atp = (a00 + a01 * t + a02 * t ** 2 + a03 * t ** 3 + a04 * t ** 4) + \
-              (a10 + a11 * t + a12 * t ** 2 + a13 * t ** 3 + a14 * t ** 4) * p + \
-              (a20 + a21 * t + a22 * t ** 2 + a23 * t ** 3) * p ** 2 + \
-              (a30 + a31 * t + a32 * t ** 2) * p ** 3
+        t2, t3, t4, t5 = [cls._pow(t, exponent) for exponent in (2, 3, 4, 5)]
+        p2, p3 = cls._pow(p, 2), cls._pow(p, 3)
 
-        cwtp = (c00 + c01 * t + c02 * t ** 2 + c03 * t ** 3 + c04 * t ** 4 + c05 * t ** 5) + \
-               (c10 + c11 * t + c12 * t ** 2 + c13 * t ** 3 + c14 * t ** 4) * p + \
-               (c20 + c21 * t + c22 * t ** 2 + c23 * t ** 3 + c24 * t ** 4) * p ** 2 + \
-               (c30 + c31 * t + c32 * t ** 2) * p ** 3
+        atp = (a00 + a01 * t + a02 * t2 + a03 * t3 + a04 * t4) + \
+              (a10 + a11 * t + a12 * t2 + a13 * t3 + a14 * t4) * p + \
+              (a20 + a21 * t + a22 * t2 + a23 * t3) * p2 + \
+              (a30 + a31 * t + a32 * t2) * p3
 
-        return cwtp + atp * s + btp * s ** 1.5 + dtp * s ** 2
+        cwtp = (c00 + c01 * t + c02 * t2 + c03 * t3 + c04 * t4 + c05 * t5) + \
+               (c10 + c11 * t + c12 * t2 + c13 * t3 + c14 * t4) * p + \
+               (c20 + c21 * t + c22 * t2 + c23 * t3 + c24 * t4) * p2 + \
+               (c30 + c31 * t + c32 * t2) * p3
+
+        return cwtp, atp, btp, dtp
 
     @classmethod
     def sal(cls, d, speed, t, lat=30):
@@ -262,6 +327,79 @@ class Oceanography:
 
         return salinity
 
+    @classmethod
+    def sal_newton(cls, d, speed, t, lat=30, tolerance=0.0005, max_iterations=20):
+        """Calculate the salinity for all the passed samples at once, based on the speed() method
+
+        Newton steps are applied to the Chen and Millero(1977) polynomial. The samples that do not converge
+        are then solved with a (vectorized) bisection in the same 0-50 PSU range used by the sal() method.
+
+        Args:
+            d: depth in meter
+            speed: sound speed in m/sec
+            t: temperature in deg Celsius
+            lat: latitude in decimal degree
+            tolerance: max absolute difference in m/sec between the measured and the calculated sound speed
+            max_iterations: max number of Newton steps
+
+        Returns: Salinity in PSU (ppt), and a boolean array with the per-sample convergence flags
+
+        """
+        low_value = 0.0
+        high_value = 50.0
+
+        d, speed, t = np.broadcast_arrays(cls._to_array(d), cls._to_array(speed), cls._to_array(t))
+        cwtp, atp, btp, dtp = cls._speed_coefficients(d=d, t=t, lat=lat)
+
+        def residual(sal):
+            return cwtp + atp * sal + btp * sal ** 1.5 + dtp * sal ** 2 - speed
+
+        # initial guess from the linear term only
+        with np.errstate(divide='ignore', invalid='ignore'):
+            salinity = np.clip((speed - cwtp) / atp, low_value, high_value)
+        salinity[~np.isfinite(salinity)] = 35.0
+
+        for _ in range(max_iterations):
+            res = residual(salinity)
+            pending = ~(np.abs(res) <= tolerance)
+            if not pending.any():
+                break
+
+            derivative = atp + 1.5 * btp * np.sqrt(salinity) + 2.0 * dtp * salinity
+            with np.errstate(divide='ignore', invalid='ignore'):
+                step = res / derivative
+            salinity[pending] = np.clip(salinity[pending] - step[pending], low_value, high_value)
+
+        converged = np.abs(residual(salinity)) <= tolerance
+
+        # bisection fallback for the samples that did not converge
+        pending = ~converged
+        if pending.any():
+            logger.debug("bisection fallback for %d samples" % np.count_nonzero(pending))
+            idx = np.nonzero(pending)[0]
+            low = np.full(idx.size, low_value)
+            high = np.full(idx.size, high_value)
+            bi_sal = np.zeros(idx.size)
+            active = np.ones(idx.size, dtype=bool)
+            # the bisection interval collapses after less than 64 halvings
+            for _ in range(64):
+                bi_sal[active] = (high[active] + low[active]) / 2.0
+                bi_res = cwtp[idx] + atp[idx] * bi_sal + btp[idx] * bi_sal ** 1.5 + dtp[idx] * bi_sal ** 2 \
+                    - speed[idx]
+                active &= ~(np.abs(bi_res) <= tolerance)
+                active &= (high != low)
+                if not active.any():
+                    break
+                too_high = active & (bi_res > 0.0)
+                high[too_high] = bi_sal[too_high]
+                too_low = active & ~(bi_res > 0.0)
+                low[too_low] = bi_sal[too_low]
+
+            salinity[idx] = bi_sal
+            converged[idx] = np.abs(bi_res) <= tolerance
+
+        return salinity, converged
+
     @classmethod
     def atg(cls, s, t, p):
         """ Adiabatic temperature gradient
@@ -319,18 +457,19 @@ class Oceanography:
         h = pr - p
         xk = h * cls.atg(s=s, t=t, p=p)
 
-        t += + 0.5 * xk
+        # no in-place operations, since the passed arrays must not be modified
+        t = t + 0.5 * xk
         q = xk
-        p += 0.5 * h
+        p = p + 0.5 * h
         xk = h * cls.atg(s=s, t=t, p=p)
 
-        t += 0.29289322 * (xk - q)
+        t = t + 0.29289322 * (xk - q)
         q = 0.58578644 * xk + 0.121320344 * q
         xk = h * cls.atg(s=s, t=t, p=p)
 
-        t += 1.707106781 * (xk - q)
+        t = t + 1.707106781 * (xk - q)
         q = 3.414213562 * xk - 4.121320344 * q
-        p += 0.5 * h
+        p = p + 0.5 * h
         xk = h * cls.atg(s=s, t=t, p=p)
 
         return t + (xk - 2.0 * q) / 6.0
@@ -339,6 +478,9 @@ class Oceanography:
     def in_situ_temp(cls, s, t, p, pr):
         """Compute in-situ temperature at pressure
 
+        The inputs may be scalars or arrays (broadcast together). Each sample is iterated on its own, so that
+        a batched call returns the same values of the corresponding scalar calls.
+
         Args:
             s: salinity in PSU ppt
             t: temperature
@@ -347,28 +489,40 @@ class Oceanography:
 
         Returns: in-situ temperature in deg C
         """
+        is_scalar = (np.ndim(s) == 0) and (np.ndim(t) == 0) and (np.ndim(p) == 0)
+        s, t, p = [cls._to_array(value) for value in np.broadcast_arrays(s, t, p)]
 
-        if p == pr:
-            return t
-
-        temp = t
+        temp = t.copy()
         new_pot_t = cls.pot_temp(s=s, t=temp, p=p, pr=pr)
         # logger.debug("p: %s, pr: %s" % (p, pr))
-        if new_pot_t < t:
-            sign = 1
-        else:
-            sign = -1
+        sign = np.where(new_pot_t < t, 1.0, -1.0)
 
         dt = new_pot_t - t
         new_dt = new_pot_t - t
 
-        while abs(new_dt) > 0.001:
-            if abs(new_dt) > abs(dt):
-                sign = -sign
-            temp += sign * 0.001
-            new_pot_t = cls.pot_temp(s=s, t=temp, p=p, pr=pr)
-            new_dt = new_pot_t - t
-
+        # the 0.001 steps are taken by blocks: the first step where the search either ends or changes
+        # direction is the new starting point (the steps are accumulated in order, as a step-by-step loop)
+        block = 64
+        todo = np.nonzero((p != pr) & (np.abs(new_dt) > 0.001))[0]
+        while todo.size > 0:
+            sign[todo] = np.where(np.abs(new_dt[todo]) > np.abs(dt[todo]), -sign[todo], sign[todo])
+            steps = np.empty((todo.size, block + 1))
+            steps[:, 0] = temp[todo]
+            steps[:, 1:] = sign[todo, np.newaxis] * 0.001
+            temps = np.add.accumulate(steps, axis=1)[:, 1:]
+            new_dts = cls.pot_temp(s=s[todo, np.newaxis], t=temps, p=p[todo, np.newaxis], pr=pr) \
+                - t[todo, np.newaxis]
+
+            done = np.abs(new_dts) <= 0.001
+            events = done | (np.abs(new_dts) > np.abs(dt[todo, np.newaxis]))
+            last = np.where(events.any(axis=1), events.argmax(axis=1), block - 1)
+            rows = np.arange(todo.size)
+            temp[todo] = temps[rows, last]
+            new_dt[todo] = new_dts[rows, last]
+            todo = todo[~done[rows, last]]
+
+        if is_scalar:
+            return temp[0]
         return temp
 
     @classmethod
@@ -489,6 +643,9 @@ class Oceanography:
 
         ref: Francois and Garrison, J. Acoust. Soc. Am., Vol. 72, No. 6, December 1982
 
+        The arguments may be arrays that broadcast together (e.g., frequencies as a column and the
+        samples as a row to get a frequencies-by-samples array).
+
         Args:
             f: frequency in kHz
             t: temperature in deg Celsius
@@ -499,31 +656,36 @@ class Oceanography:
         Returns: attenuation
 
         """
+        f = np.asarray(f, dtype=np.float64)
+        t = np.asarray(t, dtype=np.float64)
+        s = np.asarray(s, dtype=np.float64)
+        d = np.asarray(d, dtype=np.float64)
+
         abs_t = 273.0 + t
         c = 1412.0 + 3.21 * t + 1.19 * s + 0.0167 * d  # sound speed calculation
 
         # Boric Acid Contribution
-        a1 = (8.86 / c) * math.pow(10.0, (0.78 * ph - 5.0))
+        a1 = (8.86 / c) * np.power(10.0, (0.78 * ph - 5.0))
         p1 = 1.0
 
-        f1 = 2.8 * math.pow((s / 35.0), 0.5) * math.pow(10.0, 4.0 - (1245.0 / abs_t))
+        f1 = 2.8 * np.sqrt(s / 35.0) * np.power(10.0, 4.0 - (1245.0 / abs_t))
 
         # MgSO4 Contribution
         a2 = (21.44 * s / c) * (1.0 + 0.025 * t)
         p2 = (1.0 - 1.37E-4 * d) + (6.2E-9 * d * d)
-        f2 = (8.17 * math.pow(10.0, 8.0 - 1990.0 / abs_t)) / (1.0 + 0.0018 * (s - 35.0))
+        f2 = (8.17 * np.power(10.0, 8.0 - 1990.0 / abs_t)) / (1.0 + 0.0018 * (s - 35.0))
 
         # Pure Water Contribution
-        if t <= 20.0:
-            a3 = 4.937E-4 - 2.59E-5 * t + 9.11E-7 * t * t - 1.50E-8 * t * t * t
-        else:
-            a3 = 3.964E-4 - 1.146E-5 * t + 1.45E-7 * t * t - 6.5E-10 * t * t * t
+        a3 = np.where(t <= 20.0,
+                      4.937E-4 - 2.59E-5 * t + 9.11E-7 * t * t - 1.50E-8 * t * t * t,
+                      3.964E-4 - 1.146E-5 * t + 1.45E-7 * t * t - 6.5E-10 * t * t * t)
 
         p3 = 1.0 - 3.83E-5 * d + 4.9E-10 * d * d
 
-        boric = (a1 * p1 * f1 * f * f) / (f * f + f1 * f1)
-        mgso4 = (a2 * p2 * f2 * f * f) / (f * f + f2 * f2)
-        h2o = a3 * p3 * f * f
+        f_2 = f * f
+        boric = (a1 * p1 * f1 * f_2) / (f_2 + f1 * f1)
+        mgso4 = (a2 * p2 * f2 * f_2) / (f_2 + f2 * f2)
+        h2o = a3 * p3 * f_2
 
         return boric + mgso4 + h2o
 
@@ -718,34 +880,4 @@ class Oceanography:
         # S Salinity (ppt)
         # D Depth (m)
         # pH Acidity
-        abs_temp = 273.0 + t
-
-        # sound speed calculation
-        c = 1412.0 + 3.21 * t + 1.19 * s + 0.0167 * d
-
-        # Boric Acid Contribution
-        A1 = (8.86 / c) * math.pow(10.0, (0.78 * ph - 5.0))
-        P1 = 1.0
-
-        f1 = 2.8 * math.pow((s / 35.0), 0.5) * math.pow(10.0, 4.0 - (1245.0 / abs_temp))
-
-        # MgSO4 Contribution
-        A2 = (21.44 * s / c) * (1.0 + 0.025 * t)
-        P2 = (1.0 - 1.37E-4 * d) + (6.2E-9 * d * d)
-        f2 = (8.17 * math.pow(10.0, 8.0 - 1990.0 / abs_temp)) / (1.0 + 0.0018 * (s - 35.0))
-
-        # Pure Water Contribution
-        if t <= 20.0:
-            A3 = 4.937E-4 - 2.59E-5 * t + 9.11E-7 * t * t - 1.50E-8 * t * t * t
-        else:
-            A3 = 3.964E-4 - 1.146E-5 * t + 1.45E-7 * t * t - 6.5E-10 * t * t * t
-
-        P3 = 1.0 - 3.83E-5 * d + 4.9E-10 * d * d
-
-        boric = (A1 * P1 * f1 * f * f) / (f * f + f1 * f1)
-        magnes = (A2 * P2 * f2 * f * f) / (f * f + f2 * f2)
-        purewat = A3 * P3 * f * f
-
-        atten = boric + magnes + purewat
-
-        return atten
+        return cls.a(f=f, t=t, s=s, d=d, ph=ph)
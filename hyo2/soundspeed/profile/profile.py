@@ -70,6 +70,9 @@ class Profile:
         raise RuntimeError("unable to calculated median")
 
     def weighted_harmonic_mean(self):
+        return self.proc.cached('speed_harmonic_mean', self._calc_weighted_harmonic_mean)
+
+    def _calc_weighted_harmonic_mean(self):
         avg_depth = 10000.0  # just a very deep value
         half_swath_angle = 1.0  # a small angle since we just cure about nadir
 
@@ -81,6 +84,10 @@ class Profile:
 
         return tp1.harmonic_means[0]
 
+    @classmethod
+    def weighted_mean(cls, values, weights):
+        return np.average(values, weights=weights)
+
     @classmethod
     def weighted_arithmetic_std(cls, values, weights):
         avg = np.average(values, weights=weights)
@@ -88,6 +95,9 @@ class Profile:
         return math.sqrt(var)
 
     def weighted_harmonic_std(self):
+        return self.proc.cached('speed_harmonic_std', self._calc_weighted_harmonic_std)
+
+    def _calc_weighted_harmonic_std(self):
         w = self.calc_weights(self.proc.speed[self.proc_valid])
         avg = self.weighted_harmonic_mean()
         var = np.average((self.proc.speed[self.proc_valid] - avg) ** 2, weights=w)
@@ -139,98 +149,104 @@ class Profile:
         self.data.resize(count)
         self.more.resize(count)
 
+    # the masks and the statistics are cached by the samples (as read-only) until the next change
+
     @property
     def data_valid(self):
         """Return indices of valid data"""
-        return np.equal(self.data.flag, Dicts.flags['valid'])
+        return self.data.cached('valid', lambda: np.equal(self.data.flag, Dicts.flags['valid']))
 
     @property
     def proc_valid(self):
         """Return indices of valid proc samples"""
-        return np.equal(self.proc.flag, Dicts.flags['valid'])
+        return self.proc.cached('valid', lambda: np.equal(self.proc.flag, Dicts.flags['valid']))
 
     @property
     def nr_valid_proc_samples(self):
         """Return the number of valid proc samples"""
-        return len(self.proc.depth[self.proc_valid])
+        return self.proc.cached('nr_valid', lambda: len(self.proc.depth[self.proc_valid]))
 
     @property
     def proc_dqa_valid(self):
         """Return indices of DQA valid proc samples"""
-        return np.logical_and(self.proc_valid, np.logical_or(np.equal(self.proc.source, Dicts.sources['raw']),
-                                                             np.equal(self.proc.source, Dicts.sources['smoothing'])))
+        return self.proc.cached('dqa_valid', lambda: np.logical_and(
+            self.proc_valid, np.logical_or(np.equal(self.proc.source, Dicts.sources['raw']),
+                                           np.equal(self.proc.source, Dicts.sources['smoothing']))))
 
     @property
     def sis_valid(self):
         """Return indices of valid sis samples"""
-        return np.equal(self.sis.flag, Dicts.flags['valid'])
+        return self.sis.cached('valid', lambda: np.equal(self.sis.flag, Dicts.flags['valid']))
 
     @property
     def sis_thinned(self):
         """Return indices of thinned sis samples"""
-        return np.equal(self.sis.flag, Dicts.flags['thin'])
+        return self.sis.cached('thinned', lambda: np.equal(self.sis.flag, Dicts.flags['thin']))
 
     @property
     def proc_invalid_direction(self):
         """Return indices of invalid data for direction"""
-        return np.equal(self.proc.flag, Dicts.flags['direction'])  # numpy 1.10.4 if a warning
+        return self.proc.cached('invalid_direction', lambda: np.equal(self.proc.flag, Dicts.flags['direction']))
+
+    def _proc_weighted_values(self, field):
+        """Return the valid proc values of the passed field with their weights"""
+        def calc():
+            values = getattr(self.proc, field)[self.proc_valid]
+            return values, self.calc_weights(values)
+
+        return self.proc.cached('%s_weighted' % field, calc)
 
     @property
     def proc_depth_min(self):
-        return self.proc.depth[self.proc_valid].min()
+        return self.proc.cached('depth_min', lambda: self.proc.depth[self.proc_valid].min())
 
     @property
     def proc_speed_min(self):
-        return self.proc.speed[self.proc_valid].min()
+        return self.proc.cached('speed_min', lambda: self.proc.speed[self.proc_valid].min())
 
     @property
     def proc_temp_min(self):
-        return self.proc.temp[self.proc_valid].min()
+        return self.proc.cached('temp_min', lambda: self.proc.temp[self.proc_valid].min())
 
     @property
     def proc_sal_min(self):
-        return self.proc.sal[self.proc_valid].min()
+        return self.proc.cached('sal_min', lambda: self.proc.sal[self.proc_valid].min())
 
     @property
     def proc_depth_max(self):
-        return self.proc.depth[self.proc_valid].max()
+        return self.proc.cached('depth_max', lambda: self.proc.depth[self.proc_valid].max())
 
     @property
     def proc_speed_max(self):
-        return self.proc.speed[self.proc_valid].max()
+        return self.proc.cached('speed_max', lambda: self.proc.speed[self.proc_valid].max())
 
     @property
     def proc_temp_max(self):
-        return self.proc.temp[self.proc_valid].max()
+        return self.proc.cached('temp_max', lambda: self.proc.temp[self.proc_valid].max())
 
     @property
     def proc_sal_max(self):
-        return self.proc.sal[self.proc_valid].max()
+        return self.proc.cached('sal_max', lambda: self.proc.sal[self.proc_valid].max())
 
     @property
     def proc_depth_median(self):
-        w = self.calc_weights(self.proc.depth[self.proc_valid])
-        return self.weighted_median(self.proc.depth[self.proc_valid], w)
+        return self.proc.cached('depth_median', lambda: self.weighted_median(*self._proc_weighted_values('depth')))
 
     @property
     def proc_speed_median(self):
-        w = self.calc_weights(self.proc.speed[self.proc_valid])
-        return self.weighted_median(self.proc.speed[self.proc_valid], w)
+        return self.proc.cached('speed_median', lambda: self.weighted_median(*self._proc_weighted_values('speed')))
 
     @property
     def proc_temp_median(self):
-        w = self.calc_weights(self.proc.temp[self.proc_valid])
-        return self.weighted_median(self.proc.temp[self.proc_valid], w)
+        return self.proc.cached('temp_median', lambda: self.weighted_median(*self._proc_weighted_values('temp')))
 
     @property
     def proc_sal_median(self):
-        w = self.calc_weights(self.proc.sal[self.proc_valid])
-        return self.weighted_median(self.proc.sal[self.proc_valid], w)
+        return self.proc.cached('sal_median', lambda: self.weighted_median(*self._proc_weighted_values('sal')))
 
     @property
     def proc_depth_mean(self):
-        w = self.calc_weights(self.proc.depth[self.proc_valid])
-        return np.average(self.proc.depth[self.proc_valid], weights=w)
+        return self.proc.cached('depth_mean', lambda: self.weighted_mean(*self._proc_weighted_values('depth')))
 
     @property
     def proc_speed_mean(self):
@@ -238,18 +254,15 @@ class Profile:
 
     @property
     def proc_temp_mean(self):
-        w = self.calc_weights(self.proc.temp[self.proc_valid])
-        return np.average(self.proc.temp[self.proc_valid], weights=w)
+        return self.proc.cached('temp_mean', lambda: self.weighted_mean(*self._proc_weighted_values('temp')))
 
     @property
     def proc_sal_mean(self):
-        w = self.calc_weights(self.proc.sal[self.proc_valid])
-        return np.average(self.proc.sal[self.proc_valid], weights=w)
+        return self.proc.cached('sal_mean', lambda: self.weighted_mean(*self._proc_weighted_values('sal')))
 
     @property
     def proc_depth_std(self):
-        w = self.calc_weights(self.proc.depth[self.proc_valid])
-        return self.weighted_arithmetic_std(self.proc.depth[self.proc_valid], w)
+        return self.proc.cached('depth_std', lambda: self.weighted_arithmetic_std(*self._proc_weighted_values('depth')))
 
     @property
     def proc_speed_std(self):
@@ -257,13 +270,11 @@ class Profile:
 
     @property
     def proc_temp_std(self):
-        w = self.calc_weights(self.proc.temp[self.proc_valid])
-        return self.weighted_arithmetic_std(self.proc.temp[self.proc_valid], w)
+        return self.proc.cached('temp_std', lambda: self.weighted_arithmetic_std(*self._proc_weighted_values('temp')))
 
     @property
     def proc_sal_std(self):
-        w = self.calc_weights(self.proc.sal[self.proc_valid])
-        return self.weighted_arithmetic_std(self.proc.sal[self.proc_valid], w)
+        return self.proc.cached('sal_std', lambda: self.weighted_arithmetic_std(*self._proc_weighted_values('sal')))
 
     def _calc_water_salinity_threshold(self):
         """Determine salinity threshold from min/max values to help determine where instrument entered water"""
@@ -323,74 +334,100 @@ class Profile:
         except IndexError:
             logger.warning("issue with removing samples out of the water using salinity")
 
-    def statistical_filter(self):
+    @classmethod
+    def statistical_filter_mask(cls, speed, depth, window_size=5, nr_std_dev=2):
+        """Return a boolean mask with the samples that are outliers for the local mean and standard deviation
 
-        speed = self.proc.speed[self.proc_valid]
-        depth = self.proc.depth[self.proc_valid]
+        For each sample, the local statistics are calculated on the neighbors in a strided window centered
+        on the sample itself (excluding it). The endpoints use the other samples of the first/last
+        window_size - 1 samples, and a relaxed tolerance. Target: single point fliers.
+
+        Args:
+            speed: sound speed values
+            depth: depth values
+            window_size: odd number of samples in the sliding window (at least 5, for the endpoint statistics)
+            nr_std_dev: number of standard deviations to use for the error band
 
-        sigma = speed * 0.0
-        speed_mean = speed * 0.0
+        Returns: the boolean mask of the samples to filter
+        """
+        if (window_size < 5) or (window_size % 2 == 0):
+            raise RuntimeError("invalid window size: %s" % window_size)
 
+        half_window = window_size // 2
+        nr_neighbors = 2 * half_window
         nr_samples = len(speed)
-        sigma_min_th = 0.2  # Minimum standard deviation allowed.
-        logger.debug("applying statistical filter at %d valid samples" % nr_samples)
+        stat_filtered = np.zeros(nr_samples, dtype=bool)
+        if nr_samples < nr_neighbors:
+            logger.debug("skipping statistical filter for short profile (%d samples)" % nr_samples)
+            return stat_filtered
 
-        # Calculate local mean and std dev for each sample, use 2 neighbors on either sides.
-        # Endpoints treated separately. Target: single point fliers
-        for i in range(2, nr_samples - 2):
-            speed_sum = 0
-            speed_sum_sq = 0
-            for k in range(-2, 3):
-                if k == 0:  # skip itself
+        sigma_min_th = 0.2  # Minimum standard deviation allowed.
+        sigma = np.zeros(nr_samples)
+        speed_mean = np.zeros(nr_samples)
+
+        # Calculate local mean and std dev for each sample, use half window neighbors on either sides.
+        if nr_samples >= window_size:
+            speed = np.ascontiguousarray(speed, dtype=np.float64)
+            windows = np.lib.stride_tricks.as_strided(speed, shape=(nr_samples - nr_neighbors, window_size),
+                                                      strides=(speed.strides[0], speed.strides[0]),
+                                                      writeable=False)
+            speed_sum = np.zeros(windows.shape[0])
+            speed_sum_sq = np.zeros(windows.shape[0])
+            for k in range(window_size):
+                if k == half_window:  # skip itself
                     continue
-                speed_sum += speed[i + k]
-                speed_sum_sq += speed[i + k] * speed[i + k]
-
-            variance = ((4 * speed_sum_sq) - speed_sum * speed_sum) / (4 * 3)  # unbiased variance
-            speed_mean[i] = speed_sum / 4
-            if variance < 0:
-                variance = 0
-            sigma[i] = np.sqrt(variance)  # Local standard deviation
-            if sigma[i] < sigma_min_th:
-                sigma[i] = sigma_min_th
-
-        # Endpoints (use only three neighboring points). Relax tolerance.
+                speed_sum += windows[:, k]
+                speed_sum_sq += windows[:, k] * windows[:, k]
+
+            variance = ((nr_neighbors * speed_sum_sq) - speed_sum * speed_sum) \
+                / (nr_neighbors * (nr_neighbors - 1))  # unbiased variance
+            speed_mean[half_window:nr_samples - half_window] = speed_sum / nr_neighbors
+            sigma[half_window:nr_samples - half_window] = np.sqrt(np.maximum(variance, 0))  # Local std dev
+
+        # Endpoints (use only the other samples at the profile ends). Relax tolerance.
         c_end = 1.3  # Relaxed tolerance factor at endpoints.
-        ends_i = [0, 1, nr_samples - 2, nr_samples - 1]
-        index = [(1, 2, 3), (0, 2, 3), (nr_samples - 4, nr_samples - 3, nr_samples - 1),
-                 (nr_samples - 4, nr_samples - 3, nr_samples - 2)]
-        for k in range(4):
+        nr_end_neighbors = nr_neighbors - 1
+        ends_i = list(range(half_window)) + list(range(nr_samples - half_window, nr_samples))
+        for i in ends_i:
+            if i < half_window:
+                index = [j for j in range(nr_neighbors) if j != i]
+            else:
+                index = [j for j in range(nr_samples - nr_neighbors, nr_samples) if j != i]
+
             speed_sum = 0
             speed_sum_sq = 0
-            i = ends_i[k]  # Point number
-            for j in range(3):
-                ind_kj = index[k][j]
-                speed_sum += speed[ind_kj]
-                speed_sum_sq += speed[ind_kj] * speed[ind_kj]
-
-            variance = ((3 * speed_sum_sq) - speed_sum * speed_sum) / (3 * 2)  # unbiased variance
-            speed_mean[i] = speed_sum / 3
-            if variance < 0:
-                variance = 0
-            sigma[i] = np.sqrt(variance)
-            if sigma[i] < sigma_min_th:
-                sigma[i] = sigma_min_th
-            sigma[i] *= c_end  # Relax tolerance for end pts
+            for j in index:
+                speed_sum += speed[j]
+                speed_sum_sq += speed[j] * speed[j]
+
+            variance = ((nr_end_neighbors * speed_sum_sq) - speed_sum * speed_sum) \
+                / (nr_end_neighbors * (nr_end_neighbors - 1))  # unbiased variance
+            speed_mean[i] = speed_sum / nr_end_neighbors
+            sigma[i] = np.sqrt(max(variance, 0))
+
+        sigma = np.maximum(sigma, sigma_min_th)
+        sigma[ends_i] *= c_end  # Relax tolerance for end pts
 
         # identify the sample to filter
-        nr_std_dev = 2  # number of standard deviations to use for error band.
         tolerance_factor = 1.3  # Tolerance factor.
         depth_th = 33.0  # Depth at which to relax error band.
-        factor = tolerance_factor
-        stat_filtered = np.zeros(nr_samples, dtype=bool)
-        for i in range(nr_samples):
-            if depth[i] > depth_th:
-                factor = 1.0
-            th = factor * nr_std_dev * sigma[i]
-            if np.absolute(speed[i] - speed_mean[i]) > th:
-                logger.debug("statistical filtering for sample #%d (%.2f, %.2f, th: %.2f)"
-                             % (i, speed[i], speed_mean[i], th))
-                stat_filtered[i] = True
+        factor = np.where(np.logical_or.accumulate(depth > depth_th), 1.0, tolerance_factor)
+        th = factor * nr_std_dev * sigma
+        stat_filtered[:] = np.absolute(speed - speed_mean) > th
+        for i in np.nonzero(stat_filtered)[0]:
+            logger.debug("statistical filtering for sample #%d (%.2f, %.2f, th: %.2f)"
+                         % (i, speed[i], speed_mean[i], th[i]))
+
+        return stat_filtered
+
+    def statistical_filter(self, window_size=5, nr_std_dev=2):
+
+        speed = self.proc.speed[self.proc_valid]
+        depth = self.proc.depth[self.proc_valid]
+        logger.debug("applying statistical filter at %d valid samples" % len(speed))
+
+        stat_filtered = self.statistical_filter_mask(speed=speed, depth=depth, window_size=window_size,
+                                                     nr_std_dev=nr_std_dev)
 
         # finally apply the statistical filtering
         filtered_ii = np.zeros(len(self.proc_valid), dtype=bool)
@@ -444,35 +481,28 @@ class Profile:
             logger.debug("cosine avg -> storage: rows %s, columns %s" % (storage.shape[0], storage.shape[1]))
 
         # populate bin values (row #0)
-        for i in range(storage.shape[1]):
-            storage[0][i] = z_min + (- bin_width + i) * bin_size
+        storage[0] = z_min + (np.arange(storage.shape[1]) - bin_width) * bin_size
         if verbose:
             logger.debug("cosine avg -> storage bin values: %s" % (storage[0],))
 
-        # populate weights
-        for i, z in enumerate(zs):
-
-            # calculate the index of the central bin value
-            center_idx = int((z - z_min) / bin_size + .5) + bin_width
-            # if debug:
-            #     logger.debug("cosine avg -> z: %s, center index: %s" % (z, center_idx))
+        # calculate the indices of the central bin values, then the ones of all the bins in the averaging windows
+        center_idx = ((zs - z_min) / bin_size + .5).astype(int) + bin_width
+        bin_idx = center_idx[:, np.newaxis] + np.arange(-bin_width, bin_width + 1)
 
-            # calculate the differences from the current z values in the averaging windows
-            z_diff = z - storage[0][center_idx - bin_width:center_idx + bin_width + 1]
-            # if debug:
-            #     logger.debug("cosine avg -> z: %s, z diff: %s" % (z, z_diff))
+        # calculate the differences from the current z values in the averaging windows
+        z_diff = zs[:, np.newaxis] - storage[0][bin_idx]
 
-            # Insure that weight will be .1 at a window width from point I
-            bin_weights = 1.0 + np.cos(2.69 * z_diff / window_width[i])
-            bin_weights *= np.absolute(z_diff) < window_width[i]  # set to 0 when outside the window width
-            # if debug:
-            #     logger.debug("cosine avg -> z: %s, bin weights: %s" % (z, bin_weights))
+        # Insure that weight will be .1 at a window width from point I
+        bin_weights = 1.0 + np.cos(2.69 * z_diff / window_width[:, np.newaxis])
+        bin_weights *= np.absolute(z_diff) < window_width[:, np.newaxis]  # set to 0 when outside the window width
 
-            for j, name in enumerate(names):
-                # summing up for all the types, row is j + 1 since the first row is for bin values
-                storage[1 + j][center_idx - bin_width:center_idx + bin_width + 1] += records[name][i] * bin_weights
-
-            storage[-1][center_idx - bin_width:center_idx + bin_width + 1] += bin_weights
+        # populate weights and weighted sums by scatter-adding all the window contributions at once
+        flat_idx = bin_idx.ravel()
+        for j, name in enumerate(names):
+            # summing up for all the types, row is j + 1 since the first row is for bin values
+            storage[1 + j] = np.bincount(flat_idx, weights=(records[name][:, np.newaxis] * bin_weights).ravel(),
+                                         minlength=storage.shape[1])
+        storage[-1] = np.bincount(flat_idx, weights=bin_weights.ravel(), minlength=storage.shape[1])
 
         if verbose:
             logger.debug("cosine avg -> storage weights: %s" % (storage[-1],))
@@ -492,106 +522,123 @@ class Profile:
         delta_zs = np.hstack(([1.0], np.diff(storage[0])))
         # remove duplicated z values
         storage = np.compress(delta_zs >= .00001, storage, axis=1)
+        # skip negative depths
+        storage = np.compress(storage[0] >= 0.0, storage, axis=1)
 
-        # logger.debug(self.proc.depth)
-
-        # insert created data into the self.proc arrays
-        last_depth = 0.0
-        for row in storage.T:
-
-            # index of where the storage record falls
-            d_th = float(row[0])
-            if d_th < last_depth:
-                continue
-            last_depth = d_th
-            try:
-                z_bools = np.logical_and(self.proc_valid, self.proc.depth > d_th)
-                i = np.argwhere(z_bools)[0]
-            except IndexError:
-                i = zs.size
-
-            self.proc.depth = np.insert(self.proc.depth, i, d_th)
-            self.proc.source = np.insert(self.proc.source, i, Dicts.sources['smoothing'])
-            self.proc.flag = np.insert(self.proc.flag, i, Dicts.flags['valid'])
-            for j, name in enumerate(names):
-                setattr(self.proc, name, np.insert(getattr(self.proc, name), i, row[j + 1]))
+        # each smoothed sample goes before the first valid sample that is deeper (the running max makes it
+        # sortable also for non-monotonic profiles), or after the last valid sample
+        valid_idx = np.nonzero(self.proc_valid)[0]
+        insert_idx = np.searchsorted(np.maximum.accumulate(zs), storage[0], side='right')
+        insert_idx = np.append(valid_idx, valid_idx[-1] + 1)[insert_idx]
 
-            # logger.debug(self.proc.depth)
-
-        # since we inserted new samples
-        self.proc.num_samples = self.proc.depth.size
+        # merge all the created data into the self.proc arrays at once
+        values = dict([(name, storage[j + 1]) for j, name in enumerate(names)])
+        self.proc.insert(insert_idx, depth=storage[0], source=Dicts.sources['smoothing'],
+                         flag=Dicts.flags['valid'], **values)
 
         # mark previous 'valid' data as 'smoothed'
         self.proc.flag[self.proc.source != Dicts.sources['smoothing']] = Dicts.flags['smoothed']
 
-    def reduce_up_down(self, ssp_direction, use_pressure=False):
-        """Reduce the raw data samples based on the passed direction"""
+    @classmethod
+    def turning_points(cls, values, min_excursion=1.0):
+        """Return the indices of the turning points in a series of yo-yo casts (e.g., MVP tow-yo)
+
+        The first sample and the turning points (alternating local minima and maxima) are returned.
+        Reversals smaller than min_excursion are ignored.
+        """
+        nr_samples = values.size
+        if nr_samples < 2:
+            return np.arange(nr_samples)
+
+        # candidate turning points: where the direction of the (non-flat) steps changes
+        steps = np.diff(values)
+        moving = np.nonzero(steps)[0]
+        signs = np.sign(steps[moving])
+        changes = moving[1:][signs[1:] != signs[:-1]]
+        candidates = np.concatenate(([0], changes, [nr_samples - 1]))
+
+        # discard the small reversals
+        points = [candidates[0]]
+        rising = None
+        for idx in candidates[1:]:
+            delta = values[idx] - values[points[-1]]
+            if rising is None:
+                if abs(delta) >= min_excursion:
+                    rising = delta > 0
+                    points.append(idx)
+
+            elif (delta > 0) == rising:
+                if delta != 0:
+                    points[-1] = idx
+
+            elif abs(delta) >= min_excursion:
+                rising = not rising
+                points.append(idx)
+
+        return np.array(points, dtype=int)
+
+    def reduce_up_down(self, ssp_direction, use_pressure=False, cast_nr=None, min_excursion=1.0):
+        """Reduce the raw data samples based on the passed direction
+
+        By default, the max depth (or pressure) is used as turning point. For files with multiple yo-yo casts
+        (e.g., MVP tow-yo), the cast_nr-th cast (0-based) in the passed direction is selected using all
+        the turning points, while the other samples are flagged as invalid for direction.
+        """
         if self.data.num_samples == 0:  # skipping if there are no data
             return
 
         # identify max depth
         if use_pressure:
-            max_value = self.data.pressure[self.data_valid].max()  # max pressure
+            values = self.data.pressure
+            max_value = values[self.data_valid].max()  # max pressure
             logger.debug("reduce up/down > max pressure: %s" % max_value)
 
         else:
-            max_value = self.data.depth[self.data_valid].max()  # max depth
+            values = self.data.depth
+            max_value = values[self.data_valid].max()  # max depth
             logger.debug("reduce up/down > max depth: %s" % max_value)
 
-        # loop through the sample using max depth as turning point
-        max_reached = False
-        last_value = None
-        for i in range(self.data.num_samples):
-
-            if use_pressure:
-                value = self.data.pressure[i]
+        is_down = ssp_direction == Dicts.ssp_directions['down']
+        nr_samples = values.size
+        if cast_nr is None:
+            # use the first sample at max depth as turning point
+            max_reached = np.nonzero(values == max_value)[0]
+            turning_idx = max_reached[0] if max_reached.size else nr_samples
+            if is_down:
+                start, end = 0, turning_idx
             else:
-                value = self.data.depth[i]
-
-            if (ssp_direction == Dicts.ssp_directions['up'] and not max_reached) \
-                    or (ssp_direction == Dicts.ssp_directions['down'] and max_reached):
-                self.data.flag[i] = Dicts.flags['direction']  # set invalid for direction
-
-            elif ssp_direction == Dicts.ssp_directions['down'] and not max_reached:
-
-                if (i != 0) and (last_value is not None):
-                    if value <= last_value:
-                        # print(last_value, value)
-                        self.data.flag[i] = Dicts.flags['direction']  # set invalid for direction
-                    else:
-                        last_value = value
-                else:
-                    last_value = value
-
-            elif ssp_direction == Dicts.ssp_directions['up'] and max_reached:
+                start, end = turning_idx, nr_samples - 1
 
-                if (i != 0) and (last_value is not None):
-                    if value >= last_value:
-                        self.data.flag[i] = Dicts.flags['direction']  # set invalid for direction
-                    else:
-                        last_value = value
-                else:
-                    last_value = value
-
-            if (value == max_value) and (max_reached is False):
-                max_reached = True
-                last_value = value
-                if ssp_direction == Dicts.ssp_directions['up']:
-                    self.data.flag[i] = Dicts.flags['valid']  # switch back to valid the last flagged one
+        else:
+            points = self.turning_points(values, min_excursion=min_excursion)
+            logger.debug("reduce up/down > turning points: %s" % (points, ))
+            casts = [(points[i], points[i + 1]) for i in range(points.size - 1)
+                     if (values[points[i + 1]] > values[points[i]]) == is_down]
+            if cast_nr >= len(casts):
+                raise RuntimeError('Unable to locate the cast #%d (%d casts in the direction)' % (cast_nr, len(casts)))
+            start, end = casts[cast_nr]
+
+        # within the cast, only keep the samples that move further in the passed direction
+        invalid_direction = np.ones(nr_samples, dtype=bool)
+        cast = values[start:end + 1]
+        if cast.size > 0:
+            invalid_direction[start] = False
+            if is_down:
+                invalid_direction[start + 1:end + 1] = cast[1:] <= np.maximum.accumulate(cast)[:-1]
+            else:
+                invalid_direction[start + 1:end + 1] = cast[1:] >= np.minimum.accumulate(cast)[:-1]
+        self.data.flag[invalid_direction] = Dicts.flags['direction']  # set invalid for direction
+        if (not is_down) and (cast.size > 0):
+            self.data.flag[start] = Dicts.flags['valid']  # switch back to valid the turning point
 
         if np.sum(self.data_valid) <= 1:
             raise RuntimeError('Unable to locate the upcast values. Double check their presence in the input file.')
 
-        if ssp_direction == Dicts.ssp_directions['up']:
+        if not is_down:
             logger.debug("flipping data for up direction")
-            self.data.pressure[:] = np.flipud(self.data.pressure)
-            self.data.depth[:] = np.flipud(self.data.depth)
-            self.data.speed[:] = np.flipud(self.data.speed)
-            self.data.temp[:] = np.flipud(self.data.temp)
-            self.data.conductivity[:] = np.flipud(self.data.conductivity)
-            self.data.sal[:] = np.flipud(self.data.sal)
-            self.data.source[:] = np.flipud(self.data.source)
-            self.data.flag[:] = np.flipud(self.data.flag)
+            for name in ["pressure", "depth", "speed", "temp", "conductivity", "sal", "source", "flag"]:
+                array = getattr(self.data, name)
+                array[:] = array[::-1].copy()
 
     def calc_salinity_from_conductivity(self):
         if np.count_nonzero(self.data.pressure):
@@ -621,9 +668,14 @@ class Profile:
         else:
             latitude = self.meta.latitude
 
-        for count in range(self.data.num_samples):
-            self.data.sal[count] = Oc.sal(d=self.data.depth[count], speed=self.data.speed[count],
-                                          t=self.data.temp[count], lat=latitude)
+        nr_samples = self.data.num_samples
+        if nr_samples > 0:
+            sal, converged = Oc.sal_newton(d=self.data.depth[:nr_samples], speed=self.data.speed[:nr_samples],
+                                           t=self.data.temp[:nr_samples], lat=latitude)
+            self.data.sal[:nr_samples] = sal
+            nr_unstable = nr_samples - np.count_nonzero(converged)
+            if nr_unstable > 0:
+                logger.warning("unable to obtain a stable salinity value for %d samples" % nr_unstable)
         self.modify_proc_info(Dicts.proc_import_infos['CALC_SAL'])
 
     def calc_dyn_height(self):
@@ -724,11 +776,12 @@ class Profile:
         else:
             latitude = self.meta.latitude
 
-        for count in range(self.data.num_samples):
-            self.data.speed[count] = Oc.speed(self.data.depth[count],
-                                              self.data.temp[count],
-                                              self.data.sal[count],
-                                              latitude)
+        nr_samples = self.data.num_samples
+        if nr_samples > 0:
+            self.data.speed[:nr_samples] = Oc.speed(self.data.depth[:nr_samples],
+                                                    self.data.temp[:nr_samples],
+                                                    self.data.sal[:nr_samples],
+                                                    latitude)
         self.modify_proc_info(Dicts.proc_import_infos['CALC_SPD'])
 
     def calc_proc_speed(self):
@@ -740,21 +793,18 @@ class Profile:
         else:
             latitude = self.meta.latitude
 
-        for count in range(self.proc.num_samples):
-            self.proc.speed[count] = Oc.speed(self.proc.depth[count],
-                                              self.proc.temp[count],
-                                              self.proc.sal[count],
-                                              latitude)
+        nr_samples = self.proc.num_samples
+        if nr_samples > 0:
+            self.proc.speed[:nr_samples] = Oc.speed(self.proc.depth[:nr_samples],
+                                                    self.proc.temp[:nr_samples],
+                                                    self.proc.sal[:nr_samples],
+                                                    latitude)
         self.modify_proc_info(Dicts.proc_user_infos['RECALC_SPD'])
 
     def calc_attenuation(self, frequency, ph):
         """Helper method to calculation attenuation [unused]"""
-        depth = np.zeros(self.proc.num_samples)
-        attenuation = np.zeros(self.proc.num_samples)
-        for i in range(self.proc.num_samples):
-            depth[i] = self.proc.depth[i]
-            attenuation[i] = Oc.a(frequency, self.proc.temp[i], self.proc.sal[i],
-                                  self.proc.depth[i], ph)
+        depth = np.array(self.proc.depth)
+        attenuation = Oc.a(frequency, self.proc.temp, self.proc.sal, depth, ph)
 
         return attenuation, depth
 
@@ -763,11 +813,8 @@ class Profile:
         attenuation, depth = self.calc_attenuation(frequency, ph)
         cumulative_attenuation = np.zeros(len(attenuation))
 
-        total_loss = 0
-        for count in range(len(attenuation) - 1):
-            layer_loss = attenuation[count] * (depth[count + 1] - depth[count]) / 1000.0
-            total_loss += layer_loss
-            cumulative_attenuation[count] = total_loss / (depth[count + 1] / 1000.0)
+        total_loss = np.cumsum(attenuation[:-1] * np.diff(depth) / 1000.0)
+        cumulative_attenuation[:-1] = total_loss / (depth[1:] / 1000.0)
 
         cumulative_attenuation[-1] = cumulative_attenuation[-2]
 
@@ -832,33 +879,22 @@ class Profile:
             # interpolate for pressure
             pi = np.array([self.proc.pressure[valid][m_ids[0]], self.proc.pressure[valid][m_ids[1]]])
             pm, pc = np.linalg.lstsq(a, pi, rcond=None)[0]
-            self.proc.pressure = np.insert(self.proc.pressure, j, pm * depth + pc)
-            # print(self.proc.pressure[0], self.proc.pressure.size)
 
             # interpolate for temp
             ti = np.array([self.proc.temp[valid][m_ids[0]], self.proc.temp[valid][m_ids[1]]])
             tm, tc = np.linalg.lstsq(a, ti, rcond=None)[0]
-            self.proc.temp = np.insert(self.proc.temp, j, tm * depth + tc)
-            # print(self.proc.temp[0], self.proc.temp.size)
 
             # interpolate for conductivity
             ci = np.array([self.proc.conductivity[valid][m_ids[0]], self.proc.conductivity[valid][m_ids[1]]])
             cm, cc = np.linalg.lstsq(a, ci, rcond=None)[0]
-            self.proc.conductivity = np.insert(self.proc.conductivity, j, cm * depth + cc)
-            # print(self.proc.conductivity[0], self.proc.conductivity.size)
 
             # interpolate for sal
             si = np.array([self.proc.sal[valid][m_ids[0]], self.proc.sal[valid][m_ids[1]]])
             sm, sc = np.linalg.lstsq(a, si, rcond=None)[0]
-            self.proc.sal = np.insert(self.proc.sal, j, sm * depth + sc)
-            # print(self.proc.sal[0], self.proc.sal.size)
-
-            self.proc.depth = np.insert(self.proc.depth, j, depth)
-            self.proc.speed = np.insert(self.proc.speed, j, speed)
-            self.proc.source = np.insert(self.proc.source, j, src)
-            self.proc.flag = np.insert(self.proc.flag, j, Dicts.flags['valid'])
 
-            self.proc.num_samples += 1
+            self.proc.insert(j, pressure=pm * depth + pc, depth=depth, speed=speed, temp=tm * depth + tc,
+                             conductivity=cm * depth + cc, sal=sm * depth + sc, source=src,
+                             flag=Dicts.flags['valid'])
 
     def insert_sis_speed(self, depth, speed, src=Dicts.sources['user'], temp=None, cond=None, sal=None):
         # logger.debug("insert speed to sis data: d:%s, vs:%s" % (depth, speed))
@@ -927,43 +963,28 @@ class Profile:
             # interpolate for pressure
             pi = np.array([self.sis.pressure[valid][m_ids[0]], self.sis.pressure[valid][m_ids[1]]])
             pm, pc = np.linalg.lstsq(a, pi, rcond=None)[0]
-            self.sis.pressure = np.insert(self.sis.pressure, j, pm * depth + pc)
-            # print(self.sis.pressure[0], self.sis.pressure.size)
 
             # interpolate for temp
             if temp is None:
                 ti = np.array([self.sis.temp[valid][m_ids[0]], self.sis.temp[valid][m_ids[1]]])
                 tm, tc = np.linalg.lstsq(a, ti, rcond=None)[0]
-                self.sis.temp = np.insert(self.sis.temp, j, tm * depth + tc)
-            else:
-                self.sis.temp = np.insert(self.sis.temp, j, temp)
-            # logger.debug("added temperature: %s" % self.sis.temp[j])
+                temp = tm * depth + tc
 
             # interpolate for conductivity
             if cond is None:
                 ci = np.array([self.sis.conductivity[valid][m_ids[0]], self.sis.conductivity[valid][m_ids[1]]])
                 cm, cc = np.linalg.lstsq(a, ci, rcond=None)[0]
-                self.sis.conductivity = np.insert(self.sis.conductivity, j, cm * depth + cc)
-            else:
-                self.sis.conductivity = np.insert(self.sis.conductivity, j, cond)
-            # logger.debug("added conductivity: %s" % self.sis.conductivity[j])
+                cond = cm * depth + cc
 
             # interpolate for sal
             if sal is None:
                 si = np.array([self.sis.sal[valid][m_ids[0]], self.sis.sal[valid][m_ids[1]]])
                 sm, sc = np.linalg.lstsq(a, si, rcond=None)[0]
-                self.sis.sal = np.insert(self.sis.sal, j, sm * depth + sc)
-            else:
-                self.sis.sal = np.insert(self.sis.sal, j, sal)
-            # logger.debug("added salinity: %s" % self.sis.sal[j])
+                sal = sm * depth + sc
 
-            self.sis.depth = np.insert(self.sis.depth, j, depth)
-            self.sis.speed = np.insert(self.sis.speed, j, speed)
-            self.sis.source = np.insert(self.sis.source, j, src)
             # we flag it as thin since the user most likely wants to have this value in the export
-            self.sis.flag = np.insert(self.sis.flag, j, Dicts.flags['thin'])
-
-            self.sis.num_samples += 1
+            self.sis.insert(j, pressure=pm * depth + pc, depth=depth, speed=speed, temp=temp, conductivity=cond,
+                            sal=sal, source=src, flag=Dicts.flags['thin'])
 
     def insert_proc_temp_sal(self, depth, temp, sal):
         logger.debug("insert temp, sal to proc data: d:%s, t:%s, s:%s" % (depth, temp, sal))
@@ -1028,23 +1049,14 @@ class Profile:
             # interpolate for pressure
             pi = np.array([self.proc.pressure[valid][m_ids[0]], self.proc.pressure[valid][m_ids[1]]])
             pm, pc = np.linalg.lstsq(a, pi, rcond=None)[0]
-            self.proc.pressure = np.insert(self.proc.pressure, j, pm * depth + pc)
-            # print(self.proc.pressure[0], self.proc.pressure.size)
 
             # interpolate for conductivity
             ci = np.array([self.proc.conductivity[valid][m_ids[0]], self.proc.conductivity[valid][m_ids[1]]])
             cm, cc = np.linalg.lstsq(a, ci, rcond=None)[0]
-            self.proc.conductivity = np.insert(self.proc.conductivity, j, cm * depth + cc)
-            # print(self.proc.conductivity[0], self.proc.conductivity.size)
-
-            self.proc.depth = np.insert(self.proc.depth, j, depth)
-            self.proc.speed = np.insert(self.proc.speed, j, speed)
-            self.proc.temp = np.insert(self.proc.temp, j, temp)
-            self.proc.sal = np.insert(self.proc.sal, j, sal)
-            self.proc.source = np.insert(self.proc.source, j, Dicts.sources['user'])
-            self.proc.flag = np.insert(self.proc.flag, j, Dicts.flags['valid'])
 
-            self.proc.num_samples += 1
+            self.proc.insert(j, pressure=pm * depth + pc, depth=depth, speed=speed, temp=temp,
+                             conductivity=cm * depth + cc, sal=sal, source=Dicts.sources['user'],
+                             flag=Dicts.flags['valid'])
 
     def extend_profile(self, extender, ext_type):
         """ Use the extender samples to extend the profile """
@@ -1080,24 +1092,14 @@ class Profile:
             logger.warning("too short to extend with: %s" % e)
             return True
 
-        # stack the extending samples after the last valid (max depth) index
-        self.proc.pressure = np.hstack([self.proc.depth[:max_idx + 1],
-                                        np.zeros_like(extender.cur.proc.depth[ext_vi][ind2:])])
-        self.proc.depth = np.hstack([self.proc.depth[:max_idx + 1],
-                                     extender.cur.proc.depth[ext_vi][ind2:]])
-        self.proc.speed = np.hstack([self.proc.speed[:max_idx + 1],
-                                     extender.cur.proc.speed[ext_vi][ind2:]])
-        self.proc.temp = np.hstack([self.proc.temp[:max_idx + 1],
-                                    extender.cur.proc.temp[ext_vi][ind2:]])
-        self.proc.conductivity = np.hstack([self.proc.sal[:max_idx + 1],
-                                            np.zeros_like(extender.cur.proc.sal[ext_vi][ind2:])])
-        self.proc.sal = np.hstack([self.proc.sal[:max_idx + 1],
-                                   extender.cur.proc.sal[ext_vi][ind2:]])
-        self.proc.source = np.hstack([self.proc.source[:max_idx + 1],
-                                      extender.cur.proc.source[ext_vi][ind2:]])
-        self.proc.flag = np.hstack([self.proc.flag[:max_idx + 1],
-                                    extender.cur.proc.flag[ext_vi][ind2:]])
-        self.proc.num_samples = self.proc.depth.size
+        # append the extending samples after the last valid (max depth) index
+        self.proc.resize(min(max_idx + 1, self.proc.num_samples))
+        self.proc.append(depth=extender.cur.proc.depth[ext_vi][ind2:],
+                         speed=extender.cur.proc.speed[ext_vi][ind2:],
+                         temp=extender.cur.proc.temp[ext_vi][ind2:],
+                         sal=extender.cur.proc.sal[ext_vi][ind2:],
+                         source=extender.cur.proc.source[ext_vi][ind2:],
+                         flag=extender.cur.proc.flag[ext_vi][ind2:])
 
         # update processing info
         if ext_type == Dicts.sources['ref_ext']:
@@ -1219,8 +1221,11 @@ class Profile:
 
     # - thinning
 
-    def thin(self, tolerance):
-        """Thin the sis data"""
+    def thin(self, tolerance, significance=None):
+        """Thin the sis data
+
+        The significance of the valid sis samples (see douglas_peucker_1d) can be passed to skip the thinning pass.
+        """
         # logger.info("thinning the sis samples")
 
         # if the profile is too short, we just pass it back
@@ -1232,49 +1237,100 @@ class Profile:
         # - 1000 points for: EM2040, EM710, EM302 and EM122;
         # - 570 points for: EM3000, EM3002, EM1002, EM300, EM120
         flagged = self.sis.flag[self.sis_valid][:]
-        idx_start = 0
-        idx_end = self.sis.depth[self.sis_valid].size - 1
-        # logger.debug('first: %s, last: %s[%s]'
-        #              % (self.sis.depth[self.sis_valid][idx_start],
-        #                 self.sis.depth[self.sis_valid][idx_end],
-        #                 self.sis.flag[self.sis_valid][idx_end]))
-        self.douglas_peucker_1d(idx_start, idx_end, tolerance=tolerance, data=flagged)
+        if significance is None:
+            significance = self.douglas_peucker_1d(depth=self.sis.depth[self.sis_valid],
+                                                   speed=self.sis.speed[self.sis_valid], tolerance=tolerance)
+        elif significance.size != flagged.size:
+            raise RuntimeError("mismatching significance size: %d (expected: %d)" % (significance.size, flagged.size))
+        flagged[significance > tolerance] = Dicts.flags['thin']
         self.sis.flag[self.sis_valid] = flagged[:]
 
         # logger.info("thinned: %s" % self.sis.flag[self.sis_thinned].size)
         return True
 
-    def douglas_peucker_1d(self, start, end, tolerance, data):
-        """ Recursive implementation """
-        # logger.debug("dp: %s, %s" % (start, end))
+    def proc_thin_significance(self, tolerance):
+        """Return the significance (see douglas_peucker_1d) of the valid proc samples for the passed tolerance
 
-        # We always keep end points
-        data[start] = Dicts.flags['thin']
-        data[end] = Dicts.flags['thin']
+        The thinning pass is cached until the proc samples change, and reused for any tolerance not smaller than
+        the one of the pass. The result can be passed to thin() when the sis samples are a clone of the proc ones.
+        """
+        cached = self.proc.cached('thin_significance', dict)
+        if ('tolerance' not in cached) or (tolerance < cached['tolerance']):
+            cached['significance'] = self.douglas_peucker_1d(depth=self.proc.depth[self.proc_valid],
+                                                             speed=self.proc.speed[self.proc_valid],
+                                                             tolerance=tolerance)
+            cached['tolerance'] = tolerance
+        return cached['significance']
+
+    def thin_curve(self, tolerances=None):
+        """Return the number of sis samples kept by the thinning for each tolerance, with a single pass
+
+        If the tolerances are not passed, the full curve is returned (one entry for each distinct tolerance
+        at which the number of kept samples changes).
+        """
+        depth = self.sis.depth[self.sis_valid]
+        speed = self.sis.speed[self.sis_valid]
 
-        slope = (self.sis.speed[self.sis_valid][end] - self.sis.speed[self.sis_valid][start]) / \
-                (self.sis.depth[self.sis_valid][end] - self.sis.depth[self.sis_valid][start])
+        if tolerances is None:
+            min_tolerance = 0.0
+        else:
+            tolerances = np.asarray(tolerances, dtype=np.float64)
+            min_tolerance = tolerances.min()
 
-        max_dist = 0
-        max_ind = 0
-        for ind in range(start + 1, end):
-            dist = abs(self.sis.speed[self.sis_valid][start] +
-                       slope * (self.sis.depth[self.sis_valid][ind] - self.sis.depth[self.sis_valid][start]) -
-                       self.sis.speed[self.sis_valid][ind])
+        # same rule used by thin() for short profiles
+        if depth.size < 100:
+            significance = np.full(depth.size, np.inf)
+        else:
+            significance = self.douglas_peucker_1d(depth=depth, speed=speed, tolerance=min_tolerance)
 
-            if dist > max_dist:
-                max_dist = dist
-                max_ind = ind
+        if tolerances is None:
+            finite = significance[np.isfinite(significance)]
+            tolerances = np.unique(np.append(finite[finite > min_tolerance], min_tolerance))
 
-        if max_dist <= tolerance:
-            return
+        counts = depth.size - np.searchsorted(np.sort(significance), tolerances, side='right')
+        return tolerances, counts
 
-        else:
-            data[max_ind] = Dicts.flags['thin']
-            # print(max_ind, max_dist, data[max_ind])
-            self.douglas_peucker_1d(start, max_ind, tolerance, data=data)
-            self.douglas_peucker_1d(max_ind, end, tolerance, data=data)
-            return
+    @classmethod
+    def douglas_peucker_1d(cls, depth, speed, tolerance):
+        """ Iterative implementation (with an explicit stack of segments)
+
+        Returns, for each sample, the largest tolerance at which the sample is kept by the thinning: a sample
+        is kept for a given tolerance if its value is greater than that tolerance (the end points are 'inf').
+        The values are reliable only for tolerances not smaller than the passed one.
+        """
+        nr_samples = depth.size
+        significance = np.zeros(nr_samples)
+        if nr_samples == 0:
+            return significance
+
+        # We always keep end points
+        significance[0] = np.inf
+        significance[-1] = np.inf
+
+        # each segment carries the significance of the split point that created it
+        segments = [(0, nr_samples - 1, np.inf)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            while segments:
+                start, end, parent = segments.pop()
+                if end - start < 2:
+                    continue
+
+                slope = (speed[end] - speed[start]) / (depth[end] - depth[start])
+                dist = np.absolute(speed[start] + slope * (depth[start + 1:end] - depth[start]) -
+                                   speed[start + 1:end])
+                dist[np.isnan(dist)] = 0.0
+
+                max_ind = np.argmax(dist)
+                max_dist = dist[max_ind]
+                if max_dist <= tolerance:
+                    continue
+
+                max_ind += start + 1
+                significance[max_ind] = min(max_dist, parent)
+                segments.append((max_ind, end, significance[max_ind]))
+                segments.append((start, max_ind, significance[max_ind]))
+
+        return significance
 
     # - debugging
 
@@ -1373,10 +1429,14 @@ class Profile:
         depths = self.proc.depth[self.proc_dqa_valid] - draft
         speeds = self.proc.speed[self.proc_dqa_valid]
 
+        # layer parameters for all the launch angles at once (angles by layers)
+        all_params = RayTracing.get_svp_layer_parameters(np.deg2rad(np.asarray(thetas_deg, np.float64)),
+                                                         depths, speeds)
+
         ray_paths = []
-        for launch in thetas_deg:
+        for i in range(len(thetas_deg)):
 
-            params = RayTracing.get_svp_layer_parameters(np.deg2rad(launch), depths, speeds)
+            params = (all_params[0], ) + tuple(param[i] for param in all_params[1:])
             if travel_times is None:
                 tt = np.arange(res, params[-2][-1], res)  # make travel_times to reach end of profile
             else:
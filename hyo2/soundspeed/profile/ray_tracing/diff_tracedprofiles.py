@@ -18,101 +18,78 @@ class DiffTracedProfiles:
         # output
         self.new_rays = list()
         self.old_rays = list()
+        self.diffs = None
         self.max_tolerances = None
 
+    @classmethod
+    def common_rays(cls, new_rays, old_rays):
+        """Select the samples common to both sets of (angles, [t, x, z], samples) rays
+
+        The samples are re-zeroed at the first common sample and, for the kept masks, truncated at the
+        minimum common travel time.
+        """
+        common = ~np.isnan(new_rays[:, 0]) & ~np.isnan(old_rays[:, 0])
+        has_common = common.any(axis=1)
+        first = np.argmax(common, axis=1)
+        last = common.shape[1] - 1 - np.argmax(common[:, ::-1], axis=1)
+
+        angles = np.arange(common.shape[0])
+        new_zeroed = new_rays - new_rays[angles, :, first][:, :, np.newaxis]
+        old_zeroed = old_rays - old_rays[angles, :, first][:, :, np.newaxis]
+
+        # stop to the minimum common time
+        min_time = np.minimum(new_zeroed[angles, 0, last], old_zeroed[angles, 0, last])[:, np.newaxis]
+        with np.errstate(invalid='ignore'):
+            new_kept = common & (np.cumsum(common & (new_zeroed[:, 0] > min_time), axis=1) == 0)
+            old_kept = common & (np.cumsum(common & (old_zeroed[:, 0] > min_time), axis=1) == 0)
+        new_kept[~has_common] = False
+        old_kept[~has_common] = False
+
+        return new_zeroed, old_zeroed, common, new_kept, old_kept
+
     def calc_diff(self):
+        """Calculate the (angle, sample, [t, dx, dz]) differences of the old rays at the new travel times"""
         if self.old_tp is None:
             raise RuntimeError("first set the old traced profile")
         if self.new_tp is None:
             raise RuntimeError("first set the new traced profile")
 
-        for ang in range(len(self.new_tp.rays)):
-            # logger.info("[angle: %d]" % ang)
-            ray_new = self.new_tp.rays[ang]
-            ray_old = self.old_tp.rays[ang]
-
-            new_t = list()
-            new_x = list()
-            new_z = list()
-
-            old_t = list()
-            old_x = list()
-            old_z = list()
-
-            init_done = False
-            init_new_t = None
-            init_new_x = None
-            init_new_z = None
-            init_old_t = None
-            init_old_x = None
-            init_old_z = None
-
-            # first retrieve common areas for both profiles (and reset the 0 values)
-            for idx in range(len(ray_new[0])):
-
-                if np.isnan(ray_new[0][idx]):
-                    continue
-                if np.isnan(ray_old[0][idx]):
-                    continue
-
-                if not init_done:
-                    # logger.debug("begin z: %s/%s" % (ray_new[2][idx], ray_old[2][idx]))
-                    init_new_t = ray_new[0][idx]
-                    init_new_x = ray_new[1][idx]
-                    init_new_z = ray_new[2][idx]
-                    init_old_t = ray_old[0][idx]
-                    init_old_x = ray_old[1][idx]
-                    init_old_z = ray_old[2][idx]
-                    init_done = True
-
-                new_t.append(ray_new[0][idx] - init_new_t)
-                new_x.append(ray_new[1][idx] - init_new_x)
-                new_z.append(ray_new[2][idx] - init_new_z)
-
-                old_t.append(ray_old[0][idx] - init_old_t)
-                old_x.append(ray_old[1][idx] - init_old_x)
-                old_z.append(ray_old[2][idx] - init_old_z)
-
-            # logger.debug("end z: %s/%s" % (new_z[-1], old_z[-1]))
-
-            if (len(new_t) == 0) or (len(old_t) == 0):
-                self.new_rays.append(np.array([list(), list(), list()]))
-                self.old_rays.append(np.array([list(), list(), list()]))
-                return
-
-            new_is_longer = False
-            min_time = new_t[-1]
-            if new_t[-1] > old_t[-1]:
-                min_time = old_t[-1]
-                new_is_longer = True
-            # logger.debug("new is longer: %s" % new_is_longer)
-            # logger.debug("min time: %s" % min_time)
-
-            n_t = list()
-            n_x = list()
-            n_z = list()
-
-            # stop to the minimum common time
-            for idx in range(len(new_t)):
-                if new_t[idx] > min_time:
-                    break
-
-                n_t.append(new_t[idx])
-                n_x.append(new_x[idx])
-                n_z.append(new_z[idx])
-
-            o_t = list()
-            o_x = list()
-            o_z = list()
-
-            # stop to the minimum common time
-            for idx in range(len(old_t)):
-                if old_t[idx] > min_time:
-                    break
-
-                o_t.append(old_t[idx])
-                o_x.append(old_x[idx])
-                o_z.append(old_z[idx])
-
-            self.new_rays.append(np.array([n_t, n_x, n_z]))
-            self.old_rays.append(np.array([o_t, o_x, o_z]))
+        nr_rays = len(self.new_tp.rays)
+        if len(self.old_tp.rays) < nr_rays:
+            raise RuntimeError("the old traced profile has less rays: %d < %d" % (len(self.old_tp.rays), nr_rays))
+        new_rays = np.stack([self.new_tp.rays[ang] for ang in range(nr_rays)])
+        old_rays = np.stack([self.old_tp.rays[ang] for ang in range(nr_rays)])
+        if new_rays.shape != old_rays.shape:
+            raise RuntimeError("traced profiles with different resampling: %s vs. %s"
+                               % (new_rays.shape, old_rays.shape))
+
+        new_zeroed, old_zeroed, common, new_kept, old_kept = self.common_rays(new_rays, old_rays)
+
+        self.new_rays = list()
+        self.old_rays = list()
+        for ang in range(nr_rays):
+            if not new_kept[ang].any():
+                logger.debug("no common samples for angle %d" % ang)
+            self.new_rays.append(new_zeroed[ang][:, new_kept[ang]])
+            self.old_rays.append(old_zeroed[ang][:, old_kept[ang]])
+
+        # batched interpolation of the old rays at the new travel times: the rays are laid end to end
+        # by shifting each angle's travel times by an offset larger than any ray duration
+        ang_old, _ = np.nonzero(common)
+        ang_new, _ = np.nonzero(new_kept)
+        old_t = old_zeroed[:, 0][common]
+        new_t = new_zeroed[:, 0][new_kept]
+        offset = 2.0 * max(np.abs(old_t).max(initial=0.0), np.abs(new_t).max(initial=0.0)) + 1.0
+        old_t_shifted = old_t + ang_old * offset
+        new_t_shifted = new_t + ang_new * offset
+        old_x_at_t = np.interp(new_t_shifted, old_t_shifted, old_zeroed[:, 1][common]) if old_t.size else new_t * np.nan
+        old_z_at_t = np.interp(new_t_shifted, old_t_shifted, old_zeroed[:, 2][common]) if old_t.size else new_t * np.nan
+
+        counts = new_kept.sum(axis=1)
+        positions = (np.cumsum(new_kept, axis=1) - 1)[new_kept]
+        self.diffs = np.full((nr_rays, counts.max(initial=0), 3), np.nan)
+        self.diffs[ang_new, positions, 0] = new_t
+        self.diffs[ang_new, positions, 1] = new_zeroed[:, 1][new_kept] - old_x_at_t
+        self.diffs[ang_new, positions, 2] = new_zeroed[:, 2][new_kept] - old_z_at_t
+
+        return self.diffs
@@ -9,7 +9,66 @@ class RayTracing:
 
     @classmethod
     def get_svp_layer_parameters(cls, launch_angle_radians, depths, speeds):
-        return cls.get_svp_layer_parameters_slow(launch_angle_radians, depths, speeds)
+        return cls.get_svp_layer_parameters_fast(launch_angle_radians, depths, speeds)
+
+    @classmethod
+    def get_svp_layer_parameters_fast(cls, launch_angle_radians, depths, speeds):
+        """Vectorized version of get_svp_layer_parameters_slow
+
+        If an array of launch angles is passed, the returned parameters are 2-D arrays (angles by layers).
+        """
+        speed = np.array(speeds, np.float64)  # need double precision for this computation
+        depth = np.array(depths, np.float64)
+        depth[0] = 0.0  # assume zero for top layer
+
+        angles = np.asarray(launch_angle_radians, np.float64)
+        gamma_0 = angles.reshape(-1, 1)
+
+        delta_depth = np.diff(depth)
+        gradient = np.diff(speed) / delta_depth
+
+        # Snell's law: the ray parameter is constant through the layers, once a ray is refracted back
+        # (no valid arcsin) all the deeper layers are invalid
+        gamma = arcsin((speed / speed[0]) * sin(gamma_0))
+        gamma[:, 0] = gamma_0[:, 0]
+        gamma[np.logical_or.accumulate(np.isnan(gamma), axis=1)] = np.nan
+
+        gamma_top = gamma[:, :-1]
+        gamma_bottom = gamma[:, 1:]
+        nadir = gamma_top == 0  # nadir beam (could cause division by zero errors below)
+        no_gradient = np.logical_and(gradient == 0, ~nadir)
+        curved = ~np.logical_or(nadir, no_gradient)
+
+        delta_time = np.empty(gamma_top.shape, np.float64)
+        delta_range = np.empty(gamma_top.shape, np.float64)
+        radius = np.zeros(gamma.shape, np.float64)  # the last radius doesn't get computed
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed_top = np.broadcast_to(speed[:-1], gamma_top.shape)
+            speed_bottom = np.broadcast_to(speed[1:], gamma_top.shape)
+            layer_gradient = np.broadcast_to(gradient, gamma_top.shape)
+            layer_depth = np.broadcast_to(delta_depth, gamma_top.shape)
+
+            delta_time[nadir] = layer_depth[nadir] / ((speed_bottom[nadir] + speed_top[nadir]) / 2.0)
+            delta_range[nadir] = 0.0
+
+            delta_time[no_gradient] = layer_depth[no_gradient] / (speed_top[no_gradient] *
+                                                                  cos(gamma_top[no_gradient]))
+            delta_range[no_gradient] = layer_depth[no_gradient] * tan(gamma_top[no_gradient])
+
+            layer_radius = speed_top[curved] / (layer_gradient[curved] * sin(gamma_top[curved]))
+            radius[:, :-1][curved] = layer_radius
+            delta_time[curved] = log(tan(gamma_bottom[curved] / 2.0) / tan(gamma_top[curved] / 2.0)) / \
+                layer_gradient[curved]
+            delta_range[curved] = layer_radius * (cos(gamma_top[curved]) - cos(gamma_bottom[curved]))
+
+        total_time = np.zeros(gamma.shape, np.float64)
+        total_range = np.zeros(gamma.shape, np.float64)
+        total_time[:, 1:] = np.cumsum(delta_time, axis=1)
+        total_range[:, 1:] = np.cumsum(delta_range, axis=1)
+
+        if angles.ndim == 0:
+            return gradient, gamma[0], radius[0], total_time[0], total_range[0]
+        return gradient, gamma, radius, total_time, total_range
 
     @classmethod
     def get_svp_layer_parameters_slow(cls, launch_angle_radians, depths, speeds):
@@ -54,6 +113,70 @@ class RayTracing:
 
     @classmethod
     def ray_trace(cls, travel_times, depths, speeds, params, b_project=False):
+        """Return an array of (depth, range) for all the travel times, with -1 to denote out of range"""
+        return cls.ray_trace_fast(travel_times, depths, speeds, params, b_project=b_project)
+
+    @classmethod
+    def ray_trace_fast(cls, travel_times, depths, speeds, params, b_project=False):
+        """Vectorized version of ray_trace_slow, evaluating all the travel times at once"""
+        nr_layers = len(depths) - 1
+
+        speed = np.array(speeds, np.float64).ravel()
+        depth = np.array(depths, np.float64).ravel()
+        depth[0] = 0.0  # assume zero for top layer
+
+        gradient, gamma, radius, total_time, total_range = params
+        travel_times = np.atleast_1d(np.asarray(travel_times, np.float64))
+
+        ret = np.zeros([len(travel_times), 2]) - 1.0  # create an array where -1 denotes out of range
+        nr_end_layers = np.maximum(total_time.searchsorted(travel_times) - 1, 0)
+        in_range = (nr_end_layers < nr_layers) | b_project  # SVP deep enough
+        if not in_range.any():
+            return ret
+
+        times = travel_times[in_range]
+        layer = nr_end_layers[in_range]
+        tau = times - total_time[layer]
+        layer_gamma = gamma[layer]
+        final_depth = np.empty(times.shape, np.float64)
+        final_range = np.empty(times.shape, np.float64)
+
+        # Note the last radius doen't get computed but that isn't important
+        # we always want to be in the last layer, so we use the comptutations at the next to last layer
+        # and interpolate to the depth/time which is before the end of the last layer
+        straight = radius[layer] == 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+
+            # straight path: interpolate the speed at the travel time, or project the last speed to infinite depth
+            st_layer = layer[straight]
+            next_layer = np.minimum(st_layer + 1, nr_layers)
+            t_top = total_time[st_layer]
+            t_bottom = total_time[next_layer]
+            s_top = speed[st_layer]
+            s_bottom = speed[next_layer]
+            st_times = times[straight]
+            end_speed = np.where(st_times < t_top, s_top,
+                                 np.where(st_times >= t_bottom, s_bottom,
+                                          (s_bottom - s_top) / (t_bottom - t_top) * (st_times - t_top) + s_top))
+            end_speed[st_layer >= nr_layers] = s_top[st_layer >= nr_layers]
+            avg_speed = (s_top + end_speed) / 2.0
+            final_depth[straight] = avg_speed * tau[straight] * cos(layer_gamma[straight]) + depth[st_layer]
+            final_range[straight] = avg_speed * tau[straight] * sin(layer_gamma[straight]) + \
+                total_range[st_layer]
+
+            # curved path
+            cu_layer = layer[~straight]
+            cu_gamma = layer_gamma[~straight]
+            end_gamma = 2 * arctan(tan(cu_gamma / 2.0) * exp(gradient[cu_layer] * tau[~straight]))
+            final_depth[~straight] = radius[cu_layer] * (sin(end_gamma) - sin(cu_gamma)) + depth[cu_layer]
+            final_range[~straight] = radius[cu_layer] * (-cos(end_gamma) + cos(cu_gamma)) + total_range[cu_layer]
+
+        ret[in_range, 0] = final_depth
+        ret[in_range, 1] = final_range
+        return ret
+
+    @classmethod
+    def ray_trace_slow(cls, travel_times, depths, speeds, params, b_project=False):
 
         nr_layers = len(depths) - 1
 
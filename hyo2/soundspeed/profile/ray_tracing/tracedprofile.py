@@ -6,155 +6,180 @@ from scipy.interpolate import interp1d
 logger = logging.getLogger(__name__)
 
 
+class TracedRays:
+    """Read-only sequence of the rays of a traced profile, resampled on first access"""
+
+    def __init__(self, tp):
+        self._tp = tp
+        self._cache = dict()
+
+    def __len__(self):
+        return len(self._tp.angles)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        nr_rays = len(self)
+        if idx < 0:
+            idx += nr_rays
+        if (idx < 0) or (idx >= nr_rays):
+            raise IndexError("invalid ray index: %d (total rays: %d)" % (idx, nr_rays))
+
+        if idx not in self._cache:
+            self._cache[idx] = self._tp.resample_ray(idx)
+        return self._cache[idx]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def clear(self):
+        self._cache.clear()
+
+
 class TracedProfile:
 
-    def __init__(self, ssp, half_swath=65, avg_depth=10000, tss_depth=None, tss_value=None):
+    def __init__(self, ssp, half_swath=65, avg_depth=10000, tss_depth=None, tss_value=None,
+                 resolution=0.2, max_depth=5000.0, interp_kind='cubic'):
         # PyDateTime_IMPORT
         self.avg_depth = avg_depth
         self.half_swath = half_swath
 
-        # select samples for the ray tracing (must be deeper than the transducer depth)
-        depths = list()
-        speeds = list()
-        if (tss_depth is not None) and (tss_value is not None):
-            depths.append(tss_depth)
-            speeds.append(tss_value)
+        if interp_kind not in ['linear', 'cubic']:
+            raise RuntimeError("invalid interpolation kind: %s" % interp_kind)
+        if (resolution <= 0) or (max_depth <= 0):
+            raise RuntimeError("invalid resampling: resolution %s, max depth %s" % (resolution, max_depth))
+        self.resolution = resolution
+        self.max_depth = max_depth
+        self.interp_kind = interp_kind
 
+        # select samples for the ray tracing (must be deeper than the transducer depth)
         vi = ssp.proc_valid
+        depths = ssp.proc.depth[vi].astype(np.float64)
+        speeds = ssp.proc.speed[vi].astype(np.float64)
 
-        for z_idx in range(0, len(ssp.proc.depth[vi])):
-
-            # skip samples at depth less than the draft
-            if tss_depth is not None:
-                if ssp.proc.depth[vi][z_idx] <= tss_depth:
-                    # logger.debug("skipping sample at depth: %.1f" % ssp.proc.depth[z_idx])
-                    continue
+        # skip samples at depth less than the draft
+        if tss_depth is not None:
+            deeper = depths > tss_depth
+            depths = depths[deeper]
+            speeds = speeds[deeper]
 
-            depths.append(ssp.proc.depth[vi][z_idx])
-            speeds.append(ssp.proc.speed[vi][z_idx])
+        # stop after the first sample deeper than the avg depth (safer)
+        below_avg = np.nonzero(depths > self.avg_depth)[0]
+        if below_avg.size > 0:
+            depths = depths[:below_avg[0] + 1]
+            speeds = speeds[:below_avg[0] + 1]
 
-            # stop after the first sample deeper than the avg depth (safer)
-            if ssp.proc.depth[vi][z_idx] > self.avg_depth:
-                break
+        if (tss_depth is not None) and (tss_value is not None):
+            depths = np.insert(depths, 0, tss_depth)
+            speeds = np.insert(speeds, 0, tss_value)
 
         # remove extension value (if any)
-        if len(depths) > 3:
+        if depths.size > 3:
             if (depths[-1] - depths[-2]) > 1000:
                 logger.info("removed latest extension depth: %s" % depths[-1])
-                del depths[-1]
+                depths = depths[:-1]
+                speeds = speeds[:-1]
+
+        if depths.size == 0:
+            raise RuntimeError("invalid profile with zero valid depth values")
 
         logger.info("profile timestamp: %s" % ssp.meta.utc_time)
-        logger.debug("valid samples: %d" % (len(depths)), )
+        logger.debug("valid samples: %d" % (depths.size, ))
         logger.debug("depth: min %.2f, max %.2f" % (depths[0], depths[-1]))
-        # logger.debug("depths: %s" % depth)
-        # logger.debug("speeds: %s" % speed)
-
-        # ray-trace a few angles (ref: Lurton, An Introduction to UA, p.50-52)
-        self.rays = list()
-        self.harmonic_means = list()
-        for angle in np.arange(0, int(math.ceil(self.half_swath + 1))):
-
-            # ray angles
-            beta = list()
-            beta.append(math.radians(90.0 - angle))
-            total_z = list()
-            total_z.append(depths[0])
-            total_x = list()
-            total_x.append(0)
-            total_t = list()  # total travel time
-            total_t.append(0)
-
-            # logger.debug("angle %d: beta0 %s" % (angle, math.degrees(beta[0])))
-
-            for idx in range(len(depths) - 1):
-
-                # calculate delta (next - current)
-                dz = depths[idx+1] - depths[idx]
-                dc = speeds[idx+1] - speeds[idx]
-                # logger.debug("%s: dy %s, dc %s" % (x, dy, dc))
-
-                if dc == 0:  # "constant speed" case: no curvature
-
-                    if dz == 0:  # if (dc == 0) and (dy == 0):
-
-                        # logger.debug("duplicated point: #%d" % idx)
-                        beta.append(beta[idx])  # beta does not change
-                        continue
-
-                    # gradient = dc/dy
-                    beta.append(beta[idx])  # beta does not change
-                    dx = dz / (math.tan(beta[idx+1]))  # no curvature!
-                    dt = (((dx**2)+(dz**2))**.5) / speeds[idx+1]
-
-                elif dz == 0:  # "same depth" case: just adjust the ray angle
-
-                    beta.append(math.acos((speeds[idx + 1] / speeds[idx]) * (math.cos(beta[idx]))))
-                    continue
-
-                else:  # if (dc != 0) and (dz != 0):
-
-                    gradient = dc / dz  # Lurton, (2.64)
-                    if math.cos(beta[idx]) == 0:
-                        curve = 0
-                    else:  # if math.cos(beta[x]) != 0:
-                        curve = speeds[idx] / (gradient * math.cos(beta[idx]))  # Lurton, (2.66)
-
-                    beta_cos = speeds[idx + 1] * (math.cos(beta[idx])) / speeds[idx]
-                    if beta_cos > 1.0:
-                        logger.warning("angle %d, sample %d -> invalid beta cos: %s" %
-                                       (angle, idx, beta_cos))
-                        beta_cos = 1.0
-                    if beta_cos < -1.0:
-                        logger.warning("angle %d, sample %d -> invalid beta cos: %s" %
-                                       (angle, idx, beta_cos))
-                        beta_cos = -1.0
-
-                    beta.append(math.acos(beta_cos))  # Derived from Lurton, (2.65)
-
-                    dx = curve * ((math.sin(beta[idx])) - (math.sin(beta[idx + 1])))  # Lurton, (2.67)
-                    dt = abs((1 / gradient) *
-                             math.log(
-                                (speeds[idx + 1] / speeds[idx]) *
-                                (abs((1 + math.sin(beta[idx])) / (1 + math.sin(beta[idx + 1]))))))  # Lurton, (2.70)
-
-                total_z.append(total_z[-1] + dz)
-                total_x.append(total_x[-1] + dx)
-                total_t.append(total_t[-1] + dt)
-
-            # logger.debug("z:\n%s" % total_z)
-            # logger.debug("x:\n%s" % total_x)
-            # logger.debug("t:\n%s" % total_t)
-
-            if len(depths) > 1:
-                harm_mean = (total_z[-1] - total_z[0]) / (total_t[-1] - total_t[0])
-            elif len(depths) == 1:
-                harm_mean = depths[0]
-            else:
-                raise RuntimeError("invalid profile with zero valid depth values")
-            self.harmonic_means.append(harm_mean)
-
-            # interpolate between 0 and 5000 meters with decimetric resolution
-            if len(depths) > 1:
-                interp_z = np.linspace(0, 5000, num=25001, endpoint=True)
-                fx = interp1d(total_z, total_x, kind='cubic', bounds_error=False, fill_value=np.nan)
-                interp_x = fx(interp_z)
-                ft = interp1d(total_z, total_t, kind='cubic', bounds_error=False, fill_value=np.nan)
-                interp_t = ft(interp_z)
-            elif len(depths) == 1:
-                interp_z = total_z
-                interp_x = total_x
-                interp_t = total_t
-            else:
-                raise RuntimeError("invalid profile with zero valid depth values")
-
-            self.rays.append(np.array([interp_t, interp_x, interp_z]))
-
-        logger.debug("rays: %d (%d samples per-ray)" % (len(self.rays), len(self.rays[0][0])))
+
+        # ray-trace all the angles at once (ref: Lurton, An Introduction to UA, p.50-52)
+        self.angles = np.arange(0, int(math.ceil(self.half_swath + 1)))
+        self.trace(depths, speeds)
+
+        if depths.size > 1:
+            self.harmonic_means = list((self.total_z[-1] - self.total_z[0]) /
+                                       (self.total_t[:, -1] - self.total_t[:, 0]))
+        else:
+            self.harmonic_means = [depths[0]] * len(self.angles)
+
+        self.rays = TracedRays(self)
+
+        logger.debug("rays: %d (%d nodes per-ray)" % (len(self.rays), self.total_z.size))
         self.date_time = ssp.meta.utc_time
         self.latitude = ssp.meta.latitude
         self.longitude = ssp.meta.longitude
         self.data = [depths, speeds]
 
+    def trace(self, depths, speeds):
+        """Trace all the angles against all the layers, storing the ray nodes as (angles x nodes) arrays"""
+        # calculate delta (next - current)
+        dz = np.diff(depths)
+        dc = np.diff(speeds)
+
+        # Snell's invariant: cos(beta)/c is constant along the ray, unless the ray turns horizontal:
+        # then the clipping to 1.0 restarts the invariant from the layer speed (running minimum)
+        betas = np.radians(90.0 - self.angles.astype(np.float64))[:, np.newaxis]
+        invariant = np.minimum(np.cos(betas) / speeds[0], 1.0 / speeds[np.newaxis, 1:])
+        invariant = np.minimum.accumulate(invariant, axis=1)
+        beta_cos = speeds[np.newaxis, 1:] * invariant
+        nr_invalid = np.count_nonzero(beta_cos > 1.0)
+        if nr_invalid > 0:
+            logger.warning("invalid beta cos: %d (angle x sample) cases" % nr_invalid)
+        beta = np.hstack([betas * np.ones((self.angles.size, 1)), np.arccos(np.clip(beta_cos, -1.0, 1.0))])
+
+        # only layers with a depth change add a node (the "same depth" case just adjusts the ray angle)
+        layers = dz != 0
+        dz = dz[layers]
+        dc = dc[layers]
+        c0 = speeds[:-1][layers]
+        c1 = speeds[1:][layers]
+        beta0 = beta[:, :-1][:, layers]
+        beta1 = beta[:, 1:][:, layers]
+        curved = dc != 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # "constant speed" case: no curvature
+            dx = dz / np.tan(beta1)
+            dt = np.sqrt(dx ** 2 + dz ** 2) / c1
+
+            # curvature case
+            gradient = np.where(curved, dc / np.where(curved, dz, 1.0), 1.0)  # Lurton, (2.64)
+            cos_beta0 = np.cos(beta0)
+            curve = np.where(cos_beta0 == 0, 0.0,
+                             c0 / (gradient * np.where(cos_beta0 == 0, 1.0, cos_beta0)))  # Lurton, (2.66)
+            sin_beta0 = np.sin(beta0)
+            sin_beta1 = np.sin(beta1)
+            curved_dx = curve * (sin_beta0 - sin_beta1)  # Lurton, (2.67)
+            curved_dt = np.abs((1 / gradient) *
+                               np.log((c1 / c0) * np.abs((1 + sin_beta0) / (1 + sin_beta1))))  # Lurton, (2.70)
+
+        dx = np.where(curved, curved_dx, dx)
+        dt = np.where(curved, curved_dt, dt)
+
+        zeros = np.zeros((self.angles.size, 1))
+        self.total_z = depths[0] + np.concatenate([[0.0], np.cumsum(dz)])
+        self.total_x = np.cumsum(np.hstack([zeros, dx]), axis=1)
+        self.total_t = np.cumsum(np.hstack([zeros, dt]), axis=1)
+
+    def resample_ray(self, ray_idx):
+        """Resample a ray on the regular depth grid, returning an array of [t, x, z] rows"""
+        if self.total_z.size == 1:
+            return np.array([self.total_t[ray_idx], self.total_x[ray_idx], self.total_z])
+
+        nr_samples = int(round(self.max_depth / self.resolution)) + 1
+        interp_z = np.linspace(0, self.max_depth, num=nr_samples, endpoint=True)
+        interp_x = np.full(nr_samples, np.nan)
+        interp_t = np.full(nr_samples, np.nan)
+
+        # the interpolation is only evaluated within the traced depth range
+        kind = self.interp_kind
+        if (kind == 'cubic') and (self.total_z.size < 4):
+            kind = 'linear'
+        inside = (interp_z >= self.total_z.min()) & (interp_z <= self.total_z.max())
+        fx = interp1d(self.total_z, self.total_x[ray_idx], kind=kind, bounds_error=False, fill_value=np.nan)
+        interp_x[inside] = fx(interp_z[inside])
+        ft = interp1d(self.total_z, self.total_t[ray_idx], kind=kind, bounds_error=False, fill_value=np.nan)
+        interp_t[inside] = ft(interp_z[inside])
+
+        return np.array([interp_t, interp_x, interp_z])
+
     def debug_rays(self, ray_idx=0):
         nr_rays = len(self.rays)
         if (ray_idx < 0) or (ray_idx >= nr_rays):
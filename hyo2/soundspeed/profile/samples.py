@@ -4,64 +4,262 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class SamplesArray(np.ndarray):
+    """Array of samples that increments the version counter of its Samples at each in-place change"""
+
+    def __array_finalize__(self, obj):
+        # views (and copies) share the counter of the array from which they are created
+        self.counter = getattr(obj, 'counter', None)
+
+    def changed(self):
+        if self.counter is not None:
+            self.counter[0] += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed()
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        # the ufunc results are plain arrays, only the arrays modified in-place are tracked
+        args = [x.view(np.ndarray) if isinstance(x, SamplesArray) else x for x in inputs]
+        if out is not None:
+            kwargs['out'] = tuple([x.view(np.ndarray) if isinstance(x, SamplesArray) else x for x in out])
+
+        result = getattr(ufunc, method)(*args, **kwargs)
+
+        modified = list(out) if out is not None else list()
+        if method == 'at':
+            modified.append(inputs[0])
+        for x in modified:
+            if isinstance(x, SamplesArray):
+                x.changed()
+
+        if out is None:
+            return result
+        return out[0] if len(out) == 1 else out
+
+    def fill(self, value):
+        super().fill(value)
+        self.changed()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.changed()
+
+    def put(self, *args, **kwargs):
+        super().put(*args, **kwargs)
+        self.changed()
+
+
+def _samples_field(idx):
+    """Property for the view on the row of a field in the samples buffer (None if not initialized)"""
+
+    def getter(self):
+        if not self._present[idx]:
+            return None
+        if self._views is None:
+            self._views = [self._buffer[i, :self._size] for i in range(len(self.fields))]
+        return self._views[idx]
+
+    def setter(self, value):
+        self._set_field(idx, value)
+
+    return property(getter, setter)
+
+
 class Samples:
+    """Samples of a profile section
+
+    All the fields are rows of a single buffer with spare capacity, and the attributes are views on them.
+    Assigning an array copies its values into the buffer (resizing the samples if its length differs).
+
+    Any change of the arrays (assignment or in-place) increments the version, invalidating the cached values.
+    """
+
+    fields = ['pressure', 'depth', 'speed', 'temp', 'conductivity', 'sal', 'source', 'flag']
+
+    pressure = _samples_field(0)
+    depth = _samples_field(1)
+    speed = _samples_field(2)
+    temp = _samples_field(3)
+    conductivity = _samples_field(4)
+    sal = _samples_field(5)
+    source = _samples_field(6)
+    flag = _samples_field(7)
+
     def __init__(self):
-        self.num_samples = 0
-        self.pressure = None
-        self.depth = None
-        self.speed = None
-        self.temp = None
-        self.conductivity = None
-        self.sal = None
-        self.source = None
-        self.flag = None
+        self._counter = [0]
+        self._cache = dict()
+        self._cache_version = -1
+
+        self._buffer = self._make_buffer(0)
+        self._present = [False] * len(self.fields)
+        self._size = 0
+        self._views = None
+
+    def _make_buffer(self, capacity):
+        buffer = np.zeros((len(self.fields), capacity)).view(SamplesArray)
+        buffer.counter = self._counter
+        return buffer
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_cache']
+        del state['_views']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = dict()
+        self._cache_version = -1
+        self._views = None
+        self._buffer.counter = self._counter
+
+    @property
+    def version(self):
+        """Counter of the changes of the samples"""
+        return self._counter[0]
+
+    def cached(self, key, func):
+        """Return the value calculated by func, cached (as read-only) until the samples change"""
+        if self._cache_version != self._counter[0]:
+            self._cache.clear()
+            self._cache_version = self._counter[0]
+
+        if key not in self._cache:
+            value = func()
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            self._cache[key] = value
+
+        return self._cache[key]
+
+    @property
+    def num_samples(self):
+        return self._size
+
+    @num_samples.setter
+    def num_samples(self, value):
+        self.resize(value)
+
+    @property
+    def capacity(self):
+        """Number of samples that can be stored without reallocating the buffer"""
+        return self._buffer.shape[1]
+
+    def reserve(self, capacity):
+        """Reallocate the buffer (if needed) to store at least the passed number of samples"""
+        if capacity <= self.capacity:
+            return
+
+        buffer = self._make_buffer(capacity)
+        buffer.view(np.ndarray)[:, :self._size] = self._buffer[:, :self._size]
+        self._buffer = buffer
+        self._views = None
+
+    def _grow(self, count):
+        if count > self.capacity:
+            # geometric growth: amortized constant time for the appended samples
+            self.reserve(max(count, 2 * self.capacity))
+
+    def _changed(self):
+        self._views = None
+        self._counter[0] += 1
+
+    def _set_field(self, idx, value):
+        if value is None:
+            self._present[idx] = False
+            self._changed()
+            return
+
+        values = np.asarray(value, dtype=np.float64).reshape(-1)
+        if values.size != self._size:
+            self.resize(values.size)
+        self._buffer.view(np.ndarray)[idx, :self._size] = values
+        self._present[idx] = True
+        self._changed()
+
+    def _init_field(self, idx):
+        self._buffer.view(np.ndarray)[idx, :self._size] = 0.0
+        self._present[idx] = True
+        self._changed()
 
     def init_pressure(self):
-        self.pressure = np.zeros(self.num_samples)
+        self._init_field(0)
 
     def init_depth(self):
-        self.depth = np.zeros(self.num_samples)
+        self._init_field(1)
 
     def init_speed(self):
-        self.speed = np.zeros(self.num_samples)
+        self._init_field(2)
 
     def init_temp(self):
-        self.temp = np.zeros(self.num_samples)
+        self._init_field(3)
 
     def init_conductivity(self):
-        self.conductivity = np.zeros(self.num_samples)
+        self._init_field(4)
 
     def init_sal(self):
-        self.sal = np.zeros(self.num_samples)
+        self._init_field(5)
 
     def init_source(self):
-        self.source = np.zeros(self.num_samples)
+        self._init_field(6)
 
     def init_flag(self):
-        self.flag = np.zeros(self.num_samples)
+        self._init_field(7)
 
     def resize(self, count):
-        """Resize the arrays (if present) to the new given number of elements"""
-        if self.num_samples == count:
+        """Resize the arrays (if present) to the new given number of elements (the new samples are zeros)"""
+        count = int(count)
+        if self._size == count:
             return
-        self.num_samples = count
-
-        if self.pressure is not None:
-            self.pressure = np.resize(self.pressure, count)
-        if self.depth is not None:
-            self.depth = np.resize(self.depth, count)
-        if self.speed is not None:
-            self.speed = np.resize(self.speed, count)
-        if self.temp is not None:
-            self.temp = np.resize(self.temp, count)
-        if self.conductivity is not None:
-            self.conductivity = np.resize(self.conductivity, count)
-        if self.sal is not None:
-            self.sal = np.resize(self.sal, count)
-        if self.source is not None:
-            self.source = np.resize(self.source, count)
-        if self.flag is not None:
-            self.flag = np.resize(self.flag, count)
+
+        self._grow(count)
+        if count > self._size:
+            self._buffer.view(np.ndarray)[:, self._size:count] = 0.0
+        self._size = count
+        self._changed()
+
+    def insert(self, index, **values):
+        """Insert samples before the passed index (or indices, as for numpy.insert)
+
+        The values are passed by field name (e.g., depth=..., speed=...) as scalars or arrays of the same size.
+        The fields without a passed value are zeros. Inserting at a single index (e.g., appending) does not
+        reallocate the buffer if there is spare capacity.
+        """
+        unknown = set(values.keys()) - set(self.fields)
+        if len(unknown) > 0:
+            raise RuntimeError("unknown samples fields: %s" % sorted(unknown))
+
+        nr_inserted = max([np.size(index)] + [np.size(value) for value in values.values()])
+        if np.ndim(index) > 0:
+            nr_inserted = np.size(index)
+
+        rows = np.zeros((len(self.fields), nr_inserted))
+        for name, value in values.items():
+            idx = self.fields.index(name)
+            rows[idx] = value
+            if not self._present[idx]:
+                self._init_field(idx)
+
+        size = self._size
+        self._grow(size + nr_inserted)
+        buffer = self._buffer.view(np.ndarray)
+        if np.ndim(index) == 0:
+            index = int(index)
+            if (index < 0) or (index > size):
+                raise RuntimeError("invalid insertion index: %s (samples: %s)" % (index, size))
+            buffer[:, index + nr_inserted:size + nr_inserted] = buffer[:, index:size]
+            buffer[:, index:index + nr_inserted] = rows
+        else:
+            buffer[:, :size + nr_inserted] = np.insert(buffer[:, :size], index, rows, axis=1)
+
+        self._size = size + nr_inserted
+        self._changed()
+
+    def append(self, **values):
+        """Append samples, passing the values by field name (see insert)"""
+        self.insert(self._size, **values)
 
     def __repr__(self):
         msg = "  <Samples>\n"
@@ -3,9 +3,12 @@ import os
 import re
 import copy
 import shutil
+import tempfile
+import threading
 import traceback
 import logging
-from typing import Optional, TYPE_CHECKING
+from contextlib import contextmanager
+from typing import Iterator, Optional, TYPE_CHECKING
 from appdirs import user_data_dir
 
 from hyo2.abc.lib.progress.abstract_progress import AbstractProgress
@@ -53,6 +56,12 @@ class SoundSpeedLibrary:
         self.ssp = None  # current profile
         self.ref = None  # reference profile
 
+        # project dbs: lazily opened and kept open (by db path) for the library lifetime
+        self._project_dbs = dict()
+        self._project_dbs_lock = threading.Lock()
+        # write-ahead logging of the project dbs (opt-in, since not working on network filesystems)
+        self.project_dbs_wal = False
+
         # take care of all the required folders
         self._data_folder = None
         self._releases_folder = None
@@ -106,6 +115,8 @@ class SoundSpeedLibrary:
             self.server.stop()
             self.server.join(2)
 
+        self.close_project_dbs()
+
         logger.info("** > LIB: closed!")
 
     # --- library, release, atlases, and projects folders
@@ -295,6 +306,7 @@ class SoundSpeedLibrary:
     @projects_folder.setter
     def projects_folder(self, value: str) -> None:
         """ Set the projects folder"""
+        self.close_project_dbs()
         self._projects_folder = value
 
     def open_projects_folder(self) -> None:
@@ -462,34 +474,40 @@ class SoundSpeedLibrary:
         self._retrieve_atlases()
 
     def _retrieve_atlases(self):
-        # retrieve atlases data for each retrieved profile
-        for pr in self.ssp.l:
-
-            if self.use_woa09() and self.has_woa09():
-                pr.woa09 = self.atlases.woa09.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                    dtstamp=pr.meta.utc_time)
-
-            if self.use_woa13() and self.has_woa13():
-                pr.woa13 = self.atlases.woa13.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                    dtstamp=pr.meta.utc_time)
-
-            if self.use_rtofs():
-                # noinspection PyBroadException
-                try:
-                    pr.rtofs = self.atlases.rtofs.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                        dtstamp=pr.meta.utc_time)
-                except Exception:
-                    pr.rtofs = None
-                    logger.warning("unable to retrieve RTOFS data")
-
-            if self.use_gomofs():
-                # noinspection PyBroadException
-                try:
-                    pr.gomofs = self.atlases.gomofs.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                          dtstamp=pr.meta.utc_time)
-                except Exception:
-                    pr.gomofs = None
-                    logger.warning("unable to retrieve GOMOFS data")
+        # retrieve atlases data for all the retrieved profiles at once
+        lats = [pr.meta.latitude for pr in self.ssp.l]
+        lons = [pr.meta.longitude for pr in self.ssp.l]
+        dtstamps = [pr.meta.utc_time for pr in self.ssp.l]
+
+        if self.use_woa09() and self.has_woa09():
+            results = self.atlases.woa09.query_many(lats=lats, lons=lons, dtstamps=dtstamps)
+            for pr, profiles in zip(self.ssp.l, results):
+                pr.woa09 = profiles
+
+        if self.use_woa13() and self.has_woa13():
+            results = self.atlases.woa13.query_many(lats=lats, lons=lons, dtstamps=dtstamps)
+            for pr, profiles in zip(self.ssp.l, results):
+                pr.woa13 = profiles
+
+        if self.use_rtofs():
+            # noinspection PyBroadException
+            try:
+                results = list(self.atlases.rtofs.query_many(lats=lats, lons=lons, dtstamps=dtstamps))
+            except Exception:
+                results = [None] * len(self.ssp.l)
+                logger.warning("unable to retrieve RTOFS data")
+            for pr, profiles in zip(self.ssp.l, results):
+                pr.rtofs = profiles
+
+        if self.use_gomofs():
+            # noinspection PyBroadException
+            try:
+                results = list(self.atlases.gomofs.query_many(lats=lats, lons=lons, dtstamps=dtstamps))
+            except Exception:
+                results = [None] * len(self.ssp.l)
+                logger.warning("unable to retrieve GOMOFS data")
+            for pr, profiles in zip(self.ssp.l, results):
+                pr.gomofs = profiles
 
     # --- receive data
 
@@ -1094,6 +1112,9 @@ class SoundSpeedLibrary:
         if not os.path.exists(old_db_path):
             raise RuntimeError("unable to locate the current project: %s" % old_db_path)
 
+        # closing the connection also checkpoints the write-ahead log into the db file
+        self.close_project_dbs(project=self.current_project)
+
         new_db_path = os.path.join(self.projects_folder, name + ".db")
         if os.path.exists(new_db_path):
             raise RuntimeError("the project already exists: %s" % new_db_path)
@@ -1116,8 +1137,54 @@ class SoundSpeedLibrary:
         if not os.path.exists(db_path):
             raise RuntimeError("unable to locate the project to delete: %s" % db_path)
 
+        self.close_project_dbs(project=name)
         os.remove(db_path)
 
+    @contextmanager
+    def project_db(self, project: Optional[str] = None) -> Iterator[ProjectDb]:
+        """Provide the shared connection to a project db (by default, the current one)
+
+        The db is opened at the first request and kept open. The access is serialized across threads
+        (e.g., listeners and server storing casts) by holding the db lock for the whole block.
+        """
+        if project is None:
+            project = self.current_project
+
+        db_path = ProjectDb.make_db_path(projects_folder=self.projects_folder, project_name=project)
+        while True:
+            with self._project_dbs_lock:
+                db = self._project_dbs.get(db_path)
+                if db is None:
+                    db = ProjectDb(projects_folder=self.projects_folder, project_name=project,
+                                   wal=self.project_dbs_wal)
+                    self._project_dbs[db_path] = db
+
+            db.lock.acquire()
+            # the db may have been closed (e.g., by a project switch) while waiting for its lock
+            if (self._project_dbs.get(db_path) is db) and (db.conn is not None):
+                break
+            db.lock.release()
+
+        try:
+            yield db
+        finally:
+            db.lock.release()
+
+    def close_project_dbs(self, project: Optional[str] = None) -> None:
+        """Close the shared connection to a project db (by default, all of them)"""
+        with self._project_dbs_lock:
+            if project is None:
+                db_paths = list(self._project_dbs.keys())
+            else:
+                db_paths = [ProjectDb.make_db_path(projects_folder=self.projects_folder, project_name=project), ]
+
+            for db_path in db_paths:
+                db = self._project_dbs.pop(db_path, None)
+                if db is None:
+                    continue
+                with db.lock:
+                    db.disconnect()
+
     def list_projects(self) -> list:
         """Return a list with all the available projects"""
         prj_list = list()
@@ -1137,19 +1204,17 @@ class SoundSpeedLibrary:
         if not self.has_ssp():
             raise RuntimeError("Data not loaded")
 
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-
-        # special case: synthetic multiple profiles, we just save the average profile
-        if (self.ssp.l[0].meta.sensor_type == Dicts.sensor_types['Synthetic']) and \
-                ((self.ssp.l[0].meta.probe_type == Dicts.probe_types['WOA09']) or
-                 (self.ssp.l[0].meta.probe_type == Dicts.probe_types['WOA13'])):
-            tmp_ssp = copy.deepcopy(self.ssp)
-            del tmp_ssp.l[1:]
-            success = db.remove_casts(tmp_ssp)
+        with self.project_db() as db:
+            # special case: synthetic multiple profiles, we just save the average profile
+            if (self.ssp.l[0].meta.sensor_type == Dicts.sensor_types['Synthetic']) and \
+                    ((self.ssp.l[0].meta.probe_type == Dicts.probe_types['WOA09']) or
+                     (self.ssp.l[0].meta.probe_type == Dicts.probe_types['WOA13'])):
+                tmp_ssp = copy.deepcopy(self.ssp)
+                del tmp_ssp.l[1:]
+                success = db.remove_casts(tmp_ssp)
 
-        else:
-            success = db.remove_casts(self.ssp)
-        db.disconnect()
+            else:
+                success = db.remove_casts(self.ssp)
 
         # take care of listeners
         if success:
@@ -1167,19 +1232,17 @@ class SoundSpeedLibrary:
         if not self.has_ssp():
             raise RuntimeError("Data not loaded")
 
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-
-        # special case: synthetic multiple profiles, we just save the average profile
-        if (self.ssp.l[0].meta.sensor_type == Dicts.sensor_types['Synthetic']) and \
-                ((self.ssp.l[0].meta.probe_type == Dicts.probe_types['WOA09']) or
-                 (self.ssp.l[0].meta.probe_type == Dicts.probe_types['WOA13'])):
-            tmp_ssp = copy.deepcopy(self.ssp)
-            del tmp_ssp.l[1:]
-            success = db.add_casts(tmp_ssp)
+        with self.project_db() as db:
+            # special case: synthetic multiple profiles, we just save the average profile
+            if (self.ssp.l[0].meta.sensor_type == Dicts.sensor_types['Synthetic']) and \
+                    ((self.ssp.l[0].meta.probe_type == Dicts.probe_types['WOA09']) or
+                     (self.ssp.l[0].meta.probe_type == Dicts.probe_types['WOA13'])):
+                tmp_ssp = copy.deepcopy(self.ssp)
+                del tmp_ssp.l[1:]
+                success = db.add_casts(tmp_ssp)
 
-        else:
-            success = db.add_casts(self.ssp)
-        db.disconnect()
+            else:
+                success = db.add_casts(self.ssp)
 
         # take care of listeners
         if success:
@@ -1195,74 +1258,90 @@ class SoundSpeedLibrary:
         if project is None:
             project = self.current_project
 
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=project)
-        lst = db.list_profiles()
-        db.disconnect()
+        with self.project_db(project=project) as db:
+            lst = db.list_profiles()
         return lst
 
     def db_retrieve_profile(self, pk: int) -> ProfileList:
         """Retrieve a profile by primary key"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        ssp = db.profile_by_pk(pk=pk)
-        db.disconnect()
+        with self.project_db() as db:
+            ssp = db.profile_by_pk(pk=pk)
         return ssp
 
-    def db_import_data_from_db(self, input_db_path: str) -> tuple:
-        """Import profiles from another db"""
-        in_projects_folder = os.path.dirname(input_db_path)
-        in_project_name = os.path.splitext(os.path.basename(input_db_path))[0]
-        logger.debug('input: folder: %s, db: %s' % (in_projects_folder, in_project_name))
-
-        in_db = ProjectDb(projects_folder=in_projects_folder, project_name=in_project_name)
-
-        if in_db.get_db_version() > 3:
-            raise RuntimeError("unsupported db version: %s" % in_db.get_db_version())
-        logger.debug('input project db version: %s' % in_db.get_db_version())
-
-        cur_db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-
-        in_lst = in_db.list_profiles()
-        cur_lst = cur_db.list_profiles()
-        logger.debug('profiles to import: %s' % len(in_lst))
-        logger.debug('current profiles: %s' % len(cur_lst))
-
-        # create list of current pks
-        cur_pks = list()
-        for cur_ssp in cur_lst:
-            cur_pks.append("%s;%s" % (cur_ssp[1], cur_ssp[2]))
-        # print(cur_pks)
-
-        # copy after having checked that the profile is not already there
-        pk_issues = list()
-        pk_done = list()
+    def db_retrieve_profiles(self, pks: list) -> list:
+        """Retrieve many profiles by primary keys"""
+        with self.project_db() as db:
+            ssps = db.profiles_by_pks(pks=pks)
+        return ssps
+
+    def db_profiles_in_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float,
+                            start_time: Optional['datetime'] = None, end_time: Optional['datetime'] = None) -> list:
+        """Retrieve the (pk, timestamp, position) of the profiles in a bounding box and time window"""
+        with self.project_db() as db:
+            lst = db.casts_in_bbox(min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat,
+                                   start_time=start_time, end_time=end_time)
+        return lst
 
-        for in_ssp in in_lst:
+    def db_profiles_within_radius(self, longitude: float, latitude: float, radius: float,
+                                  start_time: Optional['datetime'] = None,
+                                  end_time: Optional['datetime'] = None) -> list:
+        """Retrieve the (pk, timestamp, position, distance) of the profiles within a radius (in meters)"""
+        with self.project_db() as db:
+            lst = db.casts_within_radius(longitude=longitude, latitude=latitude, radius=radius,
+                                         start_time=start_time, end_time=end_time)
+        return lst
 
-            in_key = "%s;%s" % (in_ssp[1], in_ssp[2])
-            # print(in_key)
-            if in_key in cur_pks:
-                pk_issues.append(in_ssp[0])
-                continue
+    def db_nearest_profiles(self, longitude: float, latitude: float, n: int = 1,
+                            start_time: Optional['datetime'] = None, end_time: Optional['datetime'] = None,
+                            max_radius: Optional[float] = None) -> list:
+        """Retrieve the (pk, timestamp, position, distance) of the n profiles nearest to a position"""
+        with self.project_db() as db:
+            lst = db.nearest_casts(longitude=longitude, latitude=latitude, n=n, start_time=start_time,
+                                   end_time=end_time, max_radius=max_radius)
+        return lst
 
-            ssp = in_db.profile_by_pk(pk=in_ssp[0])
-            success = cur_db.add_casts(ssp)
-            if success:
-                pk_done.append(in_ssp[0])
+    def db_import_data_from_db(self, input_db_path: str) -> tuple:
+        """Import profiles from another db
+
+        The input db is not modified: if older than the current version, a temporary updated copy is merged.
+        """
+        in_version = ProjectDb.read_db_version(input_db_path)
+        if in_version is None:
+            raise RuntimeError("unable to read the project db version: %s" % input_db_path)
+        logger.debug('input project db version: %s' % in_version)
+
+        with self.project_db() as cur_db:
+            cur_version = cur_db.cur_version
+        if in_version > cur_version:
+            raise RuntimeError("unsupported db version: %s" % in_version)
+
+        tmp_folder = None
+        merge_path = input_db_path
+        try:
+            if in_version < cur_version:
+                tmp_folder = tempfile.mkdtemp()
+                merge_path = ProjectDb.updated_copy(db_path=input_db_path, projects_folder=tmp_folder)
+                if merge_path is None:
+                    raise RuntimeError("unable to update a copy of the project db: %s" % input_db_path)
 
-            else:
-                pk_issues.append(in_ssp[0])
+            with self.project_db() as cur_db:
+                ret = cur_db.merge_db(input_db_path=merge_path, progress=self.progress)
 
-            continue
+        finally:
+            if tmp_folder is not None:
+                shutil.rmtree(tmp_folder, ignore_errors=True)
 
-        in_db.disconnect()
+        if ret is None:
+            raise RuntimeError("unable to merge the project db: %s" % input_db_path)
+        pk_issues, pk_done = ret
+        logger.debug('imported profiles: %d, issues: %d' % (len(pk_done), len(pk_issues)))
 
         return pk_issues, pk_done
 
     def db_timestamp_list(self) -> list:
         """Retrieve a list with the timestamp of all the profiles"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        lst = db.timestamp_list()
-        db.disconnect()
+        with self.project_db() as db:
+            lst = db.timestamp_list()
         return lst
 
     def profile_stats(self) -> str:
@@ -1364,9 +1443,8 @@ class SoundSpeedLibrary:
 
     def delete_db_profile(self, pk: int) -> bool:
         """Retrieve a profile by primary key"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        ret = db.delete_profile_by_pk(pk=pk)
-        db.disconnect()
+        with self.project_db() as db:
+            ret = db.delete_profile_by_pk(pk=pk)
         return ret
 
     def ray_tracing_comparison(self, pk1: int, pk2: int) -> None:
@@ -1493,52 +1571,45 @@ class SoundSpeedLibrary:
     # plotting
 
     def raise_plot_window(self) -> None:
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        _ = db.plot.raise_window()
-        db.disconnect()
+        with self.project_db() as db:
+            _ = db.plot.raise_window()
 
     def map_db_profiles(self, pks: Optional[list] = None, show_plot: Optional[bool] = False) -> bool:
         """List the profile on the db"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        ret = db.plot.map_profiles(pks=pks, show_plot=show_plot)
-        db.disconnect()
+        with self.project_db() as db:
+            ret = db.plot.map_profiles(pks=pks, show_plot=show_plot)
         return ret
 
     def save_map_db_profiles(self) -> bool:
         """List the profile on the db"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        ret = db.plot.map_profiles(save_fig=True, output_folder=self.outputs_folder)
-        db.disconnect()
+        with self.project_db() as db:
+            ret = db.plot.map_profiles(save_fig=True, output_folder=self.outputs_folder)
         return ret
 
     def aggregate_plot(self, dates: list) -> bool:
         """Create an aggregate plot"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        success = db.plot.aggregate_plot(dates=dates, output_folder=self.outputs_folder, save_fig=False)
-        db.disconnect()
+        with self.project_db() as db:
+            success = db.plot.aggregate_plot(dates=dates, output_folder=self.outputs_folder, save_fig=False)
         return success
 
     def save_aggregate_plot(self, dates: list) -> bool:
         """Create an aggregate plot"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        success = db.plot.aggregate_plot(dates=dates, output_folder=self.outputs_folder, save_fig=True)
-        db.disconnect()
+        with self.project_db() as db:
+            success = db.plot.aggregate_plot(dates=dates, output_folder=self.outputs_folder, save_fig=True)
         return success
 
     def plot_daily_db_profiles(self) -> bool:
         """Plot the profile on the db by day"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        success = db.plot.daily_plots(project_name=self.current_project,
-                                      output_folder=self.outputs_folder, save_fig=False)
-        db.disconnect()
+        with self.project_db() as db:
+            success = db.plot.daily_plots(project_name=self.current_project,
+                                          output_folder=self.outputs_folder, save_fig=False)
         return success
 
     def save_daily_db_profiles(self) -> bool:
         """Save figure with the profile on the db by day"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        success = db.plot.daily_plots(project_name=self.current_project,
-                                      output_folder=self.outputs_folder, save_fig=True)
-        db.disconnect()
+        with self.project_db() as db:
+            success = db.plot.daily_plots(project_name=self.current_project,
+                                          output_folder=self.outputs_folder, save_fig=True)
         return success
 
     # exporting
@@ -1546,12 +1617,11 @@ class SoundSpeedLibrary:
     def export_db_profiles_metadata(self, ogr_format: Optional[int] = GdalAux.ogr_formats['ESRI Shapefile'],
                                     filter_fields: Optional['ExportDbFields'] = None) -> bool:
         """Export the db profile metadata"""
-        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-        success = db.export.export_profiles_metadata(project_name=self.current_project,
-                                                     output_folder=self.outputs_folder,
-                                                     ogr_format=ogr_format,
-                                                     filter_fields=filter_fields)
-        db.disconnect()
+        with self.project_db() as db:
+            success = db.export.export_profiles_metadata(project_name=self.current_project,
+                                                         output_folder=self.outputs_folder,
+                                                         ogr_format=ogr_format,
+                                                         filter_fields=filter_fields)
         return success
 
     # --- filter
@@ -1777,7 +1847,9 @@ class SoundSpeedLibrary:
         self.cur.clone_proc_to_sis()
 
         if apply_thin:
-            if not self.cur.thin(tolerance=thin_tolerance):
+            # the thinning pass is shared by the calls with increasing tolerances (e.g., to fit a datagram)
+            significance = self.cur.proc_thin_significance(tolerance=thin_tolerance)
+            if not self.cur.thin(tolerance=thin_tolerance, significance=significance):
                 logger.warning("thinning issue")
                 return False
         else:
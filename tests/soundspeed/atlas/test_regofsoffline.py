@@ -1,11 +1,16 @@
 import unittest
 import os
 import shutil
+import tempfile
 import logging
 
+import numpy as np
+from netCDF4 import Dataset
+
 from hyo2.soundspeedmanager import AppInfo
 from hyo2.soundspeed.atlas.regofsoffline import RegOfsOffline
 from hyo2.soundspeed.soundspeed import SoundSpeedLibrary
+from hyo2.soundspeed.base.geodesy import Geodesy
 
 logger = logging.getLogger()
 
@@ -20,6 +25,68 @@ class TestSoundSpeedAtlasRegofsOffline(unittest.TestCase):
         _ = RegOfsOffline(data_folder=prj.regofs_folder, prj=prj)
         prj.close()
 
+    def test_query(self):
+        # a synthetic unstructured mesh with the FVCOM layout
+        data_folder = tempfile.mkdtemp()
+        nc_path = os.path.join(data_folder, "nos.cbofs.fields.n001.nc")
+        rng = np.random.default_rng(0)
+        nr_nodes, nr_layers = 2000, 5
+        lats = rng.uniform(36.0, 39.5, nr_nodes)
+        lons = rng.uniform(-77.5, -75.5, nr_nodes) + 360.0
+        with Dataset(nc_path, 'w') as ds:
+            ds.title = 'CBOFS'
+            ds.createDimension('time', 1)
+            ds.createDimension('node', nr_nodes)
+            ds.createDimension('siglay', nr_layers)
+            time = ds.createVariable('time', 'f4', ('time',))
+            time.units = 'days since 2020-01-01 00:00:00'
+            time[:] = 10.5
+            ds.createVariable('lat', 'f4', ('node',))[:] = lats
+            ds.createVariable('lon', 'f4', ('node',))[:] = lons
+            ds.createVariable('zeta', 'f4', ('time', 'node'))[:] = 0.5
+            ds.createVariable('h', 'f4', ('node',))[:] = np.linspace(5.0, 50.0, nr_nodes)
+            ds.createVariable('siglay', 'f4', ('siglay', 'node'))[:] = \
+                -np.tile((np.arange(nr_layers)[:, np.newaxis] + 0.5) / nr_layers, (1, nr_nodes))
+            ds.createVariable('temp', 'f4', ('time', 'siglay', 'node'))[:] = 10.0 + np.arange(nr_nodes) / nr_nodes
+            ds.createVariable('salinity', 'f4', ('time', 'siglay', 'node'))[:] = 30.0
+
+        try:
+            ofs = RegOfsOffline(data_folder=data_folder, prj=None)
+            g = Geodesy()
+            q_lats = [37.0, 37.01, 38.2, 39.4, 20.0]
+            q_lons = [-76.0, -76.02, -77.1, -75.6, -76.0]
+            results = ofs.query_many(nc_path=nc_path, lats=q_lats, lons=q_lons)
+            self.assertEqual(len(results), len(q_lats))
+            self.assertIsNone(results[-1])  # too far from the model nodes
+
+            node_lats = np.asarray(lats, dtype=np.float32).astype(np.float64)
+            node_lons = np.asarray(lons, dtype=np.float32).astype(np.float64) - 360.0
+            for lat, lon, profiles in zip(q_lats[:-1], q_lons[:-1], results[:-1]):
+                dists = np.asarray(g.distance(node_lons, node_lats, np.full(nr_nodes, lon), np.full(nr_nodes, lat)))
+                self.assertAlmostEqual(profiles.cur.meta.latitude, node_lats[dists.argmin()], places=5)
+                self.assertEqual(profiles.cur.data.temp[0], np.float32(10.0 + dists.argmin() / nr_nodes))
+                self.assertEqual(profiles.cur.data.num_samples, nr_layers)
+
+            single = ofs.query(nc_path=nc_path, lat=q_lats[0], lon=q_lons[0])
+            self.assertEqual(single.cur.meta.longitude, results[0].cur.meta.longitude)
+            self.assertEqual(len(ofs._trees), 1)
+
+            dists, idxs = ofs.nearest_nodes(nc_path=nc_path, lats=q_lats[:2], lons=q_lons[:2], k=3)
+            self.assertEqual(idxs.shape, (2, 3))
+            self.assertTrue((np.diff(dists, axis=1) >= 0.0).all())
+
+            # only the trees of the last files are kept
+            for i in range(2, 5):
+                other_path = os.path.join(data_folder, "nos.cbofs.fields.n%03d.nc" % i)
+                shutil.copyfile(nc_path, other_path)
+                self.assertIsNotNone(ofs.query(nc_path=other_path, lat=q_lats[0], lon=q_lons[0]))
+            self.assertEqual([key[0] for key in ofs._trees], [os.path.join(data_folder, "nos.cbofs.fields.n%03d.nc" % i)
+                                                              for i in (3, 4)])
+            ofs.clear_data()
+
+        finally:
+            shutil.rmtree(data_folder)
+
 
 def suite():
     s = unittest.TestSuite()
@@ -1,7 +1,11 @@
 import unittest
+from unittest import mock
 import os
 import shutil
 import logging
+from datetime import datetime
+
+import numpy as np
 
 from hyo2.soundspeedmanager import AppInfo
 from hyo2.soundspeed.atlas.rtofs import Rtofs
@@ -42,6 +46,21 @@ class TestSoundSpeedAtlasRtofs(unittest.TestCase):
 
         prj.close()
 
+    def test_query_many_failure(self):
+        rtofs = Rtofs(data_folder=self.cur_dir, prj=None)
+        dtstamp = datetime(2020, 5, 1)
+        data = [(np.array([0.0, 10.0]), np.array([20.0, 19.0]), np.array([35.0, 35.0]))]
+        side_effect = [data, RuntimeError('troubles in db download'), data]
+
+        # a failing query only drops its own result, and the profiles are only created when requested
+        with mock.patch.object(Rtofs, '_query_data', side_effect=side_effect), \
+                mock.patch.object(Rtofs, 'query') as query:
+            results = rtofs.query_many(lats=[43.0, 43.1, 43.2], lons=[-70.0, -70.0, -70.0], dtstamps=[dtstamp] * 3)
+        self.assertFalse(query.called)
+        self.assertEqual(results.found.tolist(), [True, False, True])
+        self.assertEqual(results[2].cur.data.temp.tolist(), [20.0, 19.0])
+        self.assertEqual(results[2].cur.meta.original_path, "RTOFS_20200501_000000")
+
 
 def suite():
     s = unittest.TestSuite()
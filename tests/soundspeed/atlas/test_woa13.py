@@ -0,0 +1,143 @@
+import unittest
+import os
+import shutil
+import tempfile
+import logging
+from unittest import mock
+from datetime import datetime
+
+import numpy as np
+from netCDF4 import Dataset
+
+from hyo2.soundspeed.atlas.woa13 import Woa13
+
+logger = logging.getLogger()
+
+
+class TestSoundSpeedAtlasWoa13(unittest.TestCase):
+
+    def setUp(self):
+        # a small synthetic grid with the WOA13 layout: land at the first five columns
+        self.data_folder = tempfile.mkdtemp()
+        lat = np.arange(30.5, 40.0, 1.0)
+        lon = np.arange(-79.5, -60.0, 1.0)
+        depth = np.array([0.0, 10.0, 50.0, 100.0, 200.0, 500.0])
+        nr_levels = np.tile(np.arange(lon.size) % depth.size + 1, (lat.size, 1))
+        nr_levels[:, :5] = 0
+        for kind in ['t', 's']:
+            os.makedirs(os.path.join(self.data_folder, "temp" if kind == 't' else "sal"))
+            for i in range(1, 17):
+                nc_path = os.path.join(self.data_folder, "temp" if kind == 't' else "sal",
+                                       "woa13_decav_%s%02d_04v2.nc" % (kind, i))
+                nz = 4 if i <= 12 else depth.size  # fewer monthly levels
+                ds = Dataset(nc_path, 'w')
+                ds.createDimension('time', 1)
+                ds.createDimension('depth', nz)
+                ds.createDimension('lat', lat.size)
+                ds.createDimension('lon', lon.size)
+                ds.createVariable('lat', 'f4', ('lat',))[:] = lat
+                ds.createVariable('lon', 'f4', ('lon',))[:] = lon
+                ds.createVariable('depth', 'f4', ('depth',))[:] = depth[:nz]
+                mask = np.arange(nz)[:, np.newaxis, np.newaxis] >= nr_levels
+                values = (20.0 if kind == 't' else 35.0) + lat[:, np.newaxis] / 10.0 + lon / 100.0 + i / 10.0 \
+                    - depth[:nz, np.newaxis, np.newaxis] / 100.0
+                ds.createVariable('%s_an' % kind, 'f4', ('time', 'depth', 'lat', 'lon'),
+                                  fill_value=9.96921E36)[0] = np.ma.masked_array(values, mask=mask)
+                ds.createVariable('%s_sd' % kind, 'f4', ('time', 'depth', 'lat', 'lon'),
+                                  fill_value=9.96921E36)[0] = np.ma.masked_array(np.full(values.shape, 0.5), mask=mask)
+                ds.close()
+
+        with open(os.path.join(self.data_folder, "landsea_04.msk"), "w") as fod:
+            fod.write("header\nheader\n")
+            landsea = (nr_levels == 0).astype(int)
+            landsea = np.hstack(np.hsplit(landsea, 2)[::-1])  # the mask starts at the Greenwich meridian
+            for value in landsea.ravel():
+                fod.write("0,0,%d\n" % value)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_folder)
+
+    def test_query(self):
+        woa = Woa13(data_folder=self.data_folder, prj=None)
+        mem_woa = Woa13(data_folder=self.data_folder, prj=None)
+        mem_woa.in_memory = True
+
+        for lat, lon in [(35.2, -70.1), (33.0, -78.2), (39.9, -60.1)]:
+            profiles = woa.query(lat=lat, lon=lon, dtstamp=datetime(2020, 5, 1))
+            mem_profiles = mem_woa.query(lat=lat, lon=lon, dtstamp=datetime(2020, 5, 1))
+            self.assertEqual(len(profiles.l), 3)
+            for ssp, mem_ssp in zip(profiles.l, mem_profiles.l):
+                self.assertTrue((ssp.data.temp == mem_ssp.data.temp).all())
+                self.assertTrue((ssp.data.sal == mem_ssp.data.sal).all())
+
+        # the last window wraps to the land columns, and reaches a node with all the levels
+        ssp = profiles.cur
+        self.assertEqual(ssp.data.num_samples, 6)
+        self.assertTrue((profiles.l[1].data.temp == ssp.data.temp - 0.5).all())
+        self.assertTrue(os.path.exists(os.path.join(self.data_folder, "temp", "woa13_decav_t05_04v2.t_an.npy")))
+
+        self.assertIsNone(woa.query(lat=35.0, lon=-77.5, dtstamp=datetime(2020, 5, 1)))
+
+        # batch query, across two months
+        lats = [35.2, 35.0, 33.0, 36.1]
+        lons = [-70.1, -77.5, -78.2, -65.3]
+        dtstamps = [datetime(2020, 5, 1), datetime(2020, 5, 1), datetime(2020, 12, 31, 10, 30), datetime(2020, 5, 2)]
+        results = mem_woa.query_many(lats=lats, lons=lons, dtstamps=dtstamps)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results.found.tolist(), [True, False, True, True])
+        for i, profiles in enumerate(results):
+            single = woa.query(lat=lats[i], lon=lons[i], dtstamp=dtstamps[i])
+            if single is None:
+                self.assertIsNone(profiles)
+                continue
+            self.assertEqual(len(profiles.l), len(single.l))
+            self.assertEqual(profiles.cur.meta.original_path, single.cur.meta.original_path)
+            for ssp, single_ssp in zip(profiles.l, single.l):
+                self.assertTrue((ssp.data.depth == single_ssp.data.depth).all())
+                self.assertTrue((ssp.data.speed == single_ssp.data.speed).all())
+
+        with self.assertRaises(RuntimeError):
+            woa.query_many(lats=lats, lons=lons[:2], dtstamps=dtstamps)
+
+        # the grid cache in another folder, and its purge
+        self.assertTrue(mem_woa.purge_cache())
+        self.assertFalse([name for name in os.listdir(os.path.join(self.data_folder, "temp")) if name.endswith(".npy")])
+        mem_woa.cache_folder = os.path.join(self.data_folder, "cache")
+        os.makedirs(mem_woa.cache_folder)
+        mem_profiles = mem_woa.query(lat=35.2, lon=-70.1, dtstamp=datetime(2020, 5, 1))
+        self.assertTrue((mem_profiles.cur.data.temp == woa.query(lat=35.2, lon=-70.1,
+                                                                 dtstamp=datetime(2020, 5, 1)).cur.data.temp).all())
+        self.assertEqual(len(os.listdir(mem_woa.cache_folder)), 8)
+        self.assertTrue(mem_woa.purge_cache())
+        self.assertEqual(os.listdir(mem_woa.cache_folder), [])
+
+        woa.clear_data()
+        mem_woa.clear_data()
+
+    def test_ocean_index(self):
+        woa = Woa13(data_folder=self.data_folder, prj=None)
+
+        # the nearest neighbour lookup matches a search on the axes
+        for lat, lon in [(35.2, -70.1), (35.0, -77.5), (30.0, -79.9), (41.3, -60.4)]:
+            self.assertEqual(woa.grid_coords(lat=lat, lon=lon),
+                             (np.abs(woa.lat - lat).argmin(), np.abs(woa.lon - lon).argmin()))
+
+        # the monthly grids have four levels
+        self.assertEqual(woa.get_depth(lat=35.2, lon=-70.1), 100.0)
+        self.assertEqual(woa.get_depth(lat=35.2, lon=-72.4), 10.0)
+        self.assertEqual(woa.get_depth(lat=35.0, lon=-77.5), 0.0)
+        self.assertTrue(os.path.exists(os.path.join(self.data_folder, "woa13_ocean_index.npz")))
+        woa.clear_data()
+
+        # the index is kept in memory when it cannot be stored
+        os.remove(os.path.join(self.data_folder, "woa13_ocean_index.npz"))
+        with mock.patch.object(np, 'savez', side_effect=OSError("read-only file system")):
+            self.assertEqual(woa.get_depth(lat=35.2, lon=-70.1), 100.0)
+        self.assertFalse(os.path.exists(os.path.join(self.data_folder, "woa13_ocean_index.npz")))
+        woa.clear_data()
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedAtlasWoa13))
+    return s
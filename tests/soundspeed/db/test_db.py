@@ -1,12 +1,18 @@
 import os
 import sys
+import time
+import sqlite3
+import threading
 import unittest
+from unittest import mock
 from datetime import datetime
 import numpy as np
 
 from hyo2.soundspeedmanager import AppInfo
 from hyo2.soundspeed.soundspeed import SoundSpeedLibrary
 from hyo2.soundspeed.profile.profilelist import ProfileList
+from hyo2.soundspeed.db.db import ProjectDb
+from hyo2.soundspeed.db.blob import unpack_array
 
 
 class TestSoundSpeedDb(unittest.TestCase):
@@ -39,9 +45,31 @@ class TestSoundSpeedDb(unittest.TestCase):
                 add_cast(20 + i, -75)
 
     def tearDown(self):
+        if hasattr(self, 'lib'):
+            self.lib.close_project_dbs()
         if os.path.exists(self.db_path):
             os.remove(self.db_path)
 
+    @staticmethod
+    def downgrade_to_version_3(db_path):
+        # back to the version 3 layout: a row per sample
+        conn = sqlite3.connect(db_path)
+        with conn:
+            for table in ProjectDb.samples_tables:
+                conn.execute("CREATE TABLE %s_v3(ssp_pk integer NOT NULL, pressure real, depth real NOT NULL, "
+                             "speed real, temperature real, conductivity real, salinity real, "
+                             "source int NOT NULL DEFAULT 0, flag int NOT NULL DEFAULT 0)" % table)
+                for row in conn.execute("SELECT * FROM %s" % table).fetchall():
+                    columns = [unpack_array(blob, dtype, row[1])
+                               for blob, (_, _, dtype) in zip(row[2:], ProjectDb.blob_columns)]
+                    conn.executemany("INSERT INTO %s_v3 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)" % table,
+                                     [[row[0]] + values for values in np.array(columns).T.tolist()])
+                conn.execute("DROP TABLE %s" % table)
+                conn.execute("ALTER TABLE %s_v3 RENAME TO %s" % (table, table))
+            conn.execute("DROP TABLE ssp_summary")
+            conn.execute("UPDATE library SET version=3")
+        conn.close()
+
     # @unittest.skipUnless(sys.platform.startswith("win"), "only works with GDAL < 2.0 on Windows")
     def test_save_load_cast(self):
         def test_pk(pk):
@@ -59,6 +87,177 @@ class TestSoundSpeedDb(unittest.TestCase):
             pk = i % self.max_pk + 1
             test_pk(pk)
 
+    def test_load_many_casts(self):
+        pks = list(range(self.max_pk, 0, -1))
+        ssps = self.lib.db_retrieve_profiles(pks)
+        self.assertEqual(len(ssps), self.max_pk)
+        for pk, ssp in zip(pks, ssps):
+            single = self.lib.db_retrieve_profile(pk)
+            self.assertEqual(ssp.cur.meta.latitude, single.cur.meta.latitude)
+            self.assertTrue((ssp.cur.proc.depth == single.cur.proc.depth).all())
+            self.assertTrue((ssp.cur.data.speed == single.cur.data.speed).all())
+
+        self.assertIsNone(self.lib.db_retrieve_profiles([1, self.max_pk + 1]))
+
+    def test_list_profiles(self):
+        lst = self.lib.db_list_profiles()
+        self.assertEqual(len(lst), self.max_pk)
+        for row in lst:
+            self.assertEqual(row[21], '%0.2f' % self.depth.min())
+            self.assertEqual(row[22], '%0.2f' % self.depth.max())
+            self.assertEqual(row[23], '%0.2f' % self.depth.max())
+
+    def test_shared_connection(self):
+        with self.lib.project_db() as db:
+            conn = db.conn
+            self.assertEqual(db.conn.execute("PRAGMA journal_mode").fetchone()[0], 'delete')
+        self.lib.db_list_profiles()
+        with self.lib.project_db() as db:
+            self.assertIs(db.conn, conn)
+
+        self.lib.close_project_dbs()
+        with self.lib.project_db() as db:
+            self.assertIsNot(db.conn, conn)
+
+        # a thread waiting for a db closed in the meantime gets a reopened one
+        used = list()
+
+        def list_profiles():
+            with self.lib.project_db() as waiting_db:
+                used.append(waiting_db)
+                waiting_db.list_profiles()
+
+        with self.lib.project_db() as db:
+            thread = threading.Thread(target=list_profiles)
+            thread.start()
+            time.sleep(0.1)
+            self.lib.close_project_dbs()
+            self.assertIsNone(db.conn)
+        thread.join()
+        self.assertIsNot(used[0], db)
+        self.assertIsNotNone(used[0].conn)
+
+        # write-ahead logging is opt-in, and removed when not requested
+        self.lib.close_project_dbs()
+        self.lib.project_dbs_wal = True
+        with self.lib.project_db() as db:
+            self.assertEqual(db.conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.lib.close_project_dbs()
+        db = ProjectDb(projects_folder=self.lib.projects_folder, project_name=self.lib.current_project)
+        self.assertEqual(db.conn.execute("PRAGMA journal_mode").fetchone()[0], 'delete')
+        db.disconnect()
+        self.assertFalse(os.path.exists(self.db_path + '-wal'))
+
+    def test_spatial_queries(self):
+        # the casts are at latitudes 20, 21, .., 24 (longitude -75)
+        lst = self.lib.db_profiles_in_bbox(min_lon=-76.0, min_lat=20.5, max_lon=-74.0, max_lat=22.5)
+        self.assertEqual([row[2].y for row in lst], [21.0, 22.0])
+        self.assertEqual(len(self.lib.db_profiles_in_bbox(min_lon=-74.0, min_lat=0.0, max_lon=0.0, max_lat=90.0)), 0)
+        self.assertEqual(len(self.lib.db_profiles_in_bbox(min_lon=170.0, min_lat=0.0, max_lon=-70.0, max_lat=90.0)),
+                         self.max_pk)
+        lst = self.lib.db_profiles_in_bbox(min_lon=-180.0, min_lat=-90.0, max_lon=180.0, max_lat=90.0,
+                                           end_time=datetime(2000, 1, 1))
+        self.assertEqual(len(lst), 0)
+
+        lst = self.lib.db_profiles_within_radius(longitude=-75.0, latitude=22.0, radius=120000.0)
+        self.assertEqual([row[2].y for row in lst], [22.0, 21.0, 23.0])
+        self.assertAlmostEqual(lst[0][3], 0.0)
+
+        lst = self.lib.db_nearest_profiles(longitude=-75.0, latitude=30.0, n=2)
+        self.assertEqual([row[2].y for row in lst], [24.0, 23.0])
+        self.assertEqual(len(self.lib.db_nearest_profiles(longitude=-75.0, latitude=30.0, max_radius=1000.0)), 0)
+
+        self.lib.delete_db_profile(pk=lst[0][0])
+        lst = self.lib.db_nearest_profiles(longitude=-75.0, latitude=30.0)
+        self.assertEqual(lst[0][2].y, 23.0)
+
+    def test_import_from_db(self):
+        # the input project has two of the current casts, and a new one
+        in_project = 'unittest_input'
+        in_db_path = os.path.join(self.lib.projects_folder, '%s.db' % in_project)
+        ssps = self.lib.db_retrieve_profiles([2, 4])
+        ssps[1].cur.meta.utc_time = datetime(2020, 1, 1)
+        with self.lib.project_db(project=in_project) as db:
+            for ssp in ssps + [self.lib.db_retrieve_profile(3)]:
+                db.add_casts(ssp)
+        self.lib.close_project_dbs(project=in_project)
+
+        def check_import():
+            with open(in_db_path, 'rb') as fid:
+                content = fid.read()
+            pk_issues, pk_done = self.lib.db_import_data_from_db(in_db_path)
+            self.assertEqual(pk_issues, [1, 3])
+            self.assertEqual(pk_done, [2])
+
+            lst = self.lib.db_profiles_in_bbox(min_lon=-180.0, min_lat=-90.0, max_lon=180.0, max_lat=90.0,
+                                               end_time=datetime(2020, 1, 1))
+            self.assertEqual(len(lst), 1)
+            ssp = self.lib.db_retrieve_profile(lst[0][0])
+            self.assertEqual(ssp.cur.meta.latitude, ssps[1].cur.meta.latitude)
+            self.assertTrue((ssp.cur.data.depth == self.depth).all())
+            self.assertTrue((ssp.cur.proc.speed == ssps[1].cur.proc.speed).all())
+            self.assertEqual(len(self.lib.db_list_profiles()), self.max_pk + 1)
+
+            # the input db is only read
+            with open(in_db_path, 'rb') as fid:
+                self.assertEqual(fid.read(), content)
+
+        try:
+            check_import()
+
+            # an input db at an older version is merged without being updated
+            self.lib.delete_db_profile(pk=self.max_pk + 1)
+            self.downgrade_to_version_3(in_db_path)
+            check_import()
+            self.assertEqual(ProjectDb.read_db_version(in_db_path), 3)
+
+        finally:
+            os.remove(in_db_path)
+
+        # an input db that cannot be opened
+        progress = mock.Mock()
+        with self.lib.project_db() as db:
+            self.assertIsNone(db.merge_db(input_db_path=os.path.join(in_db_path, 'missing.db'), progress=progress))
+            self.assertEqual(len(db.list_profiles()), self.max_pk + 1)
+        progress.end.assert_called_once_with()
+
+    def test_interrupted_update(self):
+        ssps = self.lib.db_retrieve_profiles(list(range(1, self.max_pk + 1)))
+        self.lib.close_project_dbs()
+
+        self.downgrade_to_version_3(self.db_path)
+        conn = sqlite3.connect(self.db_path)
+
+        # the update is interrupted while converting the second table
+        insert_blobs = ProjectDb._insert_blobs
+        calls = list()
+
+        def interrupted(db, **kwargs):
+            calls.append(kwargs['table'])
+            if kwargs['table'] == ProjectDb.samples_tables[1]:
+                raise RuntimeError("interrupted")
+            insert_blobs(db, **kwargs)
+
+        with mock.patch.object(ProjectDb, '_insert_blobs', autospec=True, side_effect=interrupted):
+            with self.assertRaises(RuntimeError):
+                ProjectDb(projects_folder=self.lib.projects_folder, project_name=self.lib.current_project)
+        self.assertEqual(calls.count(ProjectDb.samples_tables[0]), self.max_pk)
+
+        # .. and rolled back
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        self.assertFalse([table for table in tables if table.endswith('_rows')])
+        self.assertEqual(conn.execute("SELECT version FROM library").fetchone()[0], 3)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM data").fetchone()[0], self.max_pk * self.levels)
+        conn.close()
+
+        for pk, ssp in enumerate(ssps, start=1):
+            updated = self.lib.db_retrieve_profile(pk)
+            self.assertTrue((updated.cur.data.depth == ssp.cur.data.depth).all())
+            self.assertTrue((updated.cur.proc.speed == ssp.cur.proc.speed).all())
+            self.assertTrue((updated.cur.sis.flag == ssp.cur.sis.flag).all())
+        with self.lib.project_db() as db:
+            self.assertEqual(db.conn.execute("SELECT version FROM library").fetchone()[0], 4)
+
 
 def suite():
     s = unittest.TestSuite()
@@ -62,6 +62,60 @@ class TestSoundSpeedOceanography(unittest.TestCase):
 
         self.assertAlmostEqual(calc_vs, trusted_fof_vs, places=1)
 
+    def test_speed_batch(self):
+        d = np.array([0.0, 10.0, 250.0, 1000.0, 9712.653])
+        t = np.array([25.0, 20.5, 12.0, 4.0, 20.0])
+        s = np.array([0.0, 33.5, 34.8, 34.9, 35.0])
+        lat = 30.0
+
+        calc_vs = Oc.speed(d=d, t=t, s=s, lat=lat)
+        self.assertEqual(calc_vs.shape, d.shape)
+        for i in range(d.size):
+            self.assertEqual(calc_vs[i], Oc.speed(d=d[i], t=t[i], s=s[i], lat=lat))
+
+        calc_vs_32 = Oc.speed(d=d, t=t, s=s, lat=lat, dtype=np.float32)
+        self.assertEqual(calc_vs_32.dtype, np.float32)
+        self.assertLess(np.abs(calc_vs_32 - calc_vs).max(), 0.01)
+
+    def test_speed_scalar_formula(self):
+        # the per-sample formula on NumPy scalars, as used before the batched calculation
+        def poly(coeffs, x):
+            value = coeffs[0]
+            for i, coeff in enumerate(coeffs[1:], start=1):
+                value = value + coeff * (x ** i if i > 1 else x)
+            return value
+
+        def scalar_speed(d, t, s, lat):
+            sl = np.sin(lat / 57.29578)
+            g = 9.7803 * (1 + 5.3e-3 * (sl * sl))
+            h45 = 1.00818e-2 * d + 2.465e-8 * d ** 2 - 1.25e-13 * d ** 3 + 2.8e-19 * d ** 4
+            p = 100.0 * (h45 * ((g - 2e-5 * d) / (9.80612 - 2e-5 * d))) / 10
+            c = [[1402.388, 5.03830, -5.81090e-2, 3.3432e-4, -1.47797e-6, 3.1419e-9],
+                 [0.153563, 6.8999e-4, -8.1829e-6, 1.3632e-7, -6.1260e-10],
+                 [3.1260e-5, -1.7111e-6, 2.5986e-8, -2.5353e-10, 1.0415e-12],
+                 [-9.7729e-9, 3.8513e-10, -2.3654e-12]]
+            a = [[1.389, -1.262e-2, 7.166e-5, 2.008e-6, -3.21e-8],
+                 [9.4742e-5, -1.2583e-5, -6.4928e-8, 1.0515e-8, -2.0142e-10],
+                 [-3.9064e-7, 9.1061e-9, -1.6009e-10, 7.994e-12],
+                 [1.100e-10, 6.651e-12, -3.391e-13]]
+            cwtp = poly(c[0], t) + poly(c[1], t) * p + poly(c[2], t) * p ** 2 + poly(c[3], t) * p ** 3
+            atp = poly(a[0], t) + poly(a[1], t) * p + poly(a[2], t) * p ** 2 + poly(a[3], t) * p ** 3
+            btp = -1.922e-2 + -4.42e-5 * t + (7.3637e-5 + 1.7950e-7 * t) * p
+            dtp = 1.727e-3 + (-7.9836e-6 * p)
+            return cwtp + atp * s + btp * s ** 1.5 + dtp * s ** 2
+
+        rng = np.random.default_rng(0)
+        d = rng.uniform(0.0, 12000.0, 5000)
+        t = rng.uniform(-2.0, 40.0, 5000)
+        s = rng.uniform(0.0, 42.0, 5000)
+        s[0] = -1.0  # invalid salinity
+        lat = 43.1
+
+        calc_vs = Oc.speed(d=d, t=t, s=s, lat=lat)
+        self.assertTrue(np.isnan(calc_vs[0]))
+        for i in range(1, d.size):
+            self.assertEqual(calc_vs[i], scalar_speed(d=d[i], t=t[i], s=s[i], lat=lat))
+
     def test_sal(self):
         # check values from Fofonoff and Millard(1983)
         trusted_fof_d = 9712.653  # m
@@ -76,6 +130,36 @@ class TestSoundSpeedOceanography(unittest.TestCase):
 
         self.assertAlmostEqual(calc_s, trusted_fof_s, places=1)
 
+    def test_sal_newton(self):
+        d = np.array([0.0, 10.0, 250.0, 1000.0, 9712.653])
+        t = np.array([25.0, 20.5, 12.0, 4.0, 20.0])
+        s = np.array([0.0, 33.5, 34.8, 34.9, 35.0])
+        lat = 30.0
+        vs = Oc.speed(d=d, t=t, s=s, lat=lat)
+
+        calc_s, converged = Oc.sal_newton(d=d, speed=vs, t=t, lat=lat)
+        self.assertTrue(converged.all())
+        for i in range(d.size):
+            self.assertAlmostEqual(calc_s[i], s[i], places=2)
+            self.assertAlmostEqual(calc_s[i], Oc.sal(d=d[i], speed=vs[i], t=t[i], lat=lat), places=2)
+
+        # unreachable sound speed
+        _, converged = Oc.sal_newton(d=10.0, speed=1200.0, t=10.0, lat=lat)
+        self.assertFalse(converged[0])
+
+    def test_attenuation_batch(self):
+        f = np.array([12.0, 100.0, 400.0])
+        d = np.array([0.0, 10.0, 250.0, 1000.0])
+        t = np.array([25.0, 20.5, 12.0, 4.0])
+        s = np.array([33.0, 33.5, 34.8, 34.9])
+
+        atten = Oc.attenuation(f=f[:, np.newaxis], t=t, s=s, d=d, ph=8.1)
+        self.assertEqual(atten.shape, (f.size, d.size))
+        for i in range(f.size):
+            for j in range(d.size):
+                self.assertAlmostEqual(atten[i, j], Oc.a(f=f[i], t=t[j], s=s[j], d=d[j], ph=8.1), places=12)
+        self.assertTrue((np.diff(atten, axis=0) > 0.0).all())
+
     def test_atg(self):
         # check values from Fofonoff and Millard(1983)
         atg_ck = 3.255976e-4
@@ -102,6 +186,16 @@ class TestSoundSpeedOceanography(unittest.TestCase):
 
         self.assertAlmostEqual(t0_calc, t0_ck, places=1)
 
+        # a batch returns the values of the single calls, without changing the passed arrays
+        s = np.array([40.0, 35.0, 34.5, 35.0])
+        theta = np.array([36.89073, 10.0, 2.5, 20.0])
+        p = np.array([10000.0, 500.0, 4000.0, 0.0])
+        t0_calc = Oc.in_situ_temp(s=s, t=theta, p=p, pr=p_ref_ck)
+        for i in range(s.size):
+            self.assertEqual(t0_calc[i], Oc.in_situ_temp(s=s[i], t=theta[i], p=p[i], pr=p_ref_ck))
+        self.assertEqual(t0_calc[-1], theta[-1])
+        self.assertEqual(p.tolist(), [10000.0, 500.0, 4000.0, 0.0])
+
     def test_cr2s(self):
         cr_ck = 1.1
         t_ck = 40.0
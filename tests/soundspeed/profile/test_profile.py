@@ -0,0 +1,179 @@
+import unittest
+from unittest import mock
+import numpy as np
+
+from hyo2.soundspeed.profile.profile import Profile
+from hyo2.soundspeed.profile.dicts import Dicts
+
+
+class TestSoundSpeedProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.nr_samples = 200
+        self.depth = np.linspace(1.0, 100.0, self.nr_samples)
+        self.speed = 1500.0 + 0.05 * self.depth + 0.1 * np.sin(self.depth)
+
+    def tearDown(self):
+        pass
+
+    def test_statistical_filter(self):
+        prof = Profile()
+        prof.init_proc(self.nr_samples)
+        prof.proc.depth[:] = self.depth
+        prof.proc.speed[:] = self.speed
+        prof.proc.speed[50] += 10.0  # flier
+
+        prof.statistical_filter()
+        filtered = np.nonzero(prof.proc.flag == Dicts.flags['filtered'])[0]
+        self.assertEqual(filtered.tolist(), [50])
+
+        mask = Profile.statistical_filter_mask(speed=prof.proc.speed, depth=prof.proc.depth,
+                                               window_size=7, nr_std_dev=3)
+        self.assertEqual(np.nonzero(mask)[0].tolist(), [50])
+
+        with self.assertRaises(RuntimeError):
+            Profile.statistical_filter_mask(speed=prof.proc.speed, depth=prof.proc.depth, window_size=4)
+        with self.assertRaises(RuntimeError):  # a single neighbor for the endpoints
+            Profile.statistical_filter_mask(speed=prof.proc.speed, depth=prof.proc.depth, window_size=3)
+
+    def test_cosine_smooth(self):
+        prof = Profile()
+        prof.init_proc(self.nr_samples)
+        prof.proc.depth[:] = self.depth
+        prof.proc.speed[:] = self.speed
+
+        prof.cosine_smooth()
+        smoothed = prof.proc.source == Dicts.sources['smoothing']
+        self.assertEqual(prof.proc.num_samples, self.nr_samples + np.count_nonzero(smoothed))
+        self.assertTrue((prof.proc.flag[smoothed] == Dicts.flags['valid']).all())
+        self.assertTrue((prof.proc.flag[~smoothed] == Dicts.flags['smoothed']).all())
+        self.assertTrue((np.diff(prof.proc.depth) >= 0.0).all())
+        self.assertLess(np.abs(np.interp(prof.proc.depth[smoothed], self.depth, self.speed)
+                               - prof.proc.speed[smoothed]).max(), 0.1)
+
+    def test_thin(self):
+        tolerances = [0.001, 0.01, 0.05]
+        curve_tolerances, counts = None, None
+        for i, tolerance in enumerate(tolerances):
+            prof = Profile()
+            prof.init_sis(self.nr_samples)
+            prof.sis.depth[:] = self.depth
+            prof.sis.speed[:] = self.speed
+
+            if curve_tolerances is None:
+                curve_tolerances, counts = prof.thin_curve(tolerances)
+
+            self.assertTrue(prof.thin(tolerance=tolerance))
+            thinned = np.nonzero(prof.sis_thinned)[0]
+            self.assertEqual(thinned[0], 0)
+            self.assertEqual(thinned[-1], self.nr_samples - 1)
+            self.assertEqual(thinned.size, counts[i])
+
+        self.assertTrue((np.diff(counts) <= 0).all())
+
+        # a single thinning pass for increasing tolerances, as in the preparation of a cast for SIS
+        prof = Profile()
+        prof.init_proc(self.nr_samples)
+        prof.proc.depth[:] = self.depth
+        prof.proc.speed[:] = self.speed
+        with mock.patch.object(Profile, 'douglas_peucker_1d', wraps=Profile.douglas_peucker_1d) as dp:
+            for i, tolerance in enumerate(tolerances):
+                prof.clone_proc_to_sis()
+                self.assertTrue(prof.thin(tolerance=tolerance, significance=prof.proc_thin_significance(tolerance)))
+                self.assertEqual(np.count_nonzero(prof.sis_thinned), counts[i])
+        self.assertEqual(dp.call_count, 1)
+
+    def test_reduce_up_down(self):
+        depth = np.concatenate([self.depth, self.depth[::-1], self.depth, self.depth[::-1]])
+
+        prof = Profile()
+        prof.init_data(depth.size)
+        prof.data.depth[:] = depth
+        prof.reduce_up_down(Dicts.ssp_directions['down'])
+        self.assertTrue((prof.data.depth[prof.data_valid] == self.depth).all())
+
+        self.assertEqual(Profile.turning_points(depth).tolist(), [0, 200, 400, 600, 799])
+        for ssp_direction in [Dicts.ssp_directions['down'], Dicts.ssp_directions['up']]:
+            for cast_nr in [0, 1]:
+                prof = Profile()
+                prof.init_data(depth.size)
+                prof.data.depth[:] = depth
+                prof.reduce_up_down(ssp_direction, cast_nr=cast_nr)
+                self.assertTrue((prof.data.depth[prof.data_valid] == self.depth).all())
+
+        with self.assertRaises(RuntimeError):
+            prof.reduce_up_down(Dicts.ssp_directions['down'], cast_nr=2)
+
+    def test_cached_masks(self):
+        prof = Profile()
+        prof.init_proc(self.nr_samples)
+        prof.proc.depth[:] = self.depth
+        prof.proc.speed[:] = self.speed
+
+        valid = prof.proc_valid
+        self.assertIs(prof.proc_valid, valid)
+        self.assertFalse(valid.flags.writeable)
+        self.assertEqual(prof.proc_depth_max, self.depth.max())
+
+        # in-place changes, also through views, invalidate the cache
+        prof.proc.flag[-1] = Dicts.flags['filtered']
+        self.assertEqual(np.count_nonzero(prof.proc_valid), self.nr_samples - 1)
+        self.assertEqual(prof.proc_depth_max, self.depth[-2])
+        flags = prof.proc.flag[:10]
+        flags += Dicts.flags['filtered']
+        self.assertEqual(prof.nr_valid_proc_samples, self.nr_samples - 11)
+
+        # as well as the assignments
+        prof.proc.flag = np.zeros(self.nr_samples)
+        self.assertEqual(prof.nr_valid_proc_samples, self.nr_samples)
+
+    def test_samples_buffer(self):
+        prof = Profile()
+        prof.init_proc(self.nr_samples)
+        prof.proc.depth[:] = self.depth
+        prof.proc.speed[:] = self.speed
+        depth = prof.proc.depth
+
+        # the fields are views of the same buffer, growing by doubling
+        prof.proc.append(depth=101.0, speed=1505.0)
+        self.assertEqual(prof.proc.num_samples, self.nr_samples + 1)
+        self.assertGreaterEqual(prof.proc.capacity, 2 * self.nr_samples)
+        self.assertEqual(prof.proc.depth[-1], 101.0)
+        self.assertEqual(prof.proc.flag[-1], 0.0)
+
+        prof.proc.insert(1, depth=1.2, speed=1501.0)
+        self.assertEqual(prof.proc.depth[:3].tolist(), [self.depth[0], 1.2, self.depth[1]])
+        self.assertEqual(prof.proc.speed[-1], 1505.0)
+        self.assertTrue((depth[:self.nr_samples] == self.depth).all())  # views taken before a growth keep the old data
+
+        prof.proc.resize(2)
+        self.assertEqual(prof.proc.depth.tolist(), [self.depth[0], 1.2])
+        prof.proc.resize(3)
+        self.assertEqual(prof.proc.speed[-1], 0.0)
+
+        with self.assertRaises(RuntimeError):
+            prof.proc.insert(0, density=1.0)
+        with self.assertRaises(RuntimeError):
+            prof.proc.insert(10, depth=1.0)
+
+    def test_more_fields(self):
+        fields = ['Depth', 'Density', 'Status']
+        prof = Profile()
+        prof.init_data(self.nr_samples)
+        prof.init_more(fields)
+        self.assertEqual(prof.more.sa.shape, (self.nr_samples, ))
+        self.assertEqual(prof.more.sa.nbytes, self.nr_samples * len(fields) * 4)
+
+        prof.more.sa[0] = (1.0, 1025.0, 2.0)
+        prof.more.sa['Depth'][1:] = self.depth[1:]
+        prof.data_resize(self.nr_samples + 10)
+        self.assertEqual(prof.more.sa['Density'][0], 1025.0)
+        self.assertEqual(prof.more.sa['Depth'][-1], 0.0)
+        prof.data_resize(2)
+        self.assertEqual(prof.more.sa['Depth'].tolist(), [1.0, np.float32(self.depth[1])])
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedProfile))
+    return s
@@ -0,0 +1,95 @@
+import unittest
+import numpy as np
+from datetime import datetime
+
+from hyo2.soundspeed.profile.profile import Profile
+from hyo2.soundspeed.profile.ray_tracing.diff_tracedprofiles import DiffTracedProfiles
+from hyo2.soundspeed.profile.ray_tracing.ray_tracing import RayTracing
+from hyo2.soundspeed.profile.ray_tracing.tracedprofile import TracedProfile
+
+
+class TestSoundSpeedRayTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.depths = np.linspace(0.5, 500.0, 250)
+        self.speeds = 1500.0 - 0.02 * self.depths + 0.5 * np.sin(self.depths / 20.0)
+        self.speeds[100:110] = self.speeds[100]  # zero-gradient layers
+
+    def tearDown(self):
+        pass
+
+    def test_layer_parameters(self):
+        for angle in [0.0, 10.0, 45.0, 70.0]:
+            fast = RayTracing.get_svp_layer_parameters_fast(np.deg2rad(angle), self.depths, self.speeds)
+            slow = RayTracing.get_svp_layer_parameters_slow(np.deg2rad(angle), self.depths, self.speeds)
+            for fast_param, slow_param in zip(fast, slow):
+                self.assertTrue(np.allclose(fast_param, slow_param, rtol=1e-9, atol=1e-9, equal_nan=True))
+
+        angles = np.deg2rad([0.0, 10.0, 45.0])
+        params = RayTracing.get_svp_layer_parameters_fast(angles, self.depths, self.speeds)
+        self.assertEqual(params[1].shape, (angles.size, self.depths.size))
+
+    def test_ray_trace(self):
+        for angle in [0.0, 10.0, 45.0, 70.0]:
+            params = RayTracing.get_svp_layer_parameters(np.deg2rad(angle), self.depths, self.speeds)
+            travel_times = np.arange(0.005, 2.0 * params[3][-1], 0.005)
+            for b_project in [False, True]:
+                fast = RayTracing.ray_trace_fast(travel_times, self.depths, self.speeds, params, b_project=b_project)
+                slow = RayTracing.ray_trace_slow(travel_times, self.depths, self.speeds, params, b_project=b_project)
+                self.assertTrue(np.allclose(fast, slow, rtol=1e-12, atol=1e-9))
+
+    def test_traced_profile(self):
+        ssp = Profile()
+        ssp.init_proc(self.depths.size)
+        ssp.proc.depth[:] = self.depths
+        ssp.proc.speed[:] = self.speeds
+        ssp.meta.utc_time = datetime.utcnow()
+
+        tp = TracedProfile(ssp, half_swath=70, max_depth=600.0, resolution=0.5)
+        self.assertEqual(len(tp.rays), 71)
+        self.assertEqual(tp.total_t.shape, (71, self.depths.size))
+        self.assertEqual(len(tp.harmonic_means), 71)
+
+        nadir = tp.rays[0]
+        self.assertEqual(nadir.shape, (3, 1201))
+        self.assertIs(tp.rays[0], nadir)
+        valid = ~np.isnan(nadir[0])
+        self.assertTrue(np.allclose(nadir[1][valid], 0.0, atol=1e-6))
+        self.assertAlmostEqual(np.nanmax(nadir[0]), tp.total_t[0, -1], places=6)
+
+        linear_tp = TracedProfile(ssp, half_swath=70, max_depth=600.0, resolution=0.5, interp_kind='linear')
+        self.assertLess(np.nanmax(np.abs(linear_tp.rays[45] - tp.rays[45])), 0.01)
+
+        with self.assertRaises(RuntimeError):
+            TracedProfile(ssp, interp_kind='nearest')
+
+    def test_diff_traced_profiles(self):
+        def make_tp(depths, speeds):
+            ssp = Profile()
+            ssp.init_proc(depths.size)
+            ssp.proc.depth[:] = depths
+            ssp.proc.speed[:] = speeds
+            ssp.meta.utc_time = datetime.utcnow()
+            return TracedProfile(ssp, half_swath=70, max_depth=600.0, resolution=0.5)
+
+        tp = make_tp(self.depths, self.speeds)
+        diff = DiffTracedProfiles(old_tp=tp, new_tp=make_tp(self.depths, self.speeds))
+        diffs = diff.calc_diff()
+        self.assertEqual(diffs.shape[0], 71)
+        self.assertEqual(diffs.shape[2], 3)
+        self.assertEqual(len(diff.new_rays), 71)
+        self.assertLess(np.nanmax(np.abs(diffs[:, :, 1:])), 1e-6)
+
+        # no common samples: all the angles are still present
+        shallow_tp = make_tp(np.linspace(0.5, 100.0, 50), np.full(50, 1500.0))
+        deep_tp = make_tp(np.linspace(200.0, 500.0, 50), np.full(50, 1500.0))
+        diff = DiffTracedProfiles(old_tp=shallow_tp, new_tp=deep_tp)
+        self.assertEqual(diff.calc_diff().shape, (71, 0, 3))
+        self.assertEqual(len(diff.new_rays), 71)
+        self.assertEqual(len(diff.old_rays), 71)
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedRayTracing))
+    return s